@@ -3,13 +3,23 @@
 """Bulk saving objects for performance
 """
 
+import itertools
 import logging
-from typing import Any, Dict, Optional
+import multiprocessing
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
 
-from .db import DB
+import sqlalchemy
+from sqlalchemy import Column, MetaData, Table, inspect
+
+from .db import DB, DBType
 from .decorators import log_time
+from .errors import AIException
 from .iterutil import split_every
 from .models import (
+    DBID,
     Issue,
     IssueInstance,
     IssueInstanceFixInfo,
@@ -17,8 +27,10 @@ from .models import (
     IssueInstanceTraceFrameAssoc,
     PrimaryKeyGenerator,
     SharedText,
+    ShortestTrace,
     TraceFrame,
     TraceFrameAnnotation,
+    TraceFrameAnnotationText,
     TraceFrameLeafAssoc,
 )
 
@@ -32,6 +44,7 @@ class BulkSaver:
     # order is significant, objects will be saved in this order.
     SAVING_CLASSES_ORDER = [
         SharedText,
+        TraceFrameAnnotationText,
         Issue,
         IssueInstanceFixInfo,
         IssueInstance,
@@ -40,6 +53,7 @@ class BulkSaver:
         IssueInstanceTraceFrameAssoc,
         TraceFrameAnnotation,
         TraceFrameLeafAssoc,
+        ShortestTrace,
     ]
 
     BATCH_SIZE = 30000
@@ -66,7 +80,13 @@ class BulkSaver:
     def get_items_to_add(self, cls):
         return self.saving[cls.__name__]
 
-    def save_all(self, database: DB, use_lock=False, dbname=""):
+    def save_all(self, database: DB, use_lock=False, dbname="", parallel=False):
+        """Saves all added items. With parallel=True (SQLite only), every table
+        is written by its own process into a staging file and then merged into
+        the database in a single transaction. This is possible because primary
+        keys are reserved up front, so the tables don't depend on each other
+        at write time.
+        """
         saving_classes = [
             cls
             for cls in self.SAVING_CLASSES_ORDER
@@ -79,9 +99,13 @@ class BulkSaver:
 
         with database.make_session() as session:
             pk_gen = self.primary_key_generator.reserve(
-                session, saving_classes, item_counts
+                session, saving_classes, item_counts, use_lock=use_lock
             )
 
+        if parallel and database.dbtype == DBType.SQLITE:
+            self._save_parallel(database, saving_classes, pk_gen)
+            return
+
         for cls in saving_classes:
             log.info("Saving %s...", cls.__name__)
             self._save(database, cls, pk_gen)
@@ -105,6 +129,110 @@ class BulkSaver:
                 session.bulk_insert_mappings(cls, group, render_nulls=True)
                 session.commit()
 
+    @log_time
+    def _save_parallel(
+        self, database: DB, saving_classes, pk_gen: PrimaryKeyGenerator
+    ) -> None:
+        staging_dir = tempfile.mkdtemp(
+            prefix="sapp_staging_",
+            dir=os.path.dirname(os.path.abspath(database.dbname)),
+        )
+        try:
+            # Items have to be prepared in SAVING_CLASSES_ORDER, since merging
+            # resolves ids that later classes refer to. Each writer is started
+            # as soon as its rows are ready, so it overlaps with preparing the
+            # next table. Forking hands the rows over without pickling them.
+            context = multiprocessing.get_context("fork")
+            writers = []
+            for cls in saving_classes:
+                log.info("Preparing %s...", cls.__name__)
+                writer = context.Process(
+                    target=_write_staging_table,
+                    args=(
+                        self._staging_path(staging_dir, cls),
+                        cls.__table__,
+                        self._prepare_rows(database, cls, pk_gen),
+                    ),
+                    name=f"sapp-save-{cls.__name__}",
+                )
+                writer.start()
+                writers.append(writer)
+
+            for writer in writers:
+                writer.join()
+                if writer.exitcode != 0:
+                    raise AIException(
+                        f"{writer.name} failed with exit code {writer.exitcode}"
+                    )
+
+            self._merge_staging_tables(database, staging_dir, saving_classes)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _prepare_rows(
+        self, database: DB, cls, pk_gen: PrimaryKeyGenerator
+    ) -> List[Dict[str, Any]]:
+        """Runs cls.prepare and turns the items into plain rows keyed by column
+        name, with all ids resolved."""
+        column_names = {
+            attr.key: attr.columns[0].name for attr in inspect(cls).column_attrs
+        }
+        with database.make_session() as session:
+            rows = [
+                {
+                    column_names[key]: (
+                        value.resolved() if isinstance(value, DBID) else value
+                    )
+                    for key, value in item.items()
+                    if key in column_names
+                }
+                for item in cls.prepare(
+                    session, pk_gen, consume(self.saving[cls.__name__])
+                )
+            ]
+        # See _save() for why rows are sorted by their keys.
+        rows.sort(key=lambda row: list(row.keys()))
+        return rows
+
+    @log_time
+    def _merge_staging_tables(
+        self, database: DB, staging_dir: str, saving_classes
+    ) -> None:
+        quote = database.engine.dialect.identifier_preparer.quote
+        with database.engine.connect() as connection:
+            # SQLite refuses to attach databases inside a transaction.
+            attached = []
+            try:
+                for index, cls in enumerate(saving_classes):
+                    schema = f"staging_{index}"
+                    connection.execute(
+                        f"ATTACH DATABASE ? AS {schema}",
+                        (self._staging_path(staging_dir, cls),),
+                    )
+                    attached.append((schema, cls))
+
+                with connection.begin():
+                    for schema, cls in attached:
+                        log.info("Merging %s...", cls.__name__)
+                        table = quote(cls.__tablename__)
+                        columns = ", ".join(
+                            quote(column.name) for column in cls.__table__.columns
+                        )
+                        # The target is left unqualified: SQLite resolves it to
+                        # main, or to the attached run of a partitioned
+                        # database, never to the later attached staging files.
+                        connection.execute(
+                            f"INSERT INTO {table} ({columns}) "
+                            f"SELECT {columns} FROM {schema}.{table}"
+                        )
+            finally:
+                for schema, _cls in attached:
+                    connection.execute(f"DETACH DATABASE {schema}")
+
+    @staticmethod
+    def _staging_path(staging_dir: str, cls) -> str:
+        return os.path.join(staging_dir, f"{cls.__tablename__}.db")
+
     def add_trace_frame_leaf_assoc(self, message, trace_frame, depth):
         self.add(
             TraceFrameLeafAssoc.Record(
@@ -133,6 +261,37 @@ class BulkSaver:
         return stat_str
 
 
+def _write_staging_table(path: str, table: Table, rows: List[Dict[str, Any]]) -> None:
+    """Writes rows into a copy of table in a standalone SQLite file. The copy
+    keeps column types and defaults, but drops keys and indexes, which are
+    only needed on the final table."""
+    engine = sqlalchemy.create_engine(
+        sqlalchemy.engine.url.URL("sqlite", database=path)
+    )
+    engine.execute("PRAGMA journal_mode = OFF")
+    engine.execute("PRAGMA synchronous = OFF")
+
+    staging_table = Table(
+        table.name, MetaData(), *[_staging_column(column) for column in table.columns]
+    )
+    staging_table.create(engine)
+    with engine.begin() as connection:
+        for _keys, group in itertools.groupby(rows, key=lambda row: list(row.keys())):
+            for batch in split_every(BulkSaver.BATCH_SIZE, group):
+                connection.execute(staging_table.insert(), batch)
+
+
+def _staging_column(column: Column) -> Column:
+    column = column.copy()
+    column.primary_key = False
+    column.index = False
+    column.unique = False
+    return column
+
+
 def consume(lst):
+    """Yields and removes the items of lst in the order they were added, so
+    that new ids follow that order."""
+    lst.reverse()
     while len(lst) > 0:
         yield lst.pop()
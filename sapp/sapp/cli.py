@@ -1,16 +1,57 @@
 import logging
+import os
 
 import click
 
 from .cli_lib import commands, common_options
 from .context import Context
 from .db import DB, DBType
-from .lint import lint
+from .diff import diff
+from .export import export, import_
+from .lint import lint, lint_daemon
+from .prune import prune
 from .pysa_taint_parser import Parser
+from .server import serve
+from .stats import stats_command
+from .warning_code_stats import rollup_command
 
 
 logger = logging.getLogger("sapp")
 
+# Commands that only read the database. They open it read-only, so that they
+# don't wait for runs being saved.
+READ_ONLY_COMMANDS = {
+    "diff",
+    "explore",
+    "export",
+    "lint",
+    "lint-daemon",
+    "serve",
+    "stats",
+}
+
+
+def _open_database(
+    database_engine: DBType, database_name: str, partitioned: bool, command: str
+) -> DB:
+    if (
+        command in READ_ONLY_COMMANDS
+        and database_engine == DBType.SQLITE
+        and os.path.exists(database_name)
+    ):
+        database = DB(
+            database_engine, database_name, read_only=True, partitioned=partitioned
+        )
+        if not (database.needs_setup() or database.pending_rebuilds()):
+            return database
+        database.engine.dispose()
+    return DB(
+        database_engine,
+        database_name,
+        partitioned=partitioned,
+        allow_pending_rebuilds=command == "migrate",
+    )
+
 
 @common_options
 @click.option(
@@ -20,13 +61,24 @@ logger = logging.getLogger("sapp")
     default=DBType.SQLITE,
     help="database engine to use",
 )
+@click.option(
+    "--partitioned",
+    is_flag=True,
+    help="store the data of each run in its own file (SQLite only)",
+)
 @click.pass_context
 def cli(
-    ctx: click.Context, repository: str, database_name: str, database_engine: DBType
+    ctx: click.Context,
+    repository: str,
+    database_name: str,
+    database_engine: DBType,
+    partitioned: bool,
 ):
     ctx.obj = Context(
         repository=repository,
-        database=DB(database_engine, database_name, assertions=True),
+        database=_open_database(
+            database_engine, database_name, partitioned, ctx.invoked_subcommand
+        ),
         parser_class=Parser,
     )
     logger.debug(f"Context: {ctx.obj}")
@@ -34,7 +86,15 @@ def cli(
 
 for command in commands:
     cli.add_command(command)
+cli.add_command(diff)
+cli.add_command(export)
+cli.add_command(import_)
 cli.add_command(lint)
+cli.add_command(lint_daemon)
+cli.add_command(prune)
+cli.add_command(rollup_command)
+cli.add_command(serve)
+cli.add_command(stats_command)
 
 if __name__ == "__main__":
     cli()
@@ -11,16 +11,19 @@ import IPython
 from click import Parameter, Path, argument, option
 from traitlets.config import Config
 
+from . import migrations
 from .analysis_output import AnalysisOutput
 from .context import Context, pass_context
 from .database_saver import DatabaseSaver
 from .db import DB
 from .extensions import prompt_extension
 from .filesystem import find_root
+from .ingest import IngestionCoordinator
 from .interactive import Interactive
 from .model_generator import ModelGenerator
 from .models import PrimaryKeyGenerator
 from .pipeline import Pipeline
+from .snapshot import snapshot
 from .trim_trace_graph import TrimTraceGraph
 
 
@@ -88,8 +91,20 @@ def default_database(ctx: click.Context, _param: Parameter, value: Optional[str]
 
 @click.command(help="interactive exploration of issues")
 @pass_context
-def explore(ctx: Context):
-    scope_vars = Interactive(ctx.database, ctx.repository).setup()
+@option(
+    "--in-memory",
+    is_flag=True,
+    help="copy the database into memory first (SQLite only)",
+)
+@option("--run-id", type=int, help="with --in-memory, only copy this run")
+def explore(ctx: Context, in_memory: bool, run_id: Optional[int]):
+    database = ctx.database
+    if in_memory:
+        database = snapshot(database, run_id, progress=_print_copy_progress)
+        click.echo(err=True)
+    elif run_id is not None:
+        raise click.UsageError("--run-id requires --in-memory")
+    scope_vars = Interactive(database, ctx.repository).setup()
     config = Config()
     config.InteractiveShellApp.extensions = [
         prompt_extension.__name__
@@ -102,6 +117,12 @@ def explore(ctx: Context):
     IPython.start_ipython(argv=[], user_ns=scope_vars, config=config)
 
 
+def _print_copy_progress(done: int, total: int) -> None:
+    click.echo(
+        f"\rCopying into memory: {100 * done // max(total, 1)}%", nl=False, err=True
+    )
+
+
 @click.command(help="parse static analysis output and save to disk")
 @pass_context
 @option("--run-kind", type=str)
@@ -132,6 +153,16 @@ def explore(ctx: Context):
     is_flag=True,
     help="store pre/post conditions unrelated to an issue",
 )
+@option(
+    "--parallel-save",
+    is_flag=True,
+    help="write tables from parallel processes (SQLite only)",
+)
+@option(
+    "--verify-summary",
+    is_flag=True,
+    help="check the run summary against the saved issue instances",
+)
 @argument("input_file", type=Path(exists=True))
 def analyze(
     ctx: Context,
@@ -144,6 +175,8 @@ def analyze(
     previous_input,
     linemap,
     store_unused_models,
+    parallel_save,
+    verify_summary,
     input_file,
 ):
     # Store all options in the right places
@@ -173,10 +206,85 @@ def analyze(
         ctx.parser_class(),
         ModelGenerator(),
         TrimTraceGraph(),
-        DatabaseSaver(ctx.database, PrimaryKeyGenerator()),
+        DatabaseSaver(
+            ctx.database,
+            primary_key_generator=PrimaryKeyGenerator(),
+            parallel_save=parallel_save,
+            verify_summary=verify_summary,
+        ),
     ]
     pipeline = Pipeline(pipeline_steps)
     pipeline.run(input_files, summary_blob)
 
 
-commands = [analyze, explore]
+@click.command(help="save the outputs of several analyses as separate runs")
+@pass_context
+@option("--run-kind", type=str)
+@option("--branch", type=str)
+@option("--commit-hash", type=str)
+@option(
+    "--store-unused-models",
+    is_flag=True,
+    help="store pre/post conditions unrelated to an issue",
+)
+@option(
+    "--parallel-save",
+    is_flag=True,
+    help="write tables from parallel processes (SQLite only)",
+)
+@option("--jobs", "-j", type=int, help="number of outputs to parse at once")
+@argument("input_files", type=Path(exists=True), nargs=-1, required=True)
+def ingest(
+    ctx: Context,
+    run_kind,
+    branch,
+    commit_hash,
+    store_unused_models,
+    parallel_save,
+    jobs,
+    input_files,
+):
+    summary_blob = {
+        "run_kind": run_kind,
+        "repository": ctx.repository,
+        "branch": branch,
+        "commit_hash": commit_hash,
+        "job_id": None,
+        "old_linemap_file": None,
+        "store_unused_models": store_unused_models,
+    }
+    coordinator = IngestionCoordinator(
+        ctx.database,
+        ctx.parser_class,
+        summary_blob,
+        processes=jobs,
+        parallel_save=parallel_save,
+    )
+    coordinator.ingest(list(input_files))
+
+
+@click.command(help="apply pending database migrations, including slow ones")
+@pass_context
+@option("--dry-run", is_flag=True, help="only list the pending migrations")
+def migrate(ctx: Context, dry_run: bool):
+    database = ctx.database
+    if dry_run:
+        names = [migration.name for migration in migrations.pending(database.engine)]
+        for name in migrations.pending_run_file_migrations(database.run_files()):
+            if name not in names:
+                names.append(name)
+        for name in names:
+            click.echo(name)
+        return
+
+    with database.write_lock():
+        applied = migrations.migrate(database.engine, include_optional=True)
+        for name in migrations.migrate_run_files(database.engine, database.run_files()):
+            if name not in applied:
+                applied.append(name)
+    click.echo(f"Applied {len(applied)} migrations")
+    for name in applied:
+        click.echo(f"  {name}")
+
+
+commands = [analyze, explore, ingest, migrate]
@@ -3,22 +3,26 @@
 import logging
 from typing import Optional, Tuple
 
+from . import name_index
 from .bulk_saver import BulkSaver
 from .db import DB
 from .decorators import log_time
 from .models import (
     Issue,
+    IssueInstance,
     IssueInstanceSharedTextAssoc,
     PrimaryKeyGenerator,
     Run,
     RunStatus,
     RunSummary,
+    ShortestTrace,
     TraceFrame,
     TraceFrameAnnotation,
     TraceKind,
 )
 from .pipeline import PipelineStep, Summary
 from .trace_graph import TraceGraph
+from .warning_code_stats import RunStatsCollector
 
 
 log = logging.getLogger("sapp")
@@ -27,13 +31,20 @@ log = logging.getLogger("sapp")
 class DatabaseSaver(PipelineStep[TraceGraph, RunSummary]):
     RUN_MODEL = Run
 
+    # The parts of the summary that save() uses
+    SAVED_SUMMARY_KEYS = ["run", "missing_preconditions", "missing_postconditions"]
+
     def __init__(
         self,
         database: DB,
         use_lock: bool = False,
         primary_key_generator: Optional[PrimaryKeyGenerator] = None,
+        parallel_save: bool = False,
+        verify_summary: bool = False,
     ):
         self.use_lock = use_lock
+        self.parallel_save = parallel_save
+        self.verify_summary = verify_summary
         self.dbname = database.dbname
         self.database = database
         self.primary_key_generator = primary_key_generator or PrimaryKeyGenerator()
@@ -42,11 +53,25 @@ class DatabaseSaver(PipelineStep[TraceGraph, RunSummary]):
 
     @log_time
     def run(self, input: TraceGraph, summary: Summary) -> Tuple[RunSummary, Summary]:
-        self.graph = input
-        self.summary = summary
+        self.prepare(input, summary)
+        return self.save(self.bulk_saver, self.summary), self.summary
 
+    def prepare(self, graph: TraceGraph, summary: Summary) -> BulkSaver:
+        """Fills the bulk saver from the trace graph. This doesn't touch the
+        database, so it can happen in another process than saving."""
+        self.graph = graph
+        self.summary = summary
         self._prep_save()
-        return self._save(), self.summary
+        return self.bulk_saver
+
+    def save(self, bulk_saver: BulkSaver, summary: Summary) -> RunSummary:
+        """Saves a prepared run. Processes saving into the same database take
+        turns."""
+        self.bulk_saver = bulk_saver
+        bulk_saver.primary_key_generator = self.primary_key_generator
+        self.summary = summary
+        with self.database.write_lock():
+            return self._save()
 
     def _prep_save(self):
         """ Prepares the bulk saver to load the trace graph info into the
@@ -54,6 +79,7 @@ class DatabaseSaver(PipelineStep[TraceGraph, RunSummary]):
         """
         log.info("Preparing bulk save.")
         self.graph.update_bulk_saver(self.bulk_saver)
+        self._add_shortest_traces()
 
         log.info(
             "Dropped %d unused preconditions, %d are missing",
@@ -68,6 +94,22 @@ class DatabaseSaver(PipelineStep[TraceGraph, RunSummary]):
         )
         del self.summary["postcondition_entries"]
 
+    @log_time
+    def _add_shortest_traces(self) -> None:
+        """Saves the trace shown first for each issue instance, so exploring it
+        doesn't have to search the trace frames again."""
+        for instance in self.graph.get_issue_instances():
+            for kind in [TraceKind.POSTCONDITION, TraceKind.PRECONDITION]:
+                trace_frames, branches = self.graph.get_shortest_trace(instance, kind)
+                self.bulk_saver.add(
+                    ShortestTrace.Record(
+                        issue_instance_id=instance.id,
+                        kind=kind,
+                        trace_frame_ids=[frame.id for frame in trace_frames],
+                        branches=branches,
+                    )
+                )
+
     def _save(self) -> RunSummary:
         """ Saves bulk saver's info into the databases in bulk.
         """
@@ -105,16 +147,35 @@ class DatabaseSaver(PipelineStep[TraceGraph, RunSummary]):
             run_id = self.summary["run"].id.resolved()
             self.summary["run"] = None  # Invalidate it
 
-        self.bulk_saver.save_all(self.database, self.use_lock)
+        self.database.attach_run(run_id, create=True)
+
+        # Saving consumes the items. The stats also give the run summary, so
+        # the issue instances don't need to be counted again after saving.
+        names = name_index.names(
+            self.bulk_saver.get_items_to_add(Issue),
+            self.bulk_saver.get_items_to_add(IssueInstance),
+            trace_frames,
+        )
+        run_stats = RunStatsCollector(
+            self.bulk_saver.get_items_to_add(Issue),
+            self.bulk_saver.get_items_to_add(IssueInstance),
+        )
+        self.bulk_saver.save_all(
+            self.database, self.use_lock, parallel=self.parallel_save
+        )
+        name_index.add_run(self.database.engine, run_id, names)
 
         # Now that the run is finished, fetch it from the DB again and set its
         # status to FINISHED.
         with self.database.make_session() as session:
+            stats = run_stats.add(session, run_id)
             run = session.query(self.RUN_MODEL).filter_by(id=run_id).one()
             run.status = RunStatus.FINISHED
             session.add(run)
             session.commit()
-            run_summary = run.get_summary()
+            run_summary = run.get_summary_from_stats(stats)
+            if self.verify_summary:
+                run_summary = self._verify_summary(run_summary, run.get_summary())
 
         run_summary.num_invisible_issues = 0
         run_summary.num_missing_preconditions = len(
@@ -125,3 +186,22 @@ class DatabaseSaver(PipelineStep[TraceGraph, RunSummary]):
         )
 
         return run_summary
+
+    def _verify_summary(
+        self, run_summary: RunSummary, saved_summary: RunSummary
+    ) -> RunSummary:
+        """Checks the summary against the one counted from the saved issue
+        instances. On a mismatch the saved counts win."""
+        mismatched = [
+            key
+            for key in ["num_new_issues", "num_total_issues", "alarm_counts"]
+            if getattr(run_summary, key) != getattr(saved_summary, key)
+        ]
+        for key in mismatched:
+            log.error(
+                "Run summary %s is %s, but %s was saved",
+                key,
+                getattr(run_summary, key),
+                getattr(saved_summary, key),
+            )
+        return saved_summary if mismatched else run_summary
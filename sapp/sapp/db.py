@@ -3,16 +3,21 @@
 This file defines the underlying db used by SAPP library.
 """
 
+import fcntl
 import logging
+import os
+import re
 from contextlib import contextmanager
-from typing import Iterator
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import quote
 
 import sqlalchemy
+from sqlalchemy import event, inspect
 from sqlalchemy.exc import OperationalError
-from sqlalchemy.orm import Session, scoped_session, sessionmaker
-from sqlalchemy.pool import AssertionPool
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AssertionPool, QueuePool, SingletonThreadPool
 
-from . import errors, models
+from . import errors, migrations, models, name_index
 from .decorators import retryable
 
 
@@ -26,47 +31,258 @@ class DBType(sqlalchemy.Enum):
 
 
 class DB(object):
-    """Interact with the database type requested"""
+    """Interact with the database type requested
+
+    A partitioned SQLite database keeps the shared catalog (runs, issues,
+    shared texts, ...) in the main file. The run-scoped tables
+    (models.RUN_SCOPED_TABLES) of each run are kept in their own file under
+    runs_directory. The file of the selected run (see attach_run) is attached
+    to every connection as "run". Since the main file doesn't have these
+    tables, unqualified table names resolve to it, and queries only ever see
+    the selected run. Dropping a run is just deleting its file.
+    """
 
     """File-based DB when using SQLITE"""
     DEFAULT_DB_FILE = "sapp.db"
 
+    """Connections kept open for file-based DBs. SQLite connections are cheap,
+    but reusing them keeps the page cache warm between sessions."""
+    SQLITE_POOL_SIZE = 5
+
     def __init__(
-        self, dbtype, dbname=None, debug=False, read_only=False, assertions=False
+        self,
+        dbtype,
+        dbname=None,
+        debug=False,
+        read_only=False,
+        assertions=False,
+        immutable=False,
+        partitioned=False,
+        allow_pending_rebuilds=False,
     ):
+        """read_only opens SQLite files with mode=ro, and doesn't create or
+        migrate anything. immutable additionally tells SQLite that the file
+        can't change, which skips all locking. Only use it when nothing else
+        writes to the file while it is open.
+
+        partitioned creates a partitioned database. Existing ones are
+        recognized by their runs_directory.
+
+        Migrations that rebuild whole tables only run from `sapp migrate`.
+        While one is pending, opening the database for writing fails unless
+        allow_pending_rebuilds is set.
+        """
         self.dbtype = dbtype
         self.dbname = dbname or self.DEFAULT_DB_FILE
         self.debug = debug
         self.read_only = read_only
+        self.immutable = read_only and immutable
         self.assertions = assertions
-
-        self.poolclass = assertions and AssertionPool or None
+        self.runs_directory = os.path.splitext(self.dbname)[0] + ".runs"
+        self.partitioned = dbtype == DBType.SQLITE and (
+            partitioned or os.path.isdir(self.runs_directory)
+        )
+        self.attached_run_id: Optional[int] = None
+        if partitioned and not self.partitioned:
+            raise errors.AIException("Only SQLite files can be partitioned")
 
         if dbtype == DBType.MEMORY:
+            # Every connection to :memory: is a separate database, so all
+            # sessions have to share one.
             self.engine = sqlalchemy.create_engine(
                 sqlalchemy.engine.url.URL("sqlite", database=":memory:"),
                 echo=debug,
-                poolclass=self.poolclass,
+                poolclass=assertions and AssertionPool or SingletonThreadPool,
             )
         elif dbtype == DBType.SQLITE:
-            self.engine = sqlalchemy.create_engine(
-                sqlalchemy.engine.url.URL("sqlite", database=self.dbname),
-                echo=debug,
-                poolclass=self.poolclass,
-            )
+            self.engine = self._create_sqlite_engine()
         elif dbtype == DBType.XDB:
             self._create_xdb_engine()
         else:
             raise errors.AIException("Invalid db type: " + dbtype)
 
+        # A session factory is cheap to call but not to build, so build it once.
+        self._sessionmaker = sessionmaker(bind=self.engine)
+
+        if self.partitioned:
+            event.listen(self.engine, "checkout", self._attach_selected_run)
+
+        if read_only:
+            return
+
+        if self.partitioned:
+            os.makedirs(self.runs_directory, exist_ok=True)
+
+        # Checking without the lock first keeps processes opening a database
+        # that is set up already from waiting for runs being saved
+        if self.needs_setup():
+            # Processes opening a new database at once would race to create it
+            with self.write_lock():
+                if self.needs_setup():
+                    self._set_up()
+
+        if not allow_pending_rebuilds:
+            pending = self.pending_rebuilds()
+            if pending:
+                raise errors.AIException(
+                    f"{self.dbname} can't be written to before it is migrated "
+                    f"({', '.join(pending)}). Run `sapp migrate` to migrate "
+                    "it, which rewrites whole tables and can take a long time "
+                    "on a large database."
+                )
+
+    def needs_setup(self) -> bool:
+        """Whether tables have to be created or migrations applied before the
+        database can be used. Only reads the schema."""
+        if self.partitioned and not os.path.isdir(self.runs_directory):
+            return True
+        tables = [
+            table
+            for table in models.Base.metadata.sorted_tables
+            if not (self.partitioned and table in models.RUN_SCOPED_TABLES)
+        ]
+        with self.engine.connect() as connection:
+            existing = set(inspect(connection).get_table_names())
+            if any(table.name not in existing for table in tables):
+                return True
+            if not name_index.exists(connection) and name_index.is_supported(
+                connection
+            ):
+                return True
+        return bool(migrations.pending(self.engine, include_optional=False))
+
+    def pending_rebuilds(self) -> List[str]:
+        return migrations.pending_rebuilds(self.engine, self.run_files())
+
+    def _set_up(self) -> None:
+        if self.dbtype == DBType.SQLITE:
+            # Only takes effect while the file is still empty. It lets
+            # `sapp prune` return space to the file system without a full
+            # VACUUM.
+            self.engine.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
         try:
-            models.create(self.engine)
+            models.create(self.engine, partitioned=self.partitioned)
         except sqlalchemy.exc.NoSuchTableError:
             pass
+        name_index.create(self.engine)
+
+        migrations.migrate(self.engine)
+
+    def _create_sqlite_engine(self):
+        if self.assertions:
+            pool_args = {"poolclass": AssertionPool}
+        else:
+            pool_args = {
+                "poolclass": QueuePool,
+                "pool_size": self.SQLITE_POOL_SIZE,
+                "max_overflow": 10,
+            }
+
+        if not self.read_only:
+            return sqlalchemy.create_engine(
+                sqlalchemy.engine.url.URL("sqlite", database=self.dbname),
+                echo=self.debug,
+                # Pooled connections may be checked out by any thread
+                connect_args={"check_same_thread": False},
+                **pool_args,
+            )
+
+        query = {"mode": "ro", "uri": "true"}
+        if self.immutable:
+            query["immutable"] = "1"
+        # Not PRAGMA query_only, which would also keep diff and export from
+        # creating temporary tables
+        return sqlalchemy.create_engine(
+            sqlalchemy.engine.url.URL(
+                "sqlite", database=f"file:{quote(self.dbname)}", query=query
+            ),
+            echo=self.debug,
+            connect_args={"check_same_thread": False},
+            **pool_args,
+        )
+
+    def run_file(self, run_id: int) -> str:
+        return os.path.join(self.runs_directory, f"run_{run_id}.db")
+
+    def run_files(self) -> Dict[int, str]:
+        """The data files of all runs of a partitioned database."""
+        if not self.partitioned:
+            return {}
+        files = {}
+        for name in os.listdir(self.runs_directory):
+            match = re.fullmatch(r"run_(\d+)\.db", name)
+            if match:
+                files[int(match.group(1))] = os.path.join(self.runs_directory, name)
+        return files
+
+    def attach_run(self, run_id: Optional[int], create: bool = False) -> None:
+        """Selects the run whose tables sessions made from now on will see.
+        Does nothing unless the database is partitioned."""
+        if not self.partitioned:
+            return
+        if run_id is not None:
+            path = self.run_file(run_id)
+            if create and not os.path.exists(path):
+                engine = sqlalchemy.create_engine(
+                    sqlalchemy.engine.url.URL("sqlite", database=path)
+                )
+                models.create_run_scoped(engine)
+                engine.dispose()
+            elif not os.path.exists(path):
+                raise errors.AIException(
+                    f"Data file of run {run_id} is missing: {path}"
+                )
+        self.attached_run_id = run_id
+
+    def drop_run(self, run_id: int) -> None:
+        """Deletes the data file of a run of a partitioned database."""
+        if self.attached_run_id == run_id:
+            self.attached_run_id = None
+        # Pooled connections may still have the file attached
+        self.engine.dispose()
+        path = self.run_file(run_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _attach_selected_run(
+        self, dbapi_connection, connection_record, connection_proxy
+    ) -> None:
+        attached_run_id = connection_record.info.get("attached_run_id")
+        if attached_run_id == self.attached_run_id:
+            return
+        if attached_run_id is not None:
+            dbapi_connection.execute("DETACH DATABASE run")
+        if self.attached_run_id is not None:
+            path = self.run_file(self.attached_run_id)
+            if self.read_only:
+                path = f"file:{quote(path)}?mode=ro"
+            dbapi_connection.execute("ATTACH DATABASE ? AS run", (path,))
+        connection_record.info["attached_run_id"] = self.attached_run_id
 
     def _create_xdb_engine(self):
         raise NotImplementedError
 
+    @contextmanager
+    def write_lock(self) -> Iterator[None]:
+        """Held while a run is written, so that processes saving runs into
+        the same SQLite file take turns instead of racing for primary keys
+        and SQLite's write lock. It is a lock on a file next to the database,
+        and released when the process exits."""
+        if self.dbtype != DBType.SQLITE:
+            yield
+            return
+        with open(self.dbname + ".lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                log.info("Waiting for another process writing to %s", self.dbname)
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
     @contextmanager
     def make_session(self, *args, **kwargs) -> Iterator[Session]:
         session = self.make_session_object(*args, **kwargs)
@@ -77,11 +293,10 @@ class DB(object):
 
     @retryable(num_tries=2, retryable_exs=[OperationalError])
     def make_session_object(self, *args, **kwargs):
-        # use scoped_session so sessionmaker generates the same session in
-        # different threads. This is useful for UTs.
-        session = scoped_session(sessionmaker(bind=self.engine))(*args, **kwargs)
-        ping_db(session)
+        session = self._sessionmaker(*args, **kwargs)
         if self.dbtype == DBType.XDB:
+            # Local SQLite connections don't go stale, remote ones do.
+            ping_db(session)
             # Make sure SQL doesn't quit on us after 10s. Sometimes merging data takes
             # longer.
             session.execute("SET SESSION wait_timeout = %d" % 30)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Comparing the issues of two runs inside the database.
+
+The issues of each run are collected into indexed temporary tables. New,
+fixed and persisting issue instances are then set differences and
+intersections over issue_id, so neither run is loaded into Python.
+
+Issues that only moved within their file have new handles. Given a linemap,
+the one that `sapp analyze --linemap` takes, new instances are joined through
+it against the instances of the first run at the mapped lines, like
+BaseParser._is_existing_issue does for handles.
+"""
+
+import enum
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+import click
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    and_,
+    case,
+    func,
+    literal,
+    select,
+    type_coerce,
+    union_all,
+)
+from sqlalchemy.engine import Connection
+
+from .db import DB
+from .errors import AIException
+from .models import BIGDBIDType, Issue, IssueInstance, Run, SourceLocation
+
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Maps, per file, a line of the second run to the lines it was on in the
+# first run. Lines are strings, as in the JSON file.
+LineMap = Dict[str, Dict[str, List[int]]]
+
+
+class DiffStatus(enum.Enum):
+    new = enum.auto()
+    # New handle, but at a mapped line of an instance of the first run
+    moved = enum.auto()
+    fixed = enum.auto()
+    persisting = enum.auto()
+
+
+class DiffEntry(NamedTuple):
+    status: DiffStatus
+    code: int
+    filename: str
+    location: SourceLocation
+    callable: str
+    handle: str
+    issue_instance_id: int
+
+
+def _temporary_table(name: str, *columns) -> Table:
+    return Table(name, MetaData(), *columns, prefixes=["TEMPORARY"])
+
+
+def _line(instances: Table):
+    # Locations are packed with the line number in the upper 32 bits
+    return type_coerce(instances.c.location, BigInteger).op(">>")(32)
+
+
+class RunDiff:
+    """The difference between run_a and run_b. Only usable within
+    diff_runs(), which owns the connection and its temporary tables."""
+
+    def __init__(
+        self,
+        connection: Connection,
+        run_a: int,
+        run_b: int,
+        instances_a: Table,
+        instances_b: Table,
+    ) -> None:
+        self.connection = connection
+        self.run_a = run_a
+        self.run_b = run_b
+        self.instances_a = instances_a
+        self.instances_b = instances_b
+        self.issues_a = _temporary_table(
+            "tmp_diff_issues_a", Column("issue_id", BIGDBIDType, primary_key=True)
+        )
+        self.issues_b = _temporary_table(
+            "tmp_diff_issues_b", Column("issue_id", BIGDBIDType, primary_key=True)
+        )
+        self.moved = _temporary_table(
+            "tmp_diff_moved",
+            Column("new_id", BIGDBIDType, primary_key=True),
+            Column("old_id", BIGDBIDType, nullable=False, index=True),
+        )
+        self.tables = [self.issues_a, self.issues_b, self.moved]
+
+    def create(self) -> None:
+        for table in self.tables:
+            table.drop(self.connection, checkfirst=True)
+            table.create(self.connection)
+        for issues, instances, run_id in [
+            (self.issues_a, self.instances_a, self.run_a),
+            (self.issues_b, self.instances_b, self.run_b),
+        ]:
+            self.connection.execute(
+                issues.insert().from_select(
+                    ["issue_id"],
+                    select([instances.c.issue_id])
+                    .where(instances.c.run_id == run_id)
+                    .distinct(),
+                )
+            )
+
+    def drop(self) -> None:
+        for table in self.tables:
+            table.drop(self.connection, checkfirst=True)
+
+    def find_moved(
+        self, linemap: LineMap, batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> None:
+        """Marks new instances of run_b that are at a line the linemap maps
+        to the line of an instance of run_a with the same code and file."""
+        lines = _temporary_table(
+            "tmp_diff_linemap",
+            Column("filename", String(length=767), nullable=False),
+            Column("new_line", Integer, nullable=False),
+            Column("old_line", Integer, nullable=False),
+        )
+        old_locations = _temporary_table(
+            "tmp_diff_old_locations",
+            Column("id", BIGDBIDType, primary_key=True),
+            Column("filename", String(length=767), nullable=False),
+            Column("line", Integer, nullable=False),
+            Column("code", Integer, nullable=False),
+            Index("ix_tmp_diff_old_locations", "filename", "line", "code"),
+        )
+        for table in [lines, old_locations]:
+            table.drop(self.connection, checkfirst=True)
+            table.create(self.connection)
+        try:
+            rows = (
+                {"filename": filename, "new_line": int(new_line), "old_line": old}
+                for filename, file_lines in linemap.items()
+                for new_line, old_lines in file_lines.items()
+                for old in old_lines
+            )
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == batch_size:
+                    self.connection.execute(lines.insert(), batch)
+                    batch = []
+            if batch:
+                self.connection.execute(lines.insert(), batch)
+            Index("ix_tmp_diff_linemap", lines.c.filename, lines.c.new_line).create(
+                self.connection
+            )
+
+            a, b = self.instances_a, self.instances_b
+            issues = Issue.__table__
+            self.connection.execute(
+                old_locations.insert().from_select(
+                    ["id", "filename", "line", "code"],
+                    select([a.c.id, a.c.filename, _line(a), issues.c.code])
+                    .select_from(a.join(issues, issues.c.id == a.c.issue_id))
+                    .where(a.c.run_id == self.run_a),
+                )
+            )
+            # An instance that moved onto several old ones keeps the first
+            old_id = (
+                select([old_locations.c.id])
+                .where(
+                    and_(
+                        old_locations.c.filename == b.c.filename,
+                        old_locations.c.line == lines.c.old_line,
+                        old_locations.c.code == issues.c.code,
+                    )
+                )
+                .order_by(old_locations.c.id)
+                .limit(1)
+                .as_scalar()
+            )
+            self.connection.execute(
+                self.moved.insert()
+                .prefix_with("OR IGNORE", dialect="sqlite")
+                .from_select(
+                    ["new_id", "old_id"],
+                    select([b.c.id, old_id])
+                    .select_from(
+                        b.join(issues, issues.c.id == b.c.issue_id).join(
+                            lines,
+                            and_(
+                                lines.c.filename == b.c.filename,
+                                lines.c.new_line == _line(b),
+                            ),
+                        )
+                    )
+                    .where(b.c.run_id == self.run_b)
+                    .where(b.c.issue_id.notin_(select([self.issues_a.c.issue_id])))
+                    .where(old_id.isnot(None)),
+                )
+            )
+        finally:
+            for table in [lines, old_locations]:
+                table.drop(self.connection)
+
+    def _query(self, statuses: Sequence[DiffStatus]):
+        a, b = self.instances_a, self.instances_b
+        issues = Issue.__table__
+        columns = [
+            issues.c.code,
+            issues.c.callable,
+            issues.c.handle,
+        ]
+        status_b = case(
+            [
+                (
+                    b.c.issue_id.in_(select([self.issues_a.c.issue_id])),
+                    DiffStatus.persisting.name,
+                ),
+                (
+                    b.c.id.in_(select([self.moved.c.new_id])),
+                    DiffStatus.moved.name,
+                ),
+            ],
+            else_=DiffStatus.new.name,
+        )
+        selects = []
+        if set(statuses) - {DiffStatus.fixed}:
+            selects.append(
+                select(
+                    [
+                        status_b.label("status"),
+                        b.c.filename,
+                        b.c.location,
+                        b.c.id.label("issue_instance_id"),
+                    ]
+                    + columns
+                )
+                .select_from(b.join(issues, issues.c.id == b.c.issue_id))
+                .where(b.c.run_id == self.run_b)
+            )
+        if DiffStatus.fixed in statuses:
+            selects.append(
+                select(
+                    [
+                        literal(DiffStatus.fixed.name).label("status"),
+                        a.c.filename,
+                        a.c.location,
+                        a.c.id.label("issue_instance_id"),
+                    ]
+                    + columns
+                )
+                .select_from(a.join(issues, issues.c.id == a.c.issue_id))
+                .where(a.c.run_id == self.run_a)
+                .where(a.c.issue_id.notin_(select([self.issues_b.c.issue_id])))
+                .where(a.c.id.notin_(select([self.moved.c.old_id])))
+            )
+        diff = union_all(*selects).alias("diff")
+        return diff, diff.c.status.in_([status.name for status in statuses])
+
+    def counts(self) -> Dict[DiffStatus, int]:
+        diff, _ = self._query(list(DiffStatus))
+        counts = {status: 0 for status in DiffStatus}
+        for status, count in self.connection.execute(
+            select([diff.c.status, func.count()]).group_by(diff.c.status)
+        ):
+            counts[DiffStatus[status]] = count
+        return counts
+
+    def entries(self, statuses: Sequence[DiffStatus]) -> Iterator[DiffEntry]:
+        """Streams the instances with the given statuses, grouped by code and
+        file, in the order of their locations."""
+        diff, in_statuses = self._query(statuses)
+        for row in self.connection.execute(
+            select([diff])
+            .where(in_statuses)
+            .order_by(diff.c.code, diff.c.filename, diff.c.location, diff.c.status)
+        ):
+            yield DiffEntry(
+                status=DiffStatus[row.status],
+                code=row.code,
+                filename=row.filename,
+                location=row.location,
+                callable=row.callable,
+                handle=row.handle,
+                issue_instance_id=int(row.issue_instance_id),
+            )
+
+
+@contextmanager
+def diff_runs(
+    database: DB, run_a: int, run_b: int, linemap: Optional[LineMap] = None
+) -> Iterator[RunDiff]:
+    """Compares run_b against the earlier run_a."""
+    with database.make_session() as session:
+        existing = {
+            int(run_id)
+            for run_id, in session.query(Run.id).filter(Run.id.in_([run_a, run_b]))
+        }
+    for run_id in [run_a, run_b]:
+        if run_id not in existing:
+            raise AIException(f"Run {run_id} does not exist")
+        if database.partitioned and not os.path.exists(database.run_file(run_id)):
+            raise AIException(f"Data file of run {run_id} is missing")
+
+    instances = IssueInstance.__table__
+    # Temporary tables only exist on this connection
+    with database.engine.connect() as connection:
+        schemas = []
+        if database.partitioned:
+            # Each run's instances are in its own data file
+            schemas = ["diff_run_a", "diff_run_b"]
+            instances_a, instances_b = (
+                instances.tometadata(MetaData(), schema=schema) for schema in schemas
+            )
+        else:
+            instances_a = instances.alias("a")
+            instances_b = instances.alias("b")
+        diff = RunDiff(connection, run_a, run_b, instances_a, instances_b)
+        attached = []
+        try:
+            for schema, run_id in zip(schemas, [run_a, run_b]):
+                connection.execute(
+                    f"ATTACH DATABASE ? AS {schema}", (database.run_file(run_id),)
+                )
+                attached.append(schema)
+            diff.create()
+            if linemap:
+                diff.find_moved(linemap)
+            yield diff
+        finally:
+            diff.drop()
+            for schema in attached:
+                connection.execute(f"DETACH DATABASE {schema}")
+
+
+def _echo_text(entries: Iterator[DiffEntry]) -> None:
+    group = None
+    for entry in entries:
+        if (entry.code, entry.filename) != group:
+            group = (entry.code, entry.filename)
+            click.echo(f"{entry.code} {entry.filename}")
+        click.echo(
+            f"  {entry.status.name:<10} {str(entry.location):<14} {entry.callable}"
+        )
+
+
+def _echo_json(entries: Iterator[DiffEntry]) -> None:
+    for entry in entries:
+        click.echo(
+            json.dumps(
+                dict(
+                    entry._asdict(),
+                    status=entry.status.name,
+                    location=str(entry.location),
+                )
+            )
+        )
+
+
+@click.command()
+@click.pass_context
+@click.option(
+    "--linemap",
+    type=click.Path(exists=True, dir_okay=False),
+    help="json file mapping lines of RUN_B to lines of RUN_A, to find moved issues",
+)
+@click.option(
+    "--persisting", is_flag=True, help="also list issues that are in both runs"
+)
+@click.option("--json", "as_json", is_flag=True, help="write one JSON object per line")
+@click.argument("run_a", type=int)
+@click.argument("run_b", type=int)
+def diff(
+    click_ctx: click.Context,
+    linemap: Optional[str],
+    persisting: bool,
+    as_json: bool,
+    run_a: int,
+    run_b: int,
+) -> None:
+    """List the issues that are new in RUN_B, and the ones fixed since RUN_A"""
+    database = click_ctx.obj.database
+    loaded_linemap = None
+    if linemap:
+        with open(linemap) as f:
+            loaded_linemap = json.load(f)
+
+    statuses = [DiffStatus.new, DiffStatus.moved, DiffStatus.fixed]
+    if persisting:
+        statuses.append(DiffStatus.persisting)
+    try:
+        with diff_runs(database, run_a, run_b, loaded_linemap) as run_diff:
+            entries = run_diff.entries(statuses)
+            if as_json:
+                _echo_json(entries)
+                return
+            _echo_text(entries)
+            counts = run_diff.counts()
+    except AIException as error:
+        raise click.UsageError(str(error)) from error
+    click.echo(", ".join(f"{count} {status.name}" for status, count in counts.items()))
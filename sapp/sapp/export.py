@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Moving a run between databases as JSON lines.
+
+An export is one JSON object per line. The run comes first, followed by every
+row that belongs to it, always after the rows it refers to. Rows are read in
+primary key order with keyset pagination, so memory use doesn't depend on the
+size of the run. Ids in the file are the ids of the exporting database; the
+import maps them to new ids and merges issues and messages with the ones that
+already exist, exactly like a regular `analyze` does.
+"""
+
+import enum
+import gzip
+from collections import defaultdict
+from datetime import datetime
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Type
+
+import click
+import ujson as json
+from sqlalchemy import Column, DateTime, MetaData, Table, and_, select, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import Select
+
+from . import name_index
+from .bulk_saver import BulkSaver
+from .db import DB
+from .errors import AIException
+from .models import (
+    BIGDBIDType,
+    DBID,
+    Issue,
+    IssueDBID,
+    IssueInstance,
+    IssueInstanceFixInfo,
+    IssueInstanceSharedTextAssoc,
+    IssueInstanceTraceFrameAssoc,
+    PrimaryKeyGenerator,
+    Run,
+    RunStatus,
+    SharedText,
+    SourceLocation,
+    SourceLocationsType,
+    SourceLocationType,
+    TraceFrame,
+    TraceFrameAnnotation,
+    TraceFrameAnnotationText,
+    TraceFrameLeafAssoc,
+)
+from .warning_code_stats import RunStatsCollector
+
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Models in the order they are exported; every model only refers to models
+# before it.
+EXPORTED_MODELS = [
+    SharedText,
+    TraceFrameAnnotationText,
+    Issue,
+    IssueInstanceFixInfo,
+    IssueInstance,
+    IssueInstanceSharedTextAssoc,
+    TraceFrame,
+    IssueInstanceTraceFrameAssoc,
+    TraceFrameAnnotation,
+    TraceFrameLeafAssoc,
+]
+
+# Columns holding ids of other exported rows, which get new ids on import
+REFERENCES = {
+    IssueInstance: {
+        "issue_id": Issue,
+        "fix_info_id": IssueInstanceFixInfo,
+        "message_id": SharedText,
+        "filename_id": SharedText,
+        "callable_id": SharedText,
+    },
+    IssueInstanceSharedTextAssoc: {
+        "issue_instance_id": IssueInstance,
+        "shared_text_id": SharedText,
+    },
+    TraceFrame: {
+        "caller_id": SharedText,
+        "callee_id": SharedText,
+        "filename_id": SharedText,
+    },
+    IssueInstanceTraceFrameAssoc: {
+        "issue_instance_id": IssueInstance,
+        "trace_frame_id": TraceFrame,
+    },
+    TraceFrameAnnotation: {
+        "trace_frame_id": TraceFrame,
+        "text_id": TraceFrameAnnotationText,
+    },
+    TraceFrameLeafAssoc: {"trace_frame_id": TraceFrame, "leaf_id": SharedText},
+}
+
+
+def _keys(model) -> List[str]:
+    return [attr.key for attr in model.__mapper__.column_attrs]
+
+
+def _encode(value):
+    if isinstance(value, DBID):
+        return value.resolved()
+    if isinstance(value, SourceLocation):
+        return SourceLocation.to_int(value)
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _decoder(column: Column):
+    column_type = column.type
+    if isinstance(column_type, SourceLocationType):
+        return SourceLocation.from_int
+    if isinstance(column_type, SourceLocationsType):
+        return lambda value: [SourceLocation.from_int(item) for item in value]
+    enum_class = getattr(column_type, "enum_class", None)
+    if enum_class is not None:
+        return lambda value: enum_class[value]
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat
+    return None
+
+
+def _decode(model, values: Dict) -> Dict:
+    for attr in model.__mapper__.column_attrs:
+        value = values.get(attr.key)
+        decode = _decoder(attr.columns[0])
+        if value is not None and decode is not None:
+            values[attr.key] = decode(value)
+    return values
+
+
+def _paginate(query, key_columns: List, batch_size: int) -> Iterator:
+    """Runs `query` in batches ordered by `key_columns`. Every batch starts
+    after the last key of the previous one, so it costs the same no matter how
+    far into the table it is."""
+    labels = [column.key for column in key_columns]
+    last = None
+    while True:
+        batch = query
+        if last is not None:
+            if len(key_columns) == 1:
+                batch = batch.filter(key_columns[0] > last[0])
+            else:
+                batch = batch.filter(tuple_(*key_columns) > tuple_(*last))
+        rows = batch.order_by(*key_columns).limit(batch_size).all()
+        if not rows:
+            return
+        yield from rows
+        last = [int(getattr(rows[-1], label)) for label in labels]
+
+
+def _referenced_messages(run_id: int) -> List[Select]:
+    """Selects every SharedText id that rows of the run refer to."""
+    instances = IssueInstance.__table__
+    features = IssueInstanceSharedTextAssoc.__table__
+    frames = TraceFrame.__table__
+    leaves = TraceFrameLeafAssoc.__table__
+    in_instances = instances.c.run_id == run_id
+    in_frames = frames.c.run_id == run_id
+    references = [
+        (instances.c.message_id, in_instances),
+        (instances.c.filename_id, in_instances),
+        (instances.c.callable_id, in_instances),
+        (
+            features.c.feature_id,
+            and_(features.c.issue_instance_id == instances.c.id, in_instances),
+        ),
+        (frames.c.caller_id, in_frames),
+        (frames.c.callee_id, in_frames),
+        (frames.c.filename_id, in_frames),
+        (
+            leaves.c.message_id,
+            and_(leaves.c.trace_frame_id == frames.c.id, in_frames),
+        ),
+    ]
+    return [
+        select([column]).where(and_(criterion, column != 0))
+        for column, criterion in references
+    ]
+
+
+def _run_rows(session: Session, model, run_id: int, referenced: Table):
+    """The query for all rows of `model` that belong to the run, and the
+    columns to paginate it by."""
+    columns = [getattr(model, key) for key in _keys(model)]
+    query = session.query(*columns)
+    if model is SharedText:
+        query = query.join(referenced, referenced.c.id == SharedText.id)
+    elif model is Issue:
+        query = query.filter(
+            session.query(IssueInstance.id)
+            .filter(IssueInstance.issue_id == Issue.id)
+            .filter(IssueInstance.run_id == run_id)
+            .exists()
+        )
+    elif model is TraceFrameAnnotationText:
+        query = query.filter(
+            session.query(TraceFrameAnnotation.id)
+            .join(TraceFrame, TraceFrame.id == TraceFrameAnnotation.trace_frame_id)
+            .filter(TraceFrameAnnotation.text_id == TraceFrameAnnotationText.id)
+            .filter(TraceFrame.run_id == run_id)
+            .exists()
+        )
+    elif model is IssueInstanceFixInfo:
+        query = query.join(
+            IssueInstance, IssueInstance.fix_info_id == IssueInstanceFixInfo.id
+        ).filter(IssueInstance.run_id == run_id)
+    elif model in (IssueInstanceSharedTextAssoc, IssueInstanceTraceFrameAssoc):
+        query = query.join(
+            IssueInstance, IssueInstance.id == model.issue_instance_id
+        ).filter(IssueInstance.run_id == run_id)
+    elif model in (TraceFrameAnnotation, TraceFrameLeafAssoc):
+        query = query.join(TraceFrame, TraceFrame.id == model.trace_frame_id).filter(
+            TraceFrame.run_id == run_id
+        )
+    else:
+        query = query.filter(model.run_id == run_id)
+    return query, [getattr(model, key) for key in _primary_keys(model)]
+
+
+def _primary_keys(model) -> List[str]:
+    mapper = model.__mapper__
+    return [mapper.get_property_by_column(column).key for column in mapper.primary_key]
+
+
+def export_run(
+    database: DB, run_id: int, output: IO[str], batch_size: int = DEFAULT_BATCH_SIZE
+) -> Dict[str, int]:
+    """Writes the run and everything that belongs to it to `output` and
+    returns the number of rows written per model."""
+    counts: Dict[str, int] = defaultdict(int)
+    database.attach_run(run_id)
+    referenced = Table(
+        "tmp_exported_messages",
+        MetaData(),
+        Column("id", BIGDBIDType, primary_key=True),
+        prefixes=["TEMPORARY"],
+    )
+    # The temporary table only exists on this connection
+    with database.engine.connect() as connection:
+        session = Session(bind=connection)
+        run = session.query(Run).filter(Run.id == run_id).one_or_none()
+        if run is None:
+            raise AIException(f"Run {run_id} does not exist")
+        row = {key: _encode(getattr(run, key)) for key in _keys(Run) if key != "id"}
+        output.write(json.dumps(dict(row, model=Run.__name__)) + "\n")
+        counts[Run.__name__] += 1
+
+        referenced.drop(connection, checkfirst=True)
+        referenced.create(connection)
+        try:
+            for query in _referenced_messages(run_id):
+                connection.execute(
+                    referenced.insert()
+                    .prefix_with("OR IGNORE", dialect="sqlite")
+                    .prefix_with("IGNORE", dialect="mysql")
+                    .from_select(["id"], query)
+                )
+            for model in EXPORTED_MODELS:
+                query, key_columns = _run_rows(session, model, run_id, referenced)
+                for row in _paginate(query, key_columns, batch_size):
+                    values = {
+                        key: _encode(value) for key, value in row._asdict().items()
+                    }
+                    values["model"] = model.__name__
+                    output.write(json.dumps(values) + "\n")
+                    counts[model.__name__] += 1
+        finally:
+            session.close()
+            referenced.drop(connection)
+    return dict(counts)
+
+
+def import_run(
+    database: DB,
+    lines: Iterable[str],
+    primary_key_generator: Optional[PrimaryKeyGenerator] = None,
+) -> int:
+    """Saves an exported run into the database as a new run and returns its
+    id."""
+    primary_key_generator = primary_key_generator or PrimaryKeyGenerator()
+    bulk_saver = BulkSaver(primary_key_generator)
+    models: Dict[str, Type] = {model.__name__: model for model in EXPORTED_MODELS}
+    new_ids: Dict[Type, Dict[int, DBID]] = defaultdict(dict)
+    run_id: Optional[int] = None
+    status = RunStatus.FINISHED
+
+    for line in lines:
+        values = json.loads(line)
+        model_name = values.pop("model")
+        if model_name == Run.__name__:
+            values = _decode(Run, values)
+            status = values.pop("status")
+            # Rows are converted to the current schema on the way in
+            values.pop("db_version", None)
+            run_id = _save_run(database, primary_key_generator, values)
+            continue
+        if run_id is None:
+            raise AIException("Export has to start with its run")
+
+        model = models[model_name]
+        values = _decode(model, values)
+        if "run_id" in values:
+            values["run_id"] = run_id
+        for key, referenced in REFERENCES.get(model, {}).items():
+            # 0 and None mean that there is no reference
+            if values.get(key):
+                values[key] = new_ids[referenced][values[key]]
+        if model is TraceFrameAnnotation and "text_id" not in values:
+            # Exported before annotation texts were shared
+            text = TraceFrameAnnotationText.Record(
+                id=DBID(),
+                message=values.pop("message"),
+                link=values.pop("link"),
+                trace_key=values.pop("trace_key"),
+            )
+            bulk_saver.add(text)
+            values["text_id"] = text.id
+        if "id" in values:
+            new_id = IssueDBID() if model is Issue else DBID()
+            new_ids[model][values["id"]] = new_id
+            values["id"] = new_id
+        bulk_saver.add(model.Record(**values))
+
+    if run_id is None:
+        raise AIException("Export has no run")
+    names = name_index.names(
+        bulk_saver.get_items_to_add(Issue),
+        bulk_saver.get_items_to_add(IssueInstance),
+        bulk_saver.get_items_to_add(TraceFrame),
+    )
+    run_stats = RunStatsCollector(
+        bulk_saver.get_items_to_add(Issue), bulk_saver.get_items_to_add(IssueInstance)
+    )
+    bulk_saver.save_all(database)
+    name_index.add_run(database.engine, run_id, names)
+
+    with database.make_session() as session:
+        run_stats.add(session, run_id)
+        run = session.query(Run).filter(Run.id == run_id).one()
+        run.status = status
+        session.commit()
+    return run_id
+
+
+def _save_run(
+    database: DB, primary_key_generator: PrimaryKeyGenerator, values: Dict
+) -> int:
+    with database.make_session() as session:
+        pk_gen = primary_key_generator.reserve(session, [Run])
+        run = Run(id=pk_gen.get(Run), status=RunStatus.INCOMPLETE, **values)
+        session.add(run)
+        session.commit()
+        run_id = int(run.id)
+    database.attach_run(run_id, create=True)
+    return run_id
+
+
+def _open(path: str, mode: str, compress: bool) -> IO[str]:
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _is_gzip(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+
+@click.command()
+@click.pass_context
+@click.option("--run-id", type=int, help="run to export (default: latest run)")
+@click.option(
+    "--gzip", "compress", is_flag=True, help="compress the output (default for *.gz)"
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=DEFAULT_BATCH_SIZE,
+    help="rows read per query",
+)
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+def export(
+    click_ctx: click.Context,
+    run_id: Optional[int],
+    compress: bool,
+    batch_size: int,
+    output: str,
+) -> None:
+    """Write a run to a JSON lines file"""
+    database = click_ctx.obj.database
+    if run_id is None:
+        with database.make_session() as session:
+            latest = (
+                session.query(Run.id)
+                .filter(Run.status == RunStatus.FINISHED)
+                .order_by(Run.id.desc())
+                .first()
+            )
+        if latest is None:
+            raise click.UsageError("No finished runs to export")
+        run_id = int(latest.id)
+
+    with _open(output, "w", compress or output.endswith(".gz")) as f:
+        counts = export_run(database, run_id, f, batch_size)
+    click.echo(f"Exported run {run_id} to {output}")
+    for model_name, count in counts.items():
+        click.echo(f"  {model_name}: {count} rows")
+
+
+@click.command(name="import")
+@click.pass_context
+@click.argument("input", type=click.Path(exists=True, dir_okay=False))
+def import_(click_ctx: click.Context, input: str) -> None:
+    """Save an exported run as a new run"""
+    database = click_ctx.obj.database
+    with _open(input, "r", _is_gzip(input)) as f, database.write_lock():
+        run_id = import_run(database, f)
+    click.echo(f"Imported {input} as run {run_id}")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Ingests the outputs of many analyses, e.g. of sharded jobs, into one
+database as separate runs.
+
+Producer processes parse the outputs and build their trace graphs in
+parallel. Each hands back its prepared run, and the runs are saved one at a
+time as they come in, through the single connection of the coordinating
+process. Primary keys are only ever reserved there, and writes don't compete
+for SQLite's lock.
+"""
+
+import logging
+import multiprocessing
+from typing import List, Optional, Tuple, Type
+
+from .analysis_output import AnalysisOutput
+from .base_parser import BaseParser
+from .bulk_saver import BulkSaver
+from .database_saver import DatabaseSaver
+from .db import DB
+from .model_generator import ModelGenerator
+from .models import PrimaryKeyGenerator, RunSummary
+from .pipeline import Pipeline, Summary
+from .trim_trace_graph import TrimTraceGraph
+
+
+log = logging.getLogger("sapp")
+
+# Set in each producer process, see _start_producer
+_coordinator: Optional["IngestionCoordinator"] = None
+
+
+class IngestionCoordinator:
+    def __init__(
+        self,
+        database: DB,
+        parser_class: Type[BaseParser],
+        summary_blob: Summary,
+        processes: Optional[int] = None,
+        parallel_save: bool = False,
+    ) -> None:
+        self.database = database
+        self.parser_class = parser_class
+        self.summary_blob = summary_blob
+        self.processes = processes
+        self.parallel_save = parallel_save
+        self.primary_key_generator = PrimaryKeyGenerator()
+
+    def ingest(self, input_files: List[str]) -> List[RunSummary]:
+        """Saves every input file as a run, in the order they are parsed."""
+        run_summaries = []
+        # Forking hands the coordinator to the producers without pickling it
+        context = multiprocessing.get_context("fork")
+        with context.Pool(
+            self.processes, initializer=_start_producer, initargs=(self,)
+        ) as pool:
+            for input_file, bulk_saver, summary in pool.imap_unordered(
+                _produce, input_files
+            ):
+                log.info("Saving %s", input_file)
+                run_summaries.append(self.save(bulk_saver, summary))
+        return run_summaries
+
+    def prepare(self, input_file: str) -> Tuple[BulkSaver, Summary]:
+        """Runs in a producer. Everything returned is pickled in one go, which
+        keeps the ids that records share with each other and with the run."""
+        graph, summary = Pipeline(
+            [self.parser_class(), ModelGenerator(), TrimTraceGraph()]
+        ).run((AnalysisOutput.from_file(input_file), None), dict(self.summary_blob))
+        bulk_saver = DatabaseSaver(self.database).prepare(graph, summary)
+        return (
+            bulk_saver,
+            {key: summary[key] for key in DatabaseSaver.SAVED_SUMMARY_KEYS},
+        )
+
+    def save(self, bulk_saver: BulkSaver, summary: Summary) -> RunSummary:
+        return DatabaseSaver(
+            self.database,
+            primary_key_generator=self.primary_key_generator,
+            parallel_save=self.parallel_save,
+        ).save(bulk_saver, summary)
+
+
+def _start_producer(coordinator: IngestionCoordinator) -> None:
+    global _coordinator
+    _coordinator = coordinator
+
+
+def _produce(input_file: str) -> Tuple[str, BulkSaver, Summary]:
+    assert _coordinator is not None
+    return (input_file,) + _coordinator.prepare(input_file)
@@ -1,15 +1,20 @@
 #!/usr/bin/env python3
 
+import atexit
 import builtins
 import itertools
 import os
 import sys
-from collections import defaultdict
+import threading
+from collections import Counter, defaultdict, deque
 from typing import (
     Callable,
     DefaultDict,
+    Deque,
     Dict,
+    FrozenSet,
     Iterable,
+    Iterator,
     List,
     NamedTuple,
     Optional,
@@ -31,15 +36,17 @@ from prompt_toolkit.history import FileHistory, History
 from pygments import highlight
 from pygments.formatters import TerminalFormatter
 from pygments.lexers import get_lexer_for_filename
-from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.attributes import InstrumentedAttribute, set_committed_value
 from sqlalchemy.orm.query import Query
 from sqlalchemy.sql import func
-from sqlalchemy.sql.expression import or_
+from sqlalchemy.sql.expression import ColumnElement, and_, or_
 
+from . import name_index
 from .analysis_output import AnalysisOutput, AnalysisOutputError
-from .db import DB
+from .db import DB, DBType
 from .decorators import UserError, catch_keyboard_interrupt, catch_user_error
+from .lru_cache import LRUCache
 from .models import (
     DBID,
     Issue,
@@ -50,6 +57,7 @@ from .models import (
     RunStatus,
     SharedText,
     SharedTextKind,
+    ShortestTrace,
     SourceLocation,
     TraceFrame,
     TraceFrameLeafAssoc,
@@ -120,6 +128,22 @@ details()         show additional information about the current trace frame
 
     LEAF_NAMES = {"source", "sink", "leaf"}
 
+    # Issues formatted per query for their leaves
+    ISSUES_BATCH_SIZE = 1000
+
+    # Trace frames read per query while listing them
+    FRAMES_BATCH_SIZE = 1000
+
+    # Parents listed at once by parents()
+    PARENTS_LIMIT = 20
+
+    # Query results kept for the current run
+    CACHE_SIZE = 4096
+
+    # Issues of the most visited codes prefetched when a run is selected
+    WARM_CACHE_CODES = 5
+    WARM_CACHE_ISSUES = 200
+
     SELF_SCOPE_KEY = "_interactive"
 
     def __init__(self, database: DB, repository_directory: str = ""):
@@ -153,6 +177,13 @@ details()         show additional information about the current trace frame
         self.repository_directory = repository_directory or os.getcwd()
         self.current_analysis_output: Optional[AnalysisOutput] = None
 
+        # Query results of the current run, see _cached
+        self.cache: LRUCache = LRUCache(self.CACHE_SIZE)
+        # Issues selected so far by code, to pick the issues to prefetch
+        self.visited_codes: Counter = Counter()
+        self._warming_database: Optional[DB] = None
+        self._warming_thread: Optional[threading.Thread] = None
+        self._warming_stop = threading.Event()
         self.current_run_id: int = -1
 
         # Trace exploration relies on either of these
@@ -173,6 +204,99 @@ details()         show additional information about the current trace frame
         # history_key on self.prompt().
         self.prompt_history: Dict[str, History] = {}
 
+    @property
+    def current_run_id(self) -> int:
+        return self._current_run_id
+
+    @current_run_id.setter
+    def current_run_id(self, run_id: int) -> None:
+        changed = run_id != getattr(self, "_current_run_id", None)
+        if changed:
+            self.stop_warming()
+            self.cache.clear()
+        # Partitioned databases only show the tables of the attached run
+        self._current_run_id = run_id
+        if run_id != -1:
+            self.db.attach_run(run_id)
+            if changed:
+                self._start_warming(run_id)
+
+    def stop_warming(self) -> None:
+        """Cancels prefetching of the current run. The thread finishes the
+        query it is running, and its result is dropped."""
+        self._warming_stop.set()
+
+    def _start_warming(self, run_id: int) -> None:
+        # Other threads can't share the connection of in-memory databases
+        if self.db.dbtype != DBType.SQLITE:
+            return
+        if self._warming_database is None:
+            self._warming_database = DB(
+                DBType.SQLITE,
+                self.db.dbname,
+                read_only=True,
+                partitioned=self.db.partitioned,
+            )
+            atexit.register(self.stop_warming)
+        self._warming_stop = threading.Event()
+        self._warming_thread = threading.Thread(
+            target=self._warm_cache,
+            args=(self._warming_database, run_id, self._warming_stop),
+            name=f"sapp-warm-run-{run_id}",
+            daemon=True,
+        )
+        self._warming_thread.start()
+
+    def _warm_cache(self, database: DB, run_id: int, stop: threading.Event) -> None:
+        """Prefetches the issues with the most visited codes, or the most
+        common codes of the run, so that selecting them and following their
+        traces returns from the cache. Uses its own database connection."""
+        database.attach_run(run_id)
+        with database.make_session() as session:
+            for issue_instance_id in self._issues_to_warm(session, run_id):
+                lookups: List[Tuple[Tuple, Callable, Tuple]] = [
+                    (("issue",), self._query_issue, ())
+                ]
+                for kind in [SharedTextKind.SOURCE, SharedTextKind.SINK]:
+                    lookups.append(
+                        (("issue_leaves",), self._query_leaves_issue_instance, (kind,))
+                    )
+                for kind in [TraceKind.POSTCONDITION, TraceKind.PRECONDITION]:
+                    lookups.append(
+                        (("initial",), self._query_initial_trace_frames, (kind,))
+                    )
+                    lookups.append((("shortest",), self._query_shortest_trace, (kind,)))
+                for name, query, args in lookups:
+                    key = (run_id,) + name + (issue_instance_id,) + args
+                    if stop.is_set():
+                        return
+                    if key not in self.cache:
+                        value = query(session, issue_instance_id, *args)
+                        if stop.is_set():
+                            return
+                        self.cache.put(key, value)
+
+    def _issues_to_warm(self, session: Session, run_id: int) -> List[int]:
+        codes = [code for code, _ in self.visited_codes.most_common()]
+        if not codes:
+            codes = [
+                code
+                for code, in session.query(Issue.code)
+                .join(IssueInstance, IssueInstance.issue_id == Issue.id)
+                .filter(IssueInstance.run_id == run_id)
+                .group_by(Issue.code)
+                .order_by(func.count(IssueInstance.id).desc())
+            ]
+        return [
+            int(id)
+            for id, in session.query(IssueInstance.id)
+            .join(Issue, IssueInstance.issue_id == Issue.id)
+            .filter(IssueInstance.run_id == run_id)
+            .filter(Issue.code.in_(codes[: self.WARM_CACHE_CODES]))
+            .order_by(IssueInstance.id)
+            .limit(self.WARM_CACHE_ISSUES)
+        ]
+
     def setup(self) -> Dict[str, Callable]:
         with self.db.make_session() as session:
             latest_run_id = (
@@ -183,6 +307,7 @@ details()         show additional information about the current trace frame
 
             self.sources_dict = self._all_leaves_by_kind(session, SharedTextKind.SOURCE)
             self.sinks_dict = self._all_leaves_by_kind(session, SharedTextKind.SINK)
+        self.cache.clear()
 
         print("=" * len(self.welcome_message))
         print(self.welcome_message)
@@ -214,6 +339,7 @@ details()         show additional information about the current trace frame
         print(f"   Current trace frame: {self.current_frame_id}")
         print(f"        Sources filter: {self.sources}")
         print(f"          Sinks filter: {self.sinks}")
+        print(f"                 Cache: {self.cache}")
 
     @catch_keyboard_interrupt()
     def runs(self, use_pager=None):
@@ -371,6 +497,9 @@ details()         show additional information about the current trace frame
         self.current_frame_id = -1
         self.current_trace_frame_index = 1  # first one after the source
 
+        with self.db.make_session() as session:
+            self.visited_codes[self._get_current_issue(session).code] += 1
+
         print(f"Set issue to {issue_instance_id}.")
         if int(selected_issue.run_id) != self.current_run_id:
             self.current_run_id = int(selected_issue.run_id)
@@ -402,6 +531,9 @@ details()         show additional information about the current trace frame
         codes: Optional[Union[int, List[int]]] = None,
         callables: Optional[Union[str, List[str]]] = None,
         filenames: Optional[Union[str, List[str]]] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        after: Optional[int] = None,
     ):
         """Lists issues for the selected run.
 
@@ -410,6 +542,9 @@ details()         show additional information about the current trace frame
             codes: int or list[int]        issue codes to filter on
             callables: str or list[str]    callables to filter on (supports wildcards)
             filenames: str or list[str]    filenames to filter on (supports wildcards)
+            limit: int                     show at most this many issues
+            offset: int                    skip this many issues
+            after: int                     only show issues with a higher id
 
         String filters support LIKE wildcards (%, _) from SQL:
             % matches anything (like .* in regex)
@@ -422,6 +557,10 @@ details()         show additional information about the current trace frame
                 "at.start%",
                 "etc.",
             ])
+
+        Issues are listed by id. To page through a large run, prefer
+        after=<last id shown> over offset, which has to skip over all the
+        previous issues again.
         """
         pager = self._resolve_pager(use_pager)
 
@@ -450,30 +589,69 @@ details()         show additional information about the current trace frame
                     filenames, query, IssueInstance.filename, "filenames"
                 )
 
-            issues = query.join(Issue, IssueInstance.issue_id == Issue.id).join(
-                SharedText, SharedText.id == IssueInstance.message_id
+            if after is not None:
+                query = query.filter(IssueInstance.id > after)
+
+            issues = (
+                query.join(Issue, IssueInstance.issue_id == Issue.id)
+                .join(SharedText, SharedText.id == IssueInstance.message_id)
+                .order_by(IssueInstance.id)
+                .offset(offset)
+                .limit(limit)
             )
 
-            sources_list = [
-                self._get_leaves_issue_instance(
-                    session, int(issue.id), SharedTextKind.SOURCE
-                )
-                for issue in issues
-            ]
-            sinks_list = [
-                self._get_leaves_issue_instance(
-                    session, int(issue.id), SharedTextKind.SINK
+            issue_strings = self._issue_output_strings(session, issues)
+            num_issues = 0
+            last_issue_id = None
+            if pager is page.display_page:
+                # Show each issue as soon as it is read
+                for issue_id, issue_string in issue_strings:
+                    if num_issues > 0:
+                        pager("-" * 80)
+                    pager(issue_string)
+                    num_issues += 1
+                    last_issue_id = issue_id
+            else:
+                # The pager needs all of the output at once
+                output = []
+                for issue_id, issue_string in issue_strings:
+                    output.append(issue_string)
+                    last_issue_id = issue_id
+                num_issues = len(output)
+                pager(f"\n{'-' * 80}\n".join(output))
+        print(f"Found {num_issues} issues with run_id {self.current_run_id}.")
+        if limit is not None and num_issues == limit:
+            # The next page keeps the filters
+            arguments = ", ".join(
+                f"{name}={value!r}"
+                for name, value in [
+                    ("codes", codes),
+                    ("callables", callables),
+                    ("filenames", filenames),
+                    ("limit", limit),
+                    ("after", last_issue_id),
+                ]
+                if value is not None
+            )
+            print(f"Use issues({arguments}) to show more.")
+
+    def _issue_output_strings(
+        self, session: Session, issues: Query
+    ) -> Iterator[Tuple[int, str]]:
+        """Formats issues while they are read, fetching the leaves of every
+        batch of issues with one query. Yields (issue instance id, output)."""
+        rows = iter(issues.yield_per(self.ISSUES_BATCH_SIZE))
+        while True:
+            batch = list(itertools.islice(rows, self.ISSUES_BATCH_SIZE))
+            if not batch:
+                return
+            sources, sinks = self._get_leaves_issue_instances(
+                session, [int(issue.id) for issue in batch]
+            )
+            for issue in batch:
+                yield int(issue.id), self._create_issue_output_string(
+                    issue, sources[int(issue.id)], sinks[int(issue.id)]
                 )
-                for issue in issues
-            ]
-
-            issue_strings = [
-                self._create_issue_output_string(issue, sources, sinks)
-                for issue, sources, sinks in zip(issues, sources_list, sinks_list)
-            ]
-        issue_output = f"\n{'-' * 80}\n".join(issue_strings)
-        pager(issue_output)
-        print(f"Found {len(issue_strings)} issues with run_id {self.current_run_id}.")
 
     @catch_user_error()
     def trace(self):
@@ -511,6 +689,7 @@ details()         show additional information about the current trace frame
         callees: Optional[Union[str, List[str]]] = None,
         kind: Optional[TraceKind] = None,
         limit: Optional[int] = 10,
+        after: Optional[int] = None,
     ):
         """Display trace frames independent of the current issue.
 
@@ -520,6 +699,8 @@ details()         show additional information about the current trace frame
             kind: precondition|postcondition    the type of trace frames to show
             limit: int (default: 10)            how many trace frames to display
                                                 (specify limit=None for all)
+            after: int                          continue after this trace frame,
+                                                the last one shown
 
         Sample usage:
             frames(callers="module.function", kind=postcondition)
@@ -528,6 +709,9 @@ details()         show additional information about the current trace frame
             % matches anything (like .* in regex)
             _ matches 1 character (like . in regex)
         """
+        if limit is not None and not isinstance(limit, int):
+            raise UserError("'limit' should be an int or None.")
+
         with self.db.make_session() as session:
             query = session.query(TraceFrame).filter(
                 TraceFrame.run_id == self.current_run_id
@@ -551,19 +735,32 @@ details()         show additional information about the current trace frame
                     )
                 query = query.filter(TraceFrame.kind == kind)
 
-            if limit is not None and not isinstance(limit, int):
-                raise UserError("'limit' should be an int or None.")
-
-            trace_frames = query.group_by(TraceFrame.id).order_by(
-                TraceFrame.caller, TraceFrame.callee
-            )
-
-            total_trace_frames = trace_frames.count()
-            limit = limit or total_trace_frames
+            # Frames of a caller are listed together
+            order = [
+                TraceFrame.caller,
+                TraceFrame.caller_port,
+                TraceFrame.callee,
+                TraceFrame.id,
+            ]
+            if after is not None:
+                query = query.filter(
+                    self._keyset_after(session, order, after, "frames")
+                )
 
-            self._output_trace_frames(
-                self._group_trace_frames(trace_frames, limit), limit, total_trace_frames
+            num_trace_frames, last_trace_frame_id = self._output_trace_frames(
+                query.order_by(*order).limit(limit).yield_per(self.FRAMES_BATCH_SIZE),
+                self._trace_frame_id_width(session),
             )
+            if limit is None or num_trace_frames < limit:
+                return
+            # Only counted once the page is shown
+            total_trace_frames = query.with_entities(func.count(TraceFrame.id)).scalar()
+            if num_trace_frames < total_trace_frames:
+                print(
+                    f"...\nShowing {num_trace_frames}/{total_trace_frames} matching "
+                    f"frames. To see more, call 'frames' with "
+                    f"after={last_trace_frame_id}."
+                )
 
     @catch_keyboard_interrupt()
     def frame(self, frame_id: int) -> None:
@@ -608,7 +805,19 @@ details()         show additional information about the current trace frame
 
     @catch_keyboard_interrupt()
     @catch_user_error()
-    def parents(self) -> None:
+    def parents(
+        self, *, limit: Optional[int] = PARENTS_LIMIT, after: Optional[int] = None
+    ) -> None:
+        """Show and select trace frames that call the current trace frame.
+
+        Parameters (all optional):
+            limit: int (default: 20)    how many parents to list
+                                        (specify limit=None for all)
+            after: int                  continue after this trace frame,
+                                        the last one listed
+        """
+        if limit is not None and not isinstance(limit, int):
+            raise UserError("'limit' should be an int or None.")
         self._verify_entrypoint_selected()
         current_trace_tuple = self.trace_tuples[self.current_trace_frame_index]
 
@@ -630,9 +839,20 @@ details()         show additional information about the current trace frame
             ]
 
         with self.db.make_session() as session:
-            parent_trace_frames = self._next_trace_frames(
-                session, current_trace_tuple.trace_frame, backwards=True
+            query = self._parent_trace_frames_query(
+                session, current_trace_tuple.trace_frame
             )
+            order = [TraceFrame.callee_location, TraceFrame.id]
+            if after is not None:
+                query = query.filter(
+                    self._keyset_after(session, order, after, "parents")
+                )
+            parent_trace_frames = self._load_leaf_assocs(
+                session, query.order_by(*order).limit(limit).all()
+            )
+            total_parents = None
+            if limit is not None and len(parent_trace_frames) == limit:
+                total_parents = query.with_entities(func.count(TraceFrame.id)).scalar()
 
         if len(parent_trace_frames) == 0:
             print(
@@ -641,7 +861,9 @@ details()         show additional information about the current trace frame
             )
             return
 
-        parent_trace_frame = self._select_parent_trace_frame(parent_trace_frames)
+        parent_trace_frame = self._select_parent_trace_frame(
+            parent_trace_frames, total_parents
+        )
 
         self._update_trace_tuples_new_parent(parent_trace_frame)
         self.trace()
@@ -650,13 +872,11 @@ details()         show additional information about the current trace frame
         with self.db.make_session() as session:
             issue = self._get_current_issue(session)
 
-            postcondition_navigation = self._navigate_trace_frames(
-                session,
-                self._initial_trace_frames(session, issue.id, TraceKind.POSTCONDITION),
+            postcondition_navigation = self._navigate_issue_trace(
+                session, issue.id, TraceKind.POSTCONDITION
             )
-            precondition_navigation = self._navigate_trace_frames(
-                session,
-                self._initial_trace_frames(session, issue.id, TraceKind.PRECONDITION),
+            precondition_navigation = self._navigate_issue_trace(
+                session, issue.id, TraceKind.PRECONDITION
             )
 
         self.trace_tuples = (
@@ -749,18 +969,16 @@ details()         show additional information about the current trace frame
         branches = self._get_trace_frame_branches(session)
 
         leaves_strings = []
+        if branches:
+            leaves = self._get_leaves_trace_frames(
+                session,
+                [int(frame.id) for frame in branches],
+                self._trace_kind_to_shared_text_kind(branches[0].kind),
+            )
         for frame in branches:
             leaves_strings.append(
                 ", ".join(
-                    [
-                        leaf
-                        for leaf in self._get_leaves_trace_frame(
-                            session,
-                            int(frame.id),
-                            self._trace_kind_to_shared_text_kind(frame.kind),
-                        )
-                        if leaf in filter_leaves
-                    ]
+                    [leaf for leaf in leaves[int(frame.id)] if leaf in filter_leaves]
                 )
             )
 
@@ -942,20 +1160,31 @@ details()         show additional information about the current trace frame
                 return i
         return -1
 
-    def _group_trace_frames(
-        self, trace_frames: Iterable[TraceFrame], limit: int
-    ) -> Dict[Tuple[str, str], List[TraceFrame]]:
-        """Buckets together trace frames that have the same caller:caller_port.
-        """
-        # pyre-fixme[9]: caller_buckets has type `DefaultDict[Tuple[str, str], List[T...
-        caller_buckets: DefaultDict[Tuple[str, str], List[TraceFrame]] = defaultdict(
-            list
-        )
-        for trace_frame in itertools.islice(trace_frames, limit):
-            caller_buckets[(trace_frame.caller, trace_frame.caller_port)].append(
-                trace_frame
+    def _keyset_after(
+        self,
+        session: Session,
+        order: List[InstrumentedAttribute],
+        trace_frame_id: int,
+        command: str,
+    ) -> ColumnElement:
+        """Matches the trace frames that come after the given one when ordered
+        by `order`, which has to end with TraceFrame.id."""
+        if not isinstance(trace_frame_id, int):
+            raise UserError("'after' should be an int.")
+        values = session.query(*order).filter(TraceFrame.id == trace_frame_id).first()
+        if values is None:
+            raise UserError(
+                f"Trace frame {trace_frame_id} doesn't exist. "
+                f"Type '{command}()' for the first page."
             )
-        return caller_buckets
+        condition = order[-1] > trace_frame_id
+        for column, value in reversed(list(zip(order[:-1], values))):
+            condition = or_(column > value, and_(column == value, condition))
+        return condition
+
+    def _trace_frame_id_width(self, session: Session) -> int:
+        max_id = session.query(func.max(TraceFrame.id)).scalar()
+        return max(len(str(int(max_id or 0))), len("[id]"))
 
     def _add_list_or_string_filter_to_query(
         self,
@@ -964,6 +1193,20 @@ details()         show additional information about the current trace frame
         column: InstrumentedAttribute,
         argument_name: str,
     ):
+        patterns = [filter] if isinstance(filter, str) else filter
+        field = name_index.field_of(column)
+        if (
+            field is not None
+            and isinstance(patterns, list)
+            and all(isinstance(pattern, str) for pattern in patterns)
+            and any("%" in pattern or "_" in pattern for pattern in patterns)
+            and self._cached(
+                ("name_index",),
+                lambda: name_index.is_indexed(query.session, self.current_run_id),
+            )
+        ):
+            # Wildcards scan the table, the index finds the matching names
+            return query.filter(column.in_(name_index.matching_names(field, patterns)))
         return self._add_list_or_element_filter_to_query(
             filter, query, column, argument_name, str
         )
@@ -1047,40 +1290,32 @@ details()         show additional information about the current trace frame
             print(f"{' ' * 8}[{frame.filename}:{frame.callee_location}]")
 
     def _output_trace_frames(
-        self,
-        trace_buckets: Dict[Tuple[str, str], List[TraceFrame]],
-        limit: int,
-        total_trace_frames: int,
-    ) -> None:
-        if not trace_buckets:
-            print("No trace frames found.")
-            return
-
-        max_len_id = max(
-            max(
-                max(len(str(trace_frame.id)) for trace_frame in value)
-                for key, value in trace_buckets.items()
-            ),
-            len("[id]"),
-        )
-
-        print(f"{'[id]':{max_len_id}} [caller:caller_port -> callee:callee_port]")
-
-        callers = trace_buckets.keys()
-        for caller, caller_port in callers:
-            print(f"{'-' * max_len_id} {caller}:{caller_port} ->")
-            trace_frames = trace_buckets[(caller, caller_port)]
-            for trace_frame in trace_frames:
+        self, trace_frames: Iterable[TraceFrame], max_len_id: int
+    ) -> Tuple[int, Optional[int]]:
+        """Prints trace frames as they are read, under a heading for each run
+        of frames with the same caller:caller_port. Returns the number of
+        frames printed and the id of the last one."""
+        num_trace_frames = 0
+        last_trace_frame_id = None
+        caller = None
+        for trace_frame in trace_frames:
+            if num_trace_frames == 0:
                 print(
-                    f"{int(trace_frame.id):<{max_len_id}} "
-                    f"    {trace_frame.callee}:{trace_frame.callee_port}"
+                    f"{'[id]':{max_len_id}} [caller:caller_port -> callee:callee_port]"
                 )
-
-        if limit < total_trace_frames:
+            if (trace_frame.caller, trace_frame.caller_port) != caller:
+                caller = (trace_frame.caller, trace_frame.caller_port)
+                print(f"{'-' * max_len_id} {':'.join(caller)} ->")
             print(
-                f"...\nShowing {limit}/{total_trace_frames} matching frames. "
-                "To see more, call 'frames' with the 'limit' argument."
+                f"{int(trace_frame.id):<{max_len_id}} "
+                f"    {trace_frame.callee}:{trace_frame.callee_port}"
             )
+            num_trace_frames += 1
+            last_trace_frame_id = int(trace_frame.id)
+
+        if num_trace_frames == 0:
+            print("No trace frames found.")
+        return num_trace_frames, last_trace_frame_id
 
     def _output_trace_tuples(self, trace_tuples):
         expand = "+"
@@ -1158,8 +1393,87 @@ details()         show additional information about the current trace frame
             for trace_frame, branches in navigation
         ]
 
+    def _navigate_issue_trace(
+        self, session: Session, issue_instance_id: int, kind: TraceKind
+    ) -> List[Tuple[TraceFrame, int]]:
+        navigation = self._cached(
+            ("shortest", int(issue_instance_id), kind),
+            lambda: self._query_shortest_trace(session, issue_instance_id, kind),
+        )
+        if navigation is not None:
+            return list(navigation)
+        # Runs saved before shortest traces were stored
+        return self._navigate_shortest_trace(
+            session, self._initial_trace_frames(session, issue_instance_id, kind)
+        )
+
+    def _query_shortest_trace(
+        self, session: Session, issue_instance_id: int, kind: TraceKind
+    ) -> Optional[List[Tuple[TraceFrame, int]]]:
+        """The trace stored for the issue instance when its run was saved, in
+        the same form as _navigate_trace_frames returns."""
+        # Partitioned databases keep run-scoped tables in the attached run
+        schema = "run" if self.db.partitioned else None
+        if not self.db.engine.dialect.has_table(
+            session.connection(), ShortestTrace.__tablename__, schema=schema
+        ):
+            return None
+        shortest_trace = (
+            session.query(ShortestTrace)
+            .filter(ShortestTrace.issue_instance_id == issue_instance_id)
+            .filter(ShortestTrace.kind == kind)
+            .first()
+        )
+        if shortest_trace is None:
+            return None
+
+        trace_frames = {
+            int(trace_frame.id): trace_frame
+            for trace_frame in self._load_leaf_assocs(
+                session,
+                session.query(TraceFrame)
+                .filter(TraceFrame.id.in_(shortest_trace.trace_frame_ids))
+                .all(),
+            )
+        }
+        if not set(shortest_trace.trace_frame_ids).issubset(trace_frames):
+            return None
+        navigation = [
+            (trace_frames[trace_frame_id], branches)
+            for trace_frame_id, branches in zip(
+                shortest_trace.trace_frame_ids, shortest_trace.branches
+            )
+        ]
+        if navigation and not self._is_leaf(navigation[-1][0]):
+            last_trace_frame = navigation[-1][0]
+            # Denote a missing frame by setting caller to None
+            navigation.append(
+                (
+                    TraceFrame(
+                        callee=last_trace_frame.callee,
+                        callee_port=last_trace_frame.callee_port,
+                        caller=None,
+                    ),
+                    0,
+                )
+            )
+        return navigation
+
     def _initial_trace_frames(self, session, issue_instance_id, kind):
-        return (
+        return list(
+            self._cached(
+                ("initial", int(issue_instance_id), kind),
+                lambda: self._query_initial_trace_frames(
+                    session, issue_instance_id, kind
+                ),
+            )
+        )
+
+    def _query_initial_trace_frames(
+        self, session: Session, issue_instance_id: int, kind: TraceKind
+    ) -> List[TraceFrame]:
+        return self._load_leaf_assocs(
+            session,
             session.query(TraceFrame)
             .join(
                 IssueInstanceTraceFrameAssoc,
@@ -1169,20 +1483,53 @@ details()         show additional information about the current trace frame
             .filter(TraceFrame.kind == kind)
             .join(TraceFrame.leaf_assoc)
             .group_by(TraceFrame.id)
-            .order_by(TraceFrameLeafAssoc.trace_length, TraceFrame.callee_location)
-            .all()
+            .order_by(*self._trace_frame_order())
+            .all(),
         )
 
+    def _trace_frame_order(self) -> Tuple:
+        """Closest to a leaf first, for queries grouped by trace frame. Matches
+        the order of TraceGraph._trace_frame_order, which the stored shortest
+        traces were found with."""
+        return (
+            func.min(TraceFrameLeafAssoc.trace_length),
+            TraceFrame.callee_location,
+            TraceFrame.id,
+        )
+
+    def _load_leaf_assocs(
+        self, session: Session, trace_frames: List[TraceFrame]
+    ) -> List[TraceFrame]:
+        """Loads leaf_assoc of all trace_frames with one query. Branch listings
+        use it on cached trace frames, after their session is closed."""
+        leaf_assocs: DefaultDict[int, List[TraceFrameLeafAssoc]] = defaultdict(list)
+        for leaf_assoc in session.query(TraceFrameLeafAssoc).filter(
+            TraceFrameLeafAssoc.trace_frame_id.in_(
+                [int(trace_frame.id) for trace_frame in trace_frames]
+            )
+        ):
+            leaf_assocs[int(leaf_assoc.trace_frame_id)].append(leaf_assoc)
+        for trace_frame in trace_frames:
+            set_committed_value(
+                trace_frame, "leaf_assoc", leaf_assocs[int(trace_frame.id)]
+            )
+        return trace_frames
+
     def _navigate_trace_frames(
         self, session: Session, initial_trace_frames: List[TraceFrame], index: int = 0
     ) -> List[Tuple[TraceFrame, int]]:
         if not initial_trace_frames:
             return []
 
+        next_trace_frames = self._cached_reachable_trace_frames(
+            session, [initial_trace_frames[index]]
+        )
         trace_frames = [(initial_trace_frames[index], len(initial_trace_frames))]
         while not self._is_leaf(trace_frames[-1][0]):
             trace_frame, branches = trace_frames[-1]
-            next_nodes = self._next_forward_trace_frames(session, trace_frame)
+            next_nodes = next_trace_frames.get(
+                (trace_frame.callee, trace_frame.callee_port), []
+            )
 
             if len(next_nodes) == 0:
                 # Denote a missing frame by setting caller to None
@@ -1201,6 +1548,133 @@ details()         show additional information about the current trace frame
             trace_frames.append((next_nodes[0], len(next_nodes)))
         return trace_frames
 
+    def _navigate_shortest_trace(
+        self, session: Session, initial_trace_frames: List[TraceFrame]
+    ) -> List[Tuple[TraceFrame, int]]:
+        """Finds the trace TraceGraph.get_shortest_trace stores when saving a
+        run, with a breadth first search from all initial trace frames to a
+        leaf. If no leaf can be reached, navigates from the first one."""
+        if not initial_trace_frames:
+            return []
+
+        next_trace_frames = self._cached_reachable_trace_frames(
+            session, initial_trace_frames
+        )
+        parents: Dict[int, Optional[TraceFrame]] = {
+            int(trace_frame.id): None for trace_frame in initial_trace_frames
+        }
+        queue: Deque[TraceFrame] = deque(initial_trace_frames)
+        while queue:
+            trace_frame = queue.popleft()
+            if self._is_leaf(trace_frame):
+                trace: List[TraceFrame] = []
+                node: Optional[TraceFrame] = trace_frame
+                while node is not None:
+                    trace.append(node)
+                    node = parents[int(node.id)]
+                trace.reverse()
+                return [(trace[0], len(initial_trace_frames))] + [
+                    (
+                        trace_frame,
+                        len(
+                            next_trace_frames.get(
+                                (trace_frame.caller, trace_frame.caller_port), []
+                            )
+                        ),
+                    )
+                    for trace_frame in trace[1:]
+                ]
+            for next_frame in next_trace_frames.get(
+                (trace_frame.callee, trace_frame.callee_port), []
+            ):
+                if int(next_frame.id) not in parents:
+                    parents[int(next_frame.id)] = trace_frame
+                    queue.append(next_frame)
+
+        return self._navigate_trace_frames(session, initial_trace_frames)
+
+    def _cached_reachable_trace_frames(
+        self, session: Session, trace_frames: List[TraceFrame]
+    ) -> Dict[Tuple[str, str], List[TraceFrame]]:
+        return self._cached(
+            (
+                "reachable",
+                tuple(int(trace_frame.id) for trace_frame in trace_frames),
+                self._leaf_filter(trace_frames[0].kind),
+            ),
+            lambda: self._reachable_trace_frames(session, trace_frames),
+        )
+
+    def _reachable_trace_frames(
+        self, session: Session, trace_frames: List[TraceFrame]
+    ) -> Dict[Tuple[str, str], List[TraceFrame]]:
+        """Finds all trace frames reachable from the given trace_frames with one
+        recursive query, and buckets them by caller:caller_port. Each bucket
+        holds what _next_forward_trace_frames would return for a frame calling
+        into it, in the same order.
+        """
+        kind = trace_frames[0].kind
+        reachable = (
+            session.query(TraceFrame.id, TraceFrame.callee, TraceFrame.callee_port)
+            .filter(TraceFrame.id.in_([int(frame.id) for frame in trace_frames]))
+            .cte("reachable", recursive=True)
+        )
+        next_frame = aliased(TraceFrame)
+        reachable = reachable.union(
+            session.query(next_frame.id, next_frame.callee, next_frame.callee_port)
+            .filter(next_frame.caller == reachable.c.callee)
+            .filter(next_frame.caller_port == reachable.c.callee_port)
+            .filter(reachable.c.callee_port.notin_(self.LEAF_NAMES))
+            .filter(next_frame.run_id == self.current_run_id)
+            .filter(next_frame.caller != next_frame.callee)
+            .filter(next_frame.kind == kind)
+        )
+        reachable_ids = session.query(reachable.c.id)
+
+        results = (
+            session.query(TraceFrame)
+            .filter(TraceFrame.id.in_(reachable_ids))
+            .join(TraceFrame.leaf_assoc)
+            .group_by(TraceFrame.id)
+            .order_by(*self._trace_frame_order())
+        )
+        next_trace_frames: Dict[Tuple[str, str], List[TraceFrame]] = defaultdict(list)
+        for frame in self._filter_trace_frames_by_leaves(
+            session, list(results), kind, reachable_ids
+        ):
+            next_trace_frames[(frame.caller, frame.caller_port)].append(frame)
+        return next_trace_frames
+
+    def _parent_trace_frames_query(
+        self, session: Session, trace_frame: TraceFrame
+    ) -> Query:
+        """The trace frames _next_backward_trace_frames finds, with the filter
+        on their leaves done in the query, so that it can be paged."""
+        leaf_kind = self._trace_kind_to_shared_text_kind(trace_frame.kind)
+        leaf_dict = (
+            self.sources_dict if leaf_kind == SharedTextKind.SOURCE else self.sinks_dict
+        )
+        filter_leaves = self._leaf_filter(trace_frame.kind)
+        leads_to_leaf = (
+            session.query(TraceFrameLeafAssoc.trace_frame_id)
+            .filter(TraceFrameLeafAssoc.trace_frame_id == TraceFrame.id)
+            .filter(
+                TraceFrameLeafAssoc.leaf_id.in_(
+                    [id for id, leaf in leaf_dict.items() if leaf in filter_leaves]
+                )
+            )
+            .exists()
+        )
+        return (
+            session.query(TraceFrame)
+            .filter(TraceFrame.run_id == self.current_run_id)
+            .filter(TraceFrame.caller != TraceFrame.callee)
+            .filter(TraceFrame.kind == trace_frame.kind)
+            .filter(TraceFrame.callee == trace_frame.caller)
+            .filter(TraceFrame.callee_port == trace_frame.caller_port)
+            .filter(leads_to_leaf)
+        )
+
     def _is_leaf(self, trace_frame: TraceFrame) -> bool:
         return trace_frame.callee_port in self.LEAF_NAMES
 
@@ -1222,46 +1696,82 @@ details()         show additional information about the current trace frame
         When backwards=True, the result will include the parameter trace_frame,
         since we are filtering on the parameter's callee.
         """
-        query = (
-            session.query(TraceFrame)
-            .filter(TraceFrame.run_id == self.current_run_id)
-            .filter(
-                TraceFrame.caller != TraceFrame.callee
-            )  # skip recursive calls for now
-            .filter(TraceFrame.kind == trace_frame.kind)
-        )
-        if backwards:
-            query = query.filter(TraceFrame.callee == trace_frame.caller).filter(
-                TraceFrame.callee_port == trace_frame.caller_port
+
+        def query() -> List[TraceFrame]:
+            query = (
+                session.query(TraceFrame)
+                .filter(TraceFrame.run_id == self.current_run_id)
+                .filter(
+                    TraceFrame.caller != TraceFrame.callee
+                )  # skip recursive calls for now
+                .filter(TraceFrame.kind == trace_frame.kind)
             )
-        else:
-            query = query.filter(TraceFrame.caller == trace_frame.callee).filter(
-                TraceFrame.caller_port == trace_frame.callee_port
+            if backwards:
+                query = query.filter(TraceFrame.callee == trace_frame.caller).filter(
+                    TraceFrame.callee_port == trace_frame.caller_port
+                )
+            else:
+                query = query.filter(TraceFrame.caller == trace_frame.callee).filter(
+                    TraceFrame.caller_port == trace_frame.callee_port
+                )
+
+            results = (
+                query.join(TraceFrame.leaf_assoc)
+                .group_by(TraceFrame.id)
+                .order_by(*self._trace_frame_order())
+                .all()
+            )
+            return self._load_leaf_assocs(
+                session,
+                self._filter_trace_frames_by_leaves(
+                    session,
+                    results,
+                    trace_frame.kind,
+                    [int(frame.id) for frame in results],
+                ),
             )
 
-        results = (
-            query.join(TraceFrame.leaf_assoc)
-            .group_by(TraceFrame.id)
-            .order_by(TraceFrameLeafAssoc.trace_length, TraceFrame.callee_location)
+        if backwards:
+            key = (trace_frame.caller, trace_frame.caller_port)
+        else:
+            key = (trace_frame.callee, trace_frame.callee_port)
+        return list(
+            self._cached(
+                ("next", trace_frame.kind, backwards)
+                + key
+                + (self._leaf_filter(trace_frame.kind),),
+                query,
+            )
         )
-        filter_leaves = (
-            self.sources if trace_frame.kind == TraceKind.POSTCONDITION else self.sinks
+
+    def _leaf_filter(self, kind: TraceKind) -> FrozenSet[str]:
+        return frozenset(
+            self.sources if kind == TraceKind.POSTCONDITION else self.sinks
         )
 
-        filtered_results = []
-        for frame in results:
-            if filter_leaves.intersection(
-                set(
-                    self._get_leaves_trace_frame(
-                        session,
-                        int(frame.id),
-                        self._trace_kind_to_shared_text_kind(frame.kind),
-                    )
-                )
-            ):
-                filtered_results.append(frame)
+    def _cached(self, key: Tuple, compute: Callable[[], T]) -> T:
+        """Results of queries that only depend on the current run and `key`.
+        The cache is cleared whenever the run changes."""
+        return self.cache.get((self.current_run_id,) + key, compute)
 
-        return filtered_results
+    def _filter_trace_frames_by_leaves(
+        self,
+        session: Session,
+        trace_frames: List[TraceFrame],
+        kind: TraceKind,
+        trace_frame_ids: Union[Query, List[int]],
+    ) -> List[TraceFrame]:
+        """Keeps the trace frames that lead to a leaf in the sources or sinks
+        filter. trace_frame_ids selects the leaves to fetch in one query."""
+        filter_leaves = self._leaf_filter(kind)
+        leaves = self._get_leaves_trace_frames(
+            session, trace_frame_ids, self._trace_kind_to_shared_text_kind(kind)
+        )
+        return [
+            frame
+            for frame in trace_frames
+            if filter_leaves.intersection(leaves[int(frame.id)])
+        ]
 
     def _create_issue_output_string(
         self, issue: IssueQueryResult, sources: Set[str], sinks: Set[str]
@@ -1304,10 +1814,15 @@ details()         show additional information about the current trace frame
         )
 
     def _select_parent_trace_frame(
-        self, parent_trace_frames: List[TraceFrame]
+        self, parent_trace_frames: List[TraceFrame], total: Optional[int] = None
     ) -> TraceFrame:
         for i, parent in enumerate(parent_trace_frames):
             print(f"[{i + 1}] {parent.caller} : {parent.caller_port}")
+        if total is not None and total > len(parent_trace_frames):
+            print(
+                f"Showing {len(parent_trace_frames)}/{total} parents. To see more, "
+                f"call 'parents' with after={int(parent_trace_frames[-1].id)}."
+            )
         parent_number = self._prompt_for_number(
             "Parent number", len(parent_trace_frames)
         )
@@ -1360,6 +1875,14 @@ details()         show additional information about the current trace frame
         return page.page if use_pager else page.display_page
 
     def _get_current_issue(self, session: Session) -> IssueQueryResult:
+        return self._cached(
+            ("issue", self.current_issue_instance_id),
+            lambda: self._query_issue(session, self.current_issue_instance_id),
+        )
+
+    def _query_issue(
+        self, session: Session, issue_instance_id: int
+    ) -> IssueQueryResult:
         return (
             session.query(
                 IssueInstance.id,
@@ -1369,7 +1892,7 @@ details()         show additional information about the current trace frame
                 Issue.callable,
                 SharedText.contents,
             )
-            .filter(IssueInstance.id == self.current_issue_instance_id)
+            .filter(IssueInstance.id == issue_instance_id)
             .join(Issue, IssueInstance.issue_id == Issue.id)
             .join(SharedText, SharedText.id == IssueInstance.message_id)
             .first()
@@ -1377,6 +1900,18 @@ details()         show additional information about the current trace frame
 
     def _get_leaves_issue_instance(
         self, session: Session, issue_instance_id: int, kind: SharedTextKind
+    ) -> Set[str]:
+        return set(
+            self._cached(
+                ("issue_leaves", int(issue_instance_id), kind),
+                lambda: self._query_leaves_issue_instance(
+                    session, issue_instance_id, kind
+                ),
+            )
+        )
+
+    def _query_leaves_issue_instance(
+        self, session: Session, issue_instance_id: int, kind: SharedTextKind
     ) -> Set[str]:
         message_ids = [
             int(id)
@@ -1391,18 +1926,62 @@ details()         show additional information about the current trace frame
         ]
         return self._leaf_dict_lookups(message_ids, kind)
 
+    def _get_leaves_issue_instances(
+        self, session: Session, issue_instance_ids: List[int]
+    ) -> Tuple[DefaultDict[int, Set[str]], DefaultDict[int, Set[str]]]:
+        """Sources and sinks of many issue instances, with one query."""
+        sources: DefaultDict[int, Set[str]] = defaultdict(set)
+        sinks: DefaultDict[int, Set[str]] = defaultdict(set)
+        for issue_instance_id, shared_text_id in session.query(
+            IssueInstanceSharedTextAssoc.issue_instance_id,
+            IssueInstanceSharedTextAssoc.shared_text_id,
+        ).filter(
+            IssueInstanceSharedTextAssoc.issue_instance_id.in_(issue_instance_ids)
+        ):
+            # Features are in neither of the dicts
+            if int(shared_text_id) in self.sources_dict:
+                sources[int(issue_instance_id)].add(
+                    self.sources_dict[int(shared_text_id)]
+                )
+            if int(shared_text_id) in self.sinks_dict:
+                sinks[int(issue_instance_id)].add(self.sinks_dict[int(shared_text_id)])
+        return sources, sinks
+
     def _get_leaves_trace_frame(
         self, session: Session, trace_frame_id: int, kind: SharedTextKind
     ) -> Set[str]:
-        message_ids = [
-            int(id)
-            for id, in session.query(SharedText.id)
-            .distinct(SharedText.id)
-            .join(TraceFrameLeafAssoc, SharedText.id == TraceFrameLeafAssoc.leaf_id)
-            .filter(TraceFrameLeafAssoc.trace_frame_id == trace_frame_id)
-            .filter(SharedText.kind == kind)
-        ]
-        return self._leaf_dict_lookups(message_ids, kind)
+        def query() -> Set[str]:
+            message_ids = [
+                int(id)
+                for id, in session.query(SharedText.id)
+                .distinct(SharedText.id)
+                .join(TraceFrameLeafAssoc, SharedText.id == TraceFrameLeafAssoc.leaf_id)
+                .filter(TraceFrameLeafAssoc.trace_frame_id == trace_frame_id)
+                .filter(SharedText.kind == kind)
+            ]
+            return self._leaf_dict_lookups(message_ids, kind)
+
+        # Callers may modify the set
+        return set(self._cached(("leaves", int(trace_frame_id), kind), query))
+
+    def _get_leaves_trace_frames(
+        self,
+        session: Session,
+        trace_frame_ids: Union[Query, List[int]],
+        kind: SharedTextKind,
+    ) -> DefaultDict[int, Set[str]]:
+        """Like _get_leaves_trace_frame, for many trace frames at once."""
+        leaf_dict = (
+            self.sources_dict if kind == SharedTextKind.SOURCE else self.sinks_dict
+        )
+        leaves: DefaultDict[int, Set[str]] = defaultdict(set)
+        for trace_frame_id, leaf_id in session.query(
+            TraceFrameLeafAssoc.trace_frame_id, TraceFrameLeafAssoc.leaf_id
+        ).filter(TraceFrameLeafAssoc.trace_frame_id.in_(trace_frame_ids)):
+            # The lookup only succeeds for leaves of the given kind
+            if int(leaf_id) in leaf_dict:
+                leaves[int(trace_frame_id)].add(leaf_dict[int(leaf_id)])
+        return leaves
 
     def _leaf_dict_lookups(
         self, message_ids: List[int], kind: SharedTextKind
@@ -1422,10 +2001,11 @@ details()         show additional information about the current trace frame
 
     def _show_current_trace_frame(self):
         with self.db.make_session() as session:
-            trace_frame = (
-                session.query(TraceFrame)
+            trace_frame = self._cached(
+                ("frame", self.current_frame_id),
+                lambda: session.query(TraceFrame)
                 .filter(TraceFrame.id == self.current_frame_id)
-                .scalar()
+                .scalar(),
             )
 
         page.display_page(self._create_trace_frame_output_string(trace_frame))
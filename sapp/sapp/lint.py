@@ -1,14 +1,88 @@
 #!/usr/bin/env python3
 
 import json
+import logging
+import os
+import signal
+import socketserver
+import sys
+import threading
+from collections import defaultdict
 from operator import itemgetter
 from pathlib import Path
-from typing import List
+from typing import Any, DefaultDict, Dict, Iterable, List, Optional, Tuple
 
 import click
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
 
 from .cli_lib import require_option
-from .models import Issue, IssueInstance, SharedText, TraceFrame
+from .db import DB
+from .models import Issue, IssueInstance, Run, RunStatus, SharedText, TraceFrame
+
+
+log = logging.getLogger("sapp")
+
+LintEntry = Dict[str, Any]
+
+
+def _sort_key(entry: LintEntry):
+    return itemgetter("filename", "line", "code", "col")(entry)
+
+
+def _lint_entries(
+    session: Session, run_id: int, root: Path, filenames: Optional[List[str]] = None
+) -> List[Tuple[str, LintEntry]]:
+    """Lint entries of the run in the given files, relative to root, or in all
+    files of the run. Each comes with the filename as stored in the run."""
+    instances = (
+        session.query(
+            IssueInstance.filename,
+            IssueInstance.location,
+            SharedText.contents,
+            Issue.code,
+        )
+        .filter(IssueInstance.run_id == run_id)
+        .join(Issue, Issue.id == IssueInstance.issue_id)
+        .join(SharedText, SharedText.id == IssueInstance.message_id)
+    )
+    frames = session.query(
+        TraceFrame.caller,
+        TraceFrame.callee,
+        TraceFrame.filename,
+        TraceFrame.callee_location,
+        TraceFrame.kind,
+        TraceFrame.callee_port,
+        TraceFrame.caller_port,
+    ).filter(TraceFrame.run_id == run_id)
+    if filenames is not None:
+        instances = instances.filter(IssueInstance.filename.in_(filenames))
+        frames = frames.filter(TraceFrame.filename.in_(filenames))
+
+    def entry(filename, code, message, location):
+        return (
+            filename,
+            {
+                "filename": str(root / filename),
+                "code": code,
+                "message": message,
+                "line": location.line_no,
+                "col": location.begin_column,
+                "length": location.begin_column + location.end_column + 1,
+            },
+        )
+
+    return [
+        entry(i.filename, str(i.code), i.contents, i.location) for i in instances
+    ] + [
+        entry(
+            i.filename,
+            i.kind.name,
+            f"{i.caller}:{i.caller_port} -> {i.callee}->{i.callee_port}",
+            i.callee_location,
+        )
+        for i in frames
+    ]
 
 
 @click.command()
@@ -30,57 +104,133 @@ def lint(click_ctx: click.Context, run_id: int, filenames: List[str]) -> None:
     relative = [str(Path(f).relative_to(root)) for f in paths]
 
     with ctx.database.make_session() as session:
-        instances = (
-            session.query(
-                IssueInstance.filename,
-                IssueInstance.location,
-                SharedText.contents,
-                Issue.code,
-            )
-            .filter(IssueInstance.run_id == run_id)
-            .filter(IssueInstance.filename.in_(relative))
-            .join(Issue, Issue.id == IssueInstance.issue_id)
-            .join(SharedText, SharedText.id == IssueInstance.message_id)
-            .all()
-        )
+        lints = [entry for _, entry in _lint_entries(session, run_id, root, relative)]
 
-    with ctx.database.make_session() as session:
-        frames = (
-            session.query(
-                TraceFrame.caller,
-                TraceFrame.callee,
-                TraceFrame.filename,
-                TraceFrame.callee_location,
-                TraceFrame.kind,
-                TraceFrame.callee_port,
-                TraceFrame.caller_port,
-            )
-            .filter(TraceFrame.run_id == run_id)
-            .filter(TraceFrame.filename.in_(relative))
-            .all()
-        )
+    for l in sorted(lints, key=_sort_key):
+        click.echo(json.dumps(l))
 
-    def entry(filename, code, message, location):
-        return {
-            "filename": str(root / filename),
-            "code": code,
-            "message": message,
-            "line": location.line_no,
-            "col": location.begin_column,
-            "length": location.begin_column + location.end_column + 1,
-        }
-
-    lints = [
-        entry(i.filename, str(i.code), i.contents, i.location) for i in instances
-    ] + [
-        entry(
-            i.filename,
-            i.kind.name,
-            f"{i.caller}:{i.caller_port} -> {i.callee}->{i.callee_port}",
-            i.callee_location,
-        )
-        for i in frames
-    ]
 
-    for l in sorted(lints, key=itemgetter("filename", "line", "code", "col")):
-        click.echo(json.dumps(l))
+class LintIndex:
+    """All lint entries of a run, sorted and grouped by their file relative to
+    the repository."""
+
+    def __init__(self, run_id: int, entries: Dict[str, List[LintEntry]]) -> None:
+        self.run_id = run_id
+        self.entries = entries
+
+    @classmethod
+    def load(cls, session: Session, run_id: int, root: Path) -> "LintIndex":
+        entries: DefaultDict[str, List[LintEntry]] = defaultdict(list)
+        for filename, entry in _lint_entries(session, run_id, root):
+            entries[filename].append(entry)
+        for file_entries in entries.values():
+            file_entries.sort(key=_sort_key)
+        return cls(run_id, dict(entries))
+
+    def lint(self, filenames: Iterable[str]) -> List[LintEntry]:
+        lints = []
+        for filename in set(filenames):
+            lints.extend(self.entries.get(filename, []))
+        return sorted(lints, key=_sort_key)
+
+
+class LintServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answers lint requests on a Unix socket from an index of the run kept in
+    memory. Unless a run is given, it serves the latest finished run, and
+    loads a newer one as soon as it shows up."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str,
+        database: DB,
+        repository: str,
+        run_id: Optional[int] = None,
+    ) -> None:
+        self.database = database
+        self.root = Path(repository).resolve()
+        self.pinned_run_id = run_id
+        self.index: Optional[LintIndex] = None
+        # Requests share one database connection
+        self.lock = threading.Lock()
+        super().__init__(socket_path, _LintRequestHandler)
+
+    def current_index(self) -> LintIndex:
+        with self.lock:
+            run_id = self.pinned_run_id
+            if run_id is None:
+                with self.database.make_session() as session:
+                    run_id = (
+                        session.query(func.max(Run.id))
+                        .filter(Run.status == RunStatus.FINISHED)
+                        .scalar()
+                        .resolved()
+                    )
+                if run_id is None:
+                    raise LookupError("No finished runs")
+            if self.index is None or self.index.run_id != run_id:
+                log.info("Loading lints of run %d", run_id)
+                # Sessions only see the run attached before they start
+                self.database.attach_run(run_id)
+                with self.database.make_session() as session:
+                    self.index = LintIndex.load(session, run_id, self.root)
+            return self.index
+
+    def lint(self, filenames: Iterable[str]) -> Dict[str, Any]:
+        index = self.current_index()
+        relative = []
+        for filename in filenames:
+            try:
+                path = (self.root / filename).resolve().relative_to(self.root)
+            except ValueError:
+                continue  # Outside of the repository
+            relative.append(str(path))
+        return {"run_id": index.run_id, "lints": index.lint(relative)}
+
+
+class _LintRequestHandler(socketserver.StreamRequestHandler):
+    server: LintServer
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.lint(request["filenames"])
+            except (ValueError, TypeError, LookupError) as error:
+                response = {"error": f"{type(error).__name__}: {error}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+@click.command(name="lint-daemon")
+@click.pass_context
+@click.option(
+    "--run-id", type=int, help="Serve this run instead of the latest finished one"
+)
+@click.argument(
+    "socket_path", type=click.Path(dir_okay=False, writable=True, resolve_path=True)
+)
+def lint_daemon(click_ctx: click.Context, run_id: Optional[int], socket_path: str):
+    """Serve `lint` output on a Unix socket
+
+    Every request is a line of JSON like {"filenames": ["module/file.py"]},
+    with paths absolute or relative to the repository. Each gets a line of
+    JSON back, {"run_id": 1, "lints": [...]} with the entries `lint` prints,
+    or {"error": "..."}.
+    """
+    ctx = click_ctx.obj
+    require_option(click_ctx, "repository")
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    # Editors stop the daemon with SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with LintServer(socket_path, ctx.database, ctx.repository, run_id) as server:
+        log.info("Serving lints on %s", socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+In-place schema migrations for existing SAPP databases.
+
+models.create() only creates tables that don't exist yet, so changes to
+existing tables (new columns, replaced indexes) are applied here. Every
+migration checks whether it is still needed, which makes migrate() safe to
+run against any database, new or old.
+
+Migrations that only speed things up but take long on large databases (like
+building indexes) are not required. They are skipped when a database is
+opened and applied by `sapp migrate`. So are required migrations that rebuild
+whole tables, but a database can't be written to until they are applied, see
+pending_rebuilds.
+"""
+
+import logging
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import sqlalchemy
+from sqlalchemy import String, bindparam, inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateTable
+
+from . import name_index, warning_code_stats
+from .models import (
+    IssueInstance,
+    PrimaryKey,
+    SharedText,
+    SourceLocation,
+    SourceLocationsType,
+    TraceFrame,
+    TraceFrameAnnotation,
+    TraceFrameAnnotationText,
+)
+
+
+log = logging.getLogger("sapp")
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+class Migration(NamedTuple):
+    name: str
+    is_needed: Callable[[Connection], bool]
+    apply: Callable[[Connection], None]
+    required: bool = True
+    rebuilds_tables: bool = False
+
+    @property
+    def automatic(self) -> bool:
+        """Whether the migration is applied when a database is opened."""
+        return self.required and not self.rebuilds_tables
+
+
+def _column_names(connection: Connection, table_name: str) -> List[str]:
+    return [column["name"] for column in inspect(connection).get_columns(table_name)]
+
+
+def _index_names(connection: Connection, table_name: str) -> List[str]:
+    return [index["name"] for index in inspect(connection).get_indexes(table_name)]
+
+
+def _create_model_index(connection: Connection, table, index_name: str) -> None:
+    if index_name in _index_names(connection, table.name):
+        return
+    index = next(index for index in table.indexes if index.name == index_name)
+    log.info("Creating index %s on %s", index_name, table.name)
+    index.create(connection)
+
+
+def _drop_index(connection: Connection, table_name: str, index_name: str) -> None:
+    if index_name in _index_names(connection, table_name):
+        log.info("Dropping index %s on %s", index_name, table_name)
+        connection.execute(f"DROP INDEX {index_name}")
+
+
+def _shared_text_contents_hash_is_needed(connection: Connection) -> bool:
+    if not _has_table(connection, SharedText.__tablename__):
+        return False
+    return "contents_hash" not in _column_names(connection, SharedText.__tablename__)
+
+
+def _add_shared_text_contents_hash(connection: Connection) -> None:
+    table = SharedText.__table__
+    connection.execute(
+        f"ALTER TABLE {table.name} ADD COLUMN contents_hash BIGINT NOT NULL DEFAULT 0"
+    )
+
+    # Backfill in batches, walking the primary key so each batch is an
+    # index range scan.
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            table.select()
+            .with_only_columns([table.c.id, table.c.contents])
+            .where(table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(
+            table.update()
+            .where(table.c.id == bindparam("row_id"))
+            .values(contents_hash=bindparam("row_hash")),
+            [
+                {
+                    "row_id": int(row.id),
+                    "row_hash": SharedText.hash_contents(row.contents),
+                }
+                for row in rows
+            ],
+        )
+        last_id = int(rows[-1].id)
+
+    _drop_index(connection, table.name, "ix_messages_handle")
+    _drop_index(connection, table.name, "ix_messages_contents")
+    _create_model_index(connection, table, "ix_messages_kind_contents_hash")
+
+
+TRACE_FRAME_NAVIGATION_INDEXES = [
+    "ix_traceframe_run_caller_and_port",
+    "ix_traceframe_run_callee_and_port",
+]
+
+
+def _has_table(connection: Connection, table_name: str) -> bool:
+    # Partitioned databases keep run-scoped tables out of the main file
+    return connection.dialect.has_table(connection, table_name)
+
+
+def _trace_frame_navigation_indexes_are_needed(connection: Connection) -> bool:
+    if not _has_table(connection, TraceFrame.__tablename__):
+        return False
+    return not set(TRACE_FRAME_NAVIGATION_INDEXES).issubset(
+        _index_names(connection, TraceFrame.__tablename__)
+    )
+
+
+def _add_trace_frame_navigation_indexes(connection: Connection) -> None:
+    for index_name in TRACE_FRAME_NAVIGATION_INDEXES:
+        _create_model_index(connection, TraceFrame.__table__, index_name)
+
+
+def _rebuild_table(connection: Connection, table, conversions: Dict[str, str]) -> None:
+    """Recreates table from its model and copies the rows over, passing the
+    columns in conversions through the given SQL functions. SQLite can't
+    change the type of an existing column."""
+    old_name = f"{table.name}_old"
+    existing = set(_column_names(connection, table.name))
+    columns = [column.name for column in table.columns if column.name in existing]
+
+    log.info("Rebuilding %s", table.name)
+    connection.execute(f"ALTER TABLE {table.name} RENAME TO {old_name}")
+    connection.execute(CreateTable(table))
+    connection.execute(
+        "INSERT INTO {table} ({columns}) SELECT {values} FROM {old_name}".format(
+            table=table.name,
+            columns=", ".join(columns),
+            values=", ".join(
+                f"{conversions[column]}({column})" if column in conversions else column
+                for column in columns
+            ),
+            old_name=old_name,
+        )
+    )
+    connection.execute(f"DROP TABLE {old_name}")
+    # Indexes are built after the copy, which is a lot faster than
+    # maintaining them row by row.
+    for index in table.indexes:
+        index.create(connection)
+
+
+LOCATION_TABLES = [
+    (IssueInstance.__table__, {"location": "sapp_location_to_int"}),
+    (
+        TraceFrame.__table__,
+        {"callee_location": "sapp_location_to_int", "titos": "sapp_locations_to_blob"},
+    ),
+    (TraceFrameAnnotation.__table__, {"location": "sapp_location_to_int"}),
+]
+
+
+def _has_string_locations(connection: Connection, table, conversions) -> bool:
+    return any(
+        isinstance(column["type"], String)
+        for column in inspect(connection).get_columns(table.name)
+        if column["name"] in conversions
+    )
+
+
+def _integer_source_locations_are_needed(connection: Connection) -> bool:
+    return any(
+        _has_table(connection, table.name)
+        and _has_string_locations(connection, table, conversions)
+        for table, conversions in LOCATION_TABLES
+    )
+
+
+def _location_to_int(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    return SourceLocation.to_int(SourceLocation.from_string(value))
+
+
+def _locations_to_blob(value: Optional[str]) -> Optional[bytes]:
+    locations_type = SourceLocationsType()
+    return locations_type.process_bind_param(
+        locations_type.process_result_value(value, None), None
+    )
+
+
+def _create_location_functions(connection: Connection) -> None:
+    dbapi_connection = connection.connection
+    dbapi_connection.create_function("sapp_location_to_int", 1, _location_to_int)
+    dbapi_connection.create_function("sapp_locations_to_blob", 1, _locations_to_blob)
+
+
+def _use_integer_source_locations(connection: Connection) -> None:
+    _create_location_functions(connection)
+    for table, conversions in LOCATION_TABLES:
+        if _has_string_locations(connection, table, conversions):
+            log.warning(
+                "Rewriting all %d rows of %s to store source locations as "
+                "integers. This only happens once, but can take a long time "
+                "on a large database.",
+                connection.execute(f"SELECT COUNT(*) FROM {table.name}").scalar(),
+                table.name,
+            )
+            _rebuild_table(connection, table, conversions)
+
+
+def _shared_annotation_texts_are_needed(connection: Connection) -> bool:
+    # Partitioned databases keep annotations in the data files of their runs,
+    # see migrate_run_files
+    if not _has_table(connection, TraceFrameAnnotation.__tablename__):
+        return False
+    return "text_id" not in _column_names(
+        connection, TraceFrameAnnotation.__tablename__
+    )
+
+
+def _share_annotation_texts(connection: Connection) -> None:
+    """Moves the texts of annotations into their own table, one row per
+    distinct text, and rebuilds the annotations to refer to them."""
+    annotations = TraceFrameAnnotation.__table__
+    texts = TraceFrameAnnotationText.__table__
+    old_name = f"{annotations.name}_old"
+    _create_location_functions(connection)
+    connection.connection.create_function(
+        "sapp_annotation_text_hash", 3, TraceFrameAnnotationText.hash_contents
+    )
+    location = "location"
+    if _has_string_locations(connection, annotations, {"location": None}):
+        location = "sapp_location_to_int(location)"
+
+    log.info("Moving the texts of %s into %s", annotations.name, texts.name)
+    texts.create(connection, checkfirst=True)
+    # Each text takes the id of the first annotation with it. Annotation ids
+    # are unique across runs, so this holds for the texts of partitioned runs
+    # as well.
+    connection.execute(
+        f"INSERT INTO {texts.name} (id, contents_hash, message, link, trace_key) "
+        "SELECT MIN(id), sapp_annotation_text_hash(message, link, trace_key), "
+        "message, link, trace_key FROM ("
+        "SELECT id, message, COALESCE(link, '') AS link, "
+        f"COALESCE(trace_key, '') AS trace_key FROM {annotations.name}"
+        ") GROUP BY message, link, trace_key"
+    )
+    connection.execute(f"ALTER TABLE {annotations.name} RENAME TO {old_name}")
+    connection.execute(CreateTable(annotations))
+    connection.execute(
+        f"INSERT INTO {annotations.name} (id, location, text_id, trace_frame_id) "
+        f"SELECT a.id, {location}, t.id, a.trace_frame_id "
+        f"FROM {old_name} a JOIN {texts.name} t ON t.message = a.message "
+        "AND t.link = COALESCE(a.link, '') "
+        "AND t.trace_key = COALESCE(a.trace_key, '')"
+    )
+    connection.execute(f"DROP TABLE {old_name}")
+    for index in annotations.indexes:
+        index.create(connection)
+    if _has_table(connection, PrimaryKey.__tablename__):
+        _start_annotation_text_ids(connection)
+
+
+def _start_annotation_text_ids(connection: Connection) -> None:
+    """New texts get ids after all annotations saved so far, which are
+    beyond the ids of the moved texts."""
+    connection.execute(
+        f"INSERT INTO {PrimaryKey.__tablename__} (table_name, current_id) "
+        f"SELECT '{TraceFrameAnnotationText.__name__}', current_id "
+        f"FROM {PrimaryKey.__tablename__} "
+        f"WHERE table_name = '{TraceFrameAnnotation.__name__}' "
+        f"AND NOT EXISTS (SELECT 1 FROM {PrimaryKey.__tablename__} "
+        f"WHERE table_name = '{TraceFrameAnnotationText.__name__}')"
+    )
+
+
+def _name_index_backfill_is_needed(connection: Connection) -> bool:
+    if not name_index.exists(connection):
+        return False
+    # The names of partitioned runs are only indexed when they are saved
+    if not _has_table(connection, TraceFrame.__tablename__):
+        return False
+    return name_index.has_unindexed_runs(connection)
+
+
+def _warning_code_stats_backfill_is_needed(connection: Connection) -> bool:
+    # Partitioned runs only get stats when they are saved
+    if not _has_table(connection, IssueInstance.__tablename__):
+        return False
+    return warning_code_stats.has_runs_without_stats(connection)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        name="shared_text_contents_hash",
+        is_needed=_shared_text_contents_hash_is_needed,
+        apply=_add_shared_text_contents_hash,
+    ),
+    Migration(
+        name="trace_frame_navigation_indexes",
+        is_needed=_trace_frame_navigation_indexes_are_needed,
+        apply=_add_trace_frame_navigation_indexes,
+        required=False,
+    ),
+    # Before integer_source_locations, which rebuilds tables from the current
+    # models
+    Migration(
+        name="shared_annotation_texts",
+        is_needed=_shared_annotation_texts_are_needed,
+        apply=_share_annotation_texts,
+        rebuilds_tables=True,
+    ),
+    Migration(
+        name="integer_source_locations",
+        is_needed=_integer_source_locations_are_needed,
+        apply=_use_integer_source_locations,
+        rebuilds_tables=True,
+    ),
+    Migration(
+        name="name_index_backfill",
+        is_needed=_name_index_backfill_is_needed,
+        apply=name_index.backfill,
+        required=False,
+    ),
+    Migration(
+        name="warning_code_stats_backfill",
+        is_needed=_warning_code_stats_backfill_is_needed,
+        apply=warning_code_stats.backfill,
+        required=False,
+    ),
+]
+
+
+def pending(engine: Engine, include_optional: bool = True) -> List[Migration]:
+    with engine.connect() as connection:
+        return [
+            migration
+            for migration in MIGRATIONS
+            if (migration.automatic or include_optional)
+            and migration.is_needed(connection)
+        ]
+
+
+def migrate(engine: Engine, include_optional: bool = False) -> List[str]:
+    """Applies all pending migrations, each in its own transaction. Returns
+    the names of the migrations that were applied. Migrations that aren't
+    required or that rebuild tables are only applied with
+    include_optional=True."""
+    applied = []
+    with engine.connect() as connection:
+        for migration in MIGRATIONS:
+            if not migration.is_needed(connection):
+                continue
+            if not (migration.automatic or include_optional):
+                log.info(
+                    "Migration %s is pending, run `sapp migrate` to apply it",
+                    migration.name,
+                )
+                continue
+            log.info("Applying migration %s", migration.name)
+            with connection.begin():
+                migration.apply(connection)
+            applied.append(migration.name)
+    return applied
+
+
+# Migrations of run-scoped tables, which partitioned databases keep in the
+# data files of their runs. migrate_run_files applies them, and only `sapp
+# migrate` calls it.
+RUN_FILE_MIGRATIONS: List[Migration] = [
+    Migration(
+        name="shared_annotation_texts",
+        is_needed=_shared_annotation_texts_are_needed,
+        apply=_share_annotation_texts,
+        rebuilds_tables=True,
+    ),
+]
+
+
+def _run_file_migrations(path: str, apply: bool) -> List[str]:
+    engine = sqlalchemy.create_engine(
+        sqlalchemy.engine.url.URL("sqlite", database=path)
+    )
+    names = []
+    try:
+        with engine.connect() as connection:
+            for migration in RUN_FILE_MIGRATIONS:
+                if not migration.is_needed(connection):
+                    continue
+                if apply:
+                    with connection.begin():
+                        migration.apply(connection)
+                names.append(migration.name)
+    finally:
+        engine.dispose()
+    return names
+
+
+def pending_run_file_migrations(run_files: Dict[int, str]) -> List[str]:
+    """Names of the RUN_FILE_MIGRATIONS that migrate_run_files would apply."""
+    if not run_files:
+        return []
+    return _run_file_migrations(run_files[min(run_files)], apply=False)
+
+
+def pending_rebuilds(engine: Engine, run_files: Dict[int, str]) -> List[str]:
+    """Names of the pending migrations that rebuild tables, which keep the
+    database from being written to until `sapp migrate` applies them."""
+    with engine.connect() as connection:
+        names = [
+            migration.name
+            for migration in MIGRATIONS
+            if migration.rebuilds_tables and migration.is_needed(connection)
+        ]
+    return sorted(set(names + pending_run_file_migrations(run_files)))
+
+
+def migrate_run_files(engine: Engine, run_files: Dict[int, str]) -> List[str]:
+    """Applies RUN_FILE_MIGRATIONS to the data files of a partitioned
+    database, and returns the names of the migrations that were applied.
+
+    New runs are created with the current schema, so files are migrated from
+    the newest run to the oldest, and only the oldest is checked up front.
+    An interrupted migration leaves the oldest run unmigrated and continues
+    the next time."""
+    if not pending_run_file_migrations(run_files):
+        return []
+    with engine.begin() as connection:
+        _start_annotation_text_ids(connection)
+    applied = set()
+    for run_id in sorted(run_files, reverse=True):
+        log.info("Migrating the data file of run %d", run_id)
+        applied.update(_run_file_migrations(run_files[run_id], apply=True))
+    return sorted(applied)
@@ -450,6 +450,11 @@ class ModelGenerator(PipelineStep[DictEntries, TraceGraph]):
             if "extra_trace" in f:
                 annotation = f["extra_trace"]
                 location = annotation["position"]
+                text = self.graph.get_or_add_annotation_text(
+                    annotation["msg"],
+                    annotation.get("link", None),
+                    annotation.get("trace", None),
+                )
                 self.graph.add_trace_annotation(
                     TraceFrameAnnotation.Record(
                         id=DBID(),
@@ -457,9 +462,7 @@ class ModelGenerator(PipelineStep[DictEntries, TraceGraph]):
                         location=SourceLocation(
                             location["line"], location["start"], location["end"]
                         ),
-                        message=annotation["msg"],
-                        link=annotation.get("link", None),
-                        trace_key=annotation.get("trace", None),
+                        text_id=text.id,
                     )
                 )
 
@@ -2,12 +2,15 @@
 
 import enum
 import logging
+import struct
 from collections import namedtuple
 from itertools import islice, tee
 from typing import Any, Dict, List, Optional, Set, Tuple, Type
 
+import xxhash
 from munch import Munch
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
@@ -15,6 +18,7 @@ from sqlalchemy import (
     Float,
     Index,
     Integer,
+    LargeBinary,
     MetaData,
     String,
     Table,
@@ -22,7 +26,6 @@ from sqlalchemy import (
     exc,
     func,
     inspect,
-    or_,
     types,
 )
 from sqlalchemy.dialects import mysql, sqlite
@@ -32,7 +35,6 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Session, relationship
 
 from .errors import AIException
-from .iterutil import split_every
 
 
 log = logging.getLogger("sapp")
@@ -53,9 +55,6 @@ HANDLE_LENGTH = 255
 MESSAGE_LENGTH = 4096
 SHARED_TEXT_LENGTH = 4096
 
-"""Number of variables that can safely be set on a single DB call"""
-BATCH_SIZE = 450
-
 """Models used to represent DB entries
 
 An Issue is a particular problem found. It can exist across multiple commits.  A
@@ -135,25 +134,9 @@ class PrepareMixin(object):
 
         # Find existing items.
         existing_ids = {}  # map of item_hash -> existing ID
-        cls_attrs = [getattr(cls, attr.key) for attr in attrs]
-        for fetch_keys in split_every(BATCH_SIZE, keys.values()):
-            filters = []
-            for fetch_key in fetch_keys:
-                # Sub-filters for checking if item with fetch_key is in the DB
-                # Example: [
-                #   SharedText.kind.__eq__("feature"),
-                #   SharedText.contents.__eq__("via tito"),
-                # ]
-                subfilter = [
-                    getattr(cls, attr).__eq__(val) for attr, val in fetch_key.items()
-                ]
-                filters.append(and_(*subfilter))
-            existing_items = (
-                session.query(cls.id, *cls_attrs).filter(or_(*(filters))).all()
-            )
-            for existing_item in existing_items:
-                item_hash = hash_item(existing_item)
-                existing_ids[item_hash] = existing_item.id
+        for existing_item in cls._find_existing_keys(session, keys.values(), attrs):
+            item_hash = hash_item(existing_item)
+            existing_ids[item_hash] = existing_item.id
 
         # Now see if we can merge
         new_items = {}
@@ -170,6 +153,47 @@ class PrepareMixin(object):
                 new_items[item_hash] = i
                 yield i
 
+    @classmethod
+    def _find_existing_keys(cls, session, keys, attrs):
+        """Returns (id, *attrs) rows of cls for the keys already in the DB.
+
+        Rather than building one giant OR filter per batch of keys, the keys
+        are bulk loaded into a temporary table and resolved with a single join
+        against the (indexed) key columns of cls.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+
+        key_table = Table(
+            "tmp_merge_%s" % cls.__tablename__,
+            MetaData(),
+            *[Column(attr.key, attr.property.columns[0].type) for attr in attrs],
+            prefixes=["TEMPORARY"],
+        )
+        connection = session.connection()
+        key_table.drop(connection, checkfirst=True)
+        key_table.create(connection)
+        try:
+            session.execute(key_table.insert(), keys)
+            cls_attrs = [getattr(cls, attr.key) for attr in attrs]
+            return (
+                session.query(cls.id, *cls_attrs)
+                .select_from(key_table)
+                .join(
+                    cls,
+                    and_(
+                        *[
+                            cls_attr == key_table.c[cls_attr.key]
+                            for cls_attr in cls_attrs
+                        ]
+                    ),
+                )
+                .all()
+            )
+        finally:
+            key_table.drop(connection)
+
     @classmethod
     def _merge_assocs(cls, session, items, id1, id2):
         new_items = {}
@@ -199,6 +223,8 @@ class RecordMixin(object):
             mapper = inspect(cls)
             keys = [c.key for c in mapper.column_attrs] + ["model"] + extra_fields
             cls._record = namedtuple(cls.__name__ + "Record", keys)
+            # The class isn't in the module, so pickle can't find it by name
+            cls._record.__reduce__ = _reduce_record
 
         return cls._record(model=cls, **kwargs)
 
@@ -207,6 +233,15 @@ class RecordMixin(object):
         return obj._asdict()
 
 
+def _reduce_record(record):
+    fields = record._asdict()
+    return (_make_record, (fields.pop("model"), fields))
+
+
+def _make_record(model, fields):
+    return model.Record(**fields)
+
+
 class MutableRecordMixin(object):
     @classmethod
     def Record(cls, **kwargs):
@@ -251,6 +286,36 @@ class SourceLocation(object):
             map(str, [location.line_no, location.begin_column, location.end_column])
         )
 
+    @staticmethod
+    def to_int(location) -> int:
+        """Packs a location into 64 bits: the line number in the upper 32 bits,
+        then 16 bits each for the begin and end columns. Ordering the packed
+        values orders locations by line, then column. Columns that don't fit
+        are clamped, with a warning."""
+        return (
+            (int(location.line_no) << 32)
+            | (_clamp_column(location, location.begin_column) << 16)
+            | _clamp_column(location, location.end_column)
+        )
+
+    @staticmethod
+    def from_int(value: int) -> "SourceLocation":
+        return SourceLocation(value >> 32, (value >> 16) & 0xFFFF, value & 0xFFFF)
+
+
+def _clamp_column(location, column) -> int:
+    column = int(column)
+    if 0 <= column <= 0xFFFF:
+        return column
+    clamped = min(max(column, 0), 0xFFFF)
+    log.warning(
+        "Column %d of location %s is out of range, storing %d instead",
+        column,
+        SourceLocation.to_string(location),
+        clamped,
+    )
+    return clamped
+
 
 class CaseSensitiveStringType(types.TypeDecorator):
     impl = types.String
@@ -271,57 +336,93 @@ class CaseSensitiveStringType(types.TypeDecorator):
 class SourceLocationType(types.TypeDecorator):
     """Defines a new type of SQLAlchemy to store source locations.
 
-    In python land we use SourceLocation, but when stored in the databae we just
-    split the fields with |
+    In python land we use SourceLocation, but when stored in the database we
+    pack the fields into one integer (see SourceLocation.to_int). Databases
+    created before that stored them as "line|start|end" strings, which are
+    still understood.
     """
 
-    impl = types.String
-
-    def __init__(self):
-        super(SourceLocationType, self).__init__(length=255)
+    impl = types.BigInteger
 
     def process_bind_param(self, value, dialect):
         """
-        SQLAlchemy uses this to convert a SourceLocation object into a string.
+        SQLAlchemy uses this to convert a SourceLocation object into an int.
+        Plain ints are passed through, for comparisons like in_lines().
         """
-        if value is None:
-            return None
-        return SourceLocation.to_string(value)
+        if value is None or isinstance(value, int):
+            return value
+        return SourceLocation.to_int(value)
 
     def process_result_value(self, value, dialect):
         """
-        SQLAlchemy uses this to convert a string into a SourceLocation object.
-        We separate the fields by a |
+        SQLAlchemy uses this to convert an int into a SourceLocation object.
         """
         if value is None:
             return None
+        if isinstance(value, str):
+            return SourceLocation(*map(int, value.split("|")))
+        return SourceLocation.from_int(value)
 
-        p = value.split("|")
-
-        if len(p) == 0:
-            return None
-        return SourceLocation(*map(int, p))
+    @staticmethod
+    def in_lines(column, first_line: int, last_line: int):
+        """Filters column to locations on lines first_line to last_line,
+        inclusive. This is a range over the stored integers, so it can use an
+        index on the column."""
+        return column.between(first_line << 32, ((last_line + 1) << 32) - 1)
 
 
 class SourceLocationsType(types.TypeDecorator):
-    """Defines a type to store multiple source locations in a single string"""
+    """Defines a type to store multiple source locations in a single column,
+    as packed little-endian 64-bit integers. Comma separated location strings
+    from older databases are still understood."""
 
-    impl = types.String
+    impl = types.LargeBinary
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return struct.pack(
+            "<%dq" % len(value), *[SourceLocation.to_int(l) for l in value]
+        )
+
+    def result_processor(self, dialect, coltype):
+        # LargeBinary's own result processing fails on the strings stored by
+        # older databases and by the server default, so it is skipped.
+        return lambda value: self.process_result_value(value, dialect)
+
+    def process_result_value(self, value, dialect):
+        if not value:
+            return []
+        if isinstance(value, str):
+            return [
+                SourceLocation(*map(int, location.split("|")))
+                for location in value.split(",")
+            ]
+        return [
+            SourceLocation.from_int(location)
+            for location in struct.unpack("<%dq" % (len(value) // 8), value)
+        ]
+
+
+class IntegersType(types.TypeDecorator):
+    """Defines a type to store a list of integers in a single column, as packed
+    little-endian 64-bit integers. DBIDs are resolved when the row is written.
+    """
 
-    def __init__(self):
-        super(SourceLocationsType, self).__init__(length=4096)
+    impl = types.LargeBinary
 
     def process_bind_param(self, value, dialect):
         if value is None:
             return None
-        return ",".join([SourceLocation.to_string(l) for l in value])
+        return struct.pack(
+            "<%dq" % len(value),
+            *[int(v.resolved()) if isinstance(v, DBID) else v for v in value],
+        )
 
     def process_result_value(self, value, dialect):
-        if value is None or value == "":
+        if not value:
             return []
-        assert isinstance(value, str), "Invalid SourceLocationsType %s" % str(value)
-        locations = value.split(",")
-        return [SourceLocation.from_string(location) for location in locations]
+        return list(struct.unpack("<%dq" % (len(value) // 8), value))
 
 
 # The following three DBID classes require some explanation. Normally models
@@ -522,12 +623,20 @@ class SharedText(Base, PrepareMixin, RecordMixin):  # noqa
 
     __tablename__ = "messages"
 
-    __table_args__ = (Index("ix_messages_handle", "contents", "kind"),)
+    __table_args__ = (Index("ix_messages_kind_contents_hash", "kind", "contents_hash"),)
 
     id: DBID = Column(BIGDBIDType, primary_key=True)
 
-    contents: str = Column(
-        String(length=SHARED_TEXT_LENGTH), nullable=False, index=True
+    contents: str = Column(String(length=SHARED_TEXT_LENGTH), nullable=False)
+
+    contents_hash: int = Column(
+        BigInteger,
+        nullable=False,
+        server_default="0",
+        default=lambda context: SharedText.hash_contents(
+            context.get_current_parameters()["contents"]
+        ),
+        doc="Fixed width hash of contents, used for lookups instead of contents",
     )
 
     kind: SharedTextKind = Column(
@@ -550,14 +659,30 @@ class SharedText(Base, PrepareMixin, RecordMixin):  # noqa
         primaryjoin=("SharedText.id == foreign(TraceFrameLeafAssoc.leaf_id)"),
     )
 
+    @staticmethod
+    def hash_contents(contents: str) -> int:
+        """xxhash64 of contents, folded into a signed 64-bit integer so it fits
+        in a BIGINT column."""
+        digest = xxhash.xxh64_intdigest(contents.encode("utf-8"))
+        return digest - (1 << 64) if digest >= (1 << 63) else digest
+
+    @classmethod
+    def Record(cls, extra_fields=None, **kwargs):
+        if "contents_hash" not in kwargs:
+            kwargs["contents_hash"] = cls.hash_contents(kwargs["contents"])
+        return super().Record(extra_fields, **kwargs)
+
     @classmethod
     def merge(cls, session, items):
+        # The lookup goes through the (kind, contents_hash) index. Joining on
+        # contents as well guards against hash collisions.
         return cls._merge_by_keys(
             session,
             items,
             lambda item: "%s:%s" % (item.contents, item.kind),
-            cls.contents,
             cls.kind,
+            cls.contents_hash,
+            cls.contents,
         )
 
 
@@ -872,7 +997,7 @@ class RunStatus(enum.Enum):
         return cls.failed
 
 
-CURRENT_DB_VERSION = 1
+CURRENT_DB_VERSION = 2
 
 
 class Run(Base):  # noqa
@@ -967,6 +1092,21 @@ class Run(Base):  # noqa
             alarm_counts=self._get_alarm_counts(session),
         )
 
+    def get_summary_from_stats(self, stats: List["WarningCodeRunStats"]):
+        """Like get_summary, but from the stats of the run's warning codes
+        instead of counting its issue instances."""
+        return RunSummary(
+            commit_hash=self.commit_hash,
+            differential_id=self.differential_id,
+            id=self.id.resolved(),
+            job_id=self.job_id,
+            num_new_issues=sum(code_stats.new_issue_count for code_stats in stats),
+            num_total_issues=sum(code_stats.issue_count for code_stats in stats),
+            alarm_counts={
+                code_stats.code: code_stats.issue_count for code_stats in stats
+            },
+        )
+
     def new_issue_instances(self):
         session = Session.object_session(self)
         return (
@@ -1082,6 +1222,21 @@ class TraceFrame(Base, PrepareMixin, RecordMixin):  # noqa
     __table_args__ = (
         Index("ix_traceframe_caller", "caller"),
         Index("ix_traceframe_caller_and_port", "caller", "caller_port"),
+        # Trace navigation looks up the frames of a run in both directions
+        Index(
+            "ix_traceframe_run_caller_and_port",
+            "run_id",
+            "kind",
+            "caller",
+            "caller_port",
+        ),
+        Index(
+            "ix_traceframe_run_callee_and_port",
+            "run_id",
+            "kind",
+            "callee",
+            "callee_port",
+        ),
     )
 
     id: DBID = Column(BIGDBIDType, nullable=False, primary_key=True)
@@ -1114,7 +1269,7 @@ class TraceFrame(Base, PrepareMixin, RecordMixin):  # noqa
     callee_location = Column(
         SourceLocationType,
         nullable=False,
-        doc="The location of the callee in the source code (line|start|end)",
+        doc="The location of the callee in the source code",
     )
 
     callee_port: str = Column(
@@ -1203,31 +1358,130 @@ class TraceFrameAnnotation(Base, PrepareMixin, RecordMixin):  # noqa
         SourceLocationType, nullable=False, doc="The location for the message"
     )
 
+    text_id: DBID = Column(
+        BIGDBIDType,
+        nullable=False,
+        doc="The message, link and trace key, shared with other annotations",
+    )
+
+    text = relationship(
+        "TraceFrameAnnotationText",
+        primaryjoin=(
+            "TraceFrameAnnotationText.id == " "foreign(TraceFrameAnnotation.text_id)"
+        ),
+        uselist=False,
+    )
+
+    trace_frame_id: DBID = Column(BIGDBIDType, nullable=False, index=True)
+    trace_frame = relationship(
+        "TraceFrame",
+        primaryjoin=(
+            "TraceFrame.id == " "foreign(TraceFrameAnnotation.trace_frame_id)"
+        ),
+        uselist=True,
+    )
+
+    @property
+    def message(self) -> str:
+        return self.text.message
+
+    @property
+    def link(self) -> Optional[str]:
+        return self.text.link or None
+
+    @property
+    def trace_key(self) -> Optional[str]:
+        return self.text.trace_key or None
+
+
+class TraceFrameAnnotationText(Base, PrepareMixin, RecordMixin):  # noqa
+    """The text of trace frame annotations. Analyses attach the same few
+    annotations to many frames, so each text is stored once. A missing link
+    or trace key is stored as an empty string, which lets merging match on
+    all columns."""
+
+    __tablename__ = "trace_frame_annotation_texts"
+
+    __table_args__ = (
+        Index("ix_trace_frame_annotation_texts_contents_hash", "contents_hash"),
+    )
+
+    id: DBID = Column(BIGDBIDType, nullable=False, primary_key=True)
+
+    contents_hash: int = Column(
+        BigInteger,
+        nullable=False,
+        doc="Fixed width hash of the other columns, used for lookups",
+    )
+
     message: str = Column(
         String(length=4096),
         doc="Message describing info about the trace",
         nullable=False,
     )
 
-    link: Optional[str] = Column(
+    link: str = Column(
         String(length=4096),
         doc="An optional URL linking the message to more info (Quandary)",
-        nullable=True,
+        nullable=False,
+        server_default="",
     )
 
-    trace_key: Optional[str] = Column(
+    trace_key: str = Column(
         String(length=INNODB_MAX_INDEX_LENGTH),
-        nullable=True,
+        nullable=False,
+        server_default="",
         doc="Link to possible pre/post traces (caller_condition).",
     )
 
-    trace_frame_id: DBID = Column(BIGDBIDType, nullable=False, index=True)
-    trace_frame = relationship(
-        "TraceFrame",
-        primaryjoin=(
-            "TraceFrame.id == " "foreign(TraceFrameAnnotation.trace_frame_id)"
-        ),
-        uselist=True,
+    @staticmethod
+    def hash_contents(message: str, link: str, trace_key: str) -> int:
+        return SharedText.hash_contents("\0".join([message, link, trace_key]))
+
+    @classmethod
+    def Record(cls, extra_fields=None, **kwargs):
+        kwargs["link"] = kwargs.get("link") or ""
+        kwargs["trace_key"] = kwargs.get("trace_key") or ""
+        if "contents_hash" not in kwargs:
+            kwargs["contents_hash"] = cls.hash_contents(
+                kwargs["message"], kwargs["link"], kwargs["trace_key"]
+            )
+        return super().Record(extra_fields, **kwargs)
+
+    @classmethod
+    def merge(cls, session, items):
+        return cls._merge_by_keys(
+            session,
+            items,
+            lambda item: (item.message, item.link, item.trace_key),
+            cls.contents_hash,
+            cls.message,
+            cls.link,
+            cls.trace_key,
+        )
+
+
+class ShortestTrace(Base, PrepareMixin, RecordMixin):  # noqa
+    """The trace shown first for an issue instance in one direction: its
+    shortest path of trace frames to a leaf, computed when the run is saved."""
+
+    __tablename__ = "shortest_traces"
+
+    issue_instance_id: DBID = Column(BIGDBIDType, nullable=False, primary_key=True)
+
+    kind = Column(Enum(TraceKind), nullable=False, primary_key=True)
+
+    trace_frame_ids = Column(
+        IntegersType,
+        nullable=False,
+        doc="Trace frames from the issue towards the leaf. If the last one "
+        "isn't a leaf, the next frame is missing.",
+    )
+
+    branches = Column(
+        IntegersType,
+        nullable=False,
+        doc="Number of trace frames to choose from at each step",
     )
 
 
@@ -1358,6 +1612,77 @@ class WarningCodeProperties(Base):  # noqa
     )
 
 
+class WarningCodeRunStats(Base):  # noqa
+    """Counts of the issue instances of a warning code in a run, taken while
+    the run is saved. WarningCodeProperties' computed columns are rolled up
+    from these (see warning_code_stats)."""
+
+    __tablename__ = "warning_code_run_stats"
+
+    run_id = Column(BIGDBIDType, primary_key=True)
+
+    code = Column(Integer, autoincrement=False, primary_key=True)
+
+    issue_count = Column(Integer, nullable=False, doc="Number of issue instances")
+
+    new_issue_count = Column(
+        Integer, nullable=False, doc="Number of instances of new issues"
+    )
+
+    fwd_trace_len_sum = Column(
+        BigInteger,
+        nullable=False,
+        doc="Sum of the instances' min_trace_length_to_sources",
+    )
+
+    fwd_trace_len_count = Column(
+        Integer,
+        nullable=False,
+        doc="Number of instances with a min_trace_length_to_sources",
+    )
+
+    bwd_trace_len_sum = Column(
+        BigInteger,
+        nullable=False,
+        doc="Sum of the instances' min_trace_length_to_sinks",
+    )
+
+    bwd_trace_len_count = Column(
+        Integer,
+        nullable=False,
+        doc="Number of instances with a min_trace_length_to_sinks",
+    )
+
+    rolled_up = Column(
+        Boolean,
+        nullable=False,
+        server_default="0",
+        default=False,
+        doc="True once these counts are added to WarningCodeTotals",
+    )
+
+
+class WarningCodeTotals(Base):  # noqa
+    """Sums of the WarningCodeRunStats of the runs rolled up so far, so that
+    a rollup only has to add the stats of the runs finished since."""
+
+    __tablename__ = "warning_code_totals"
+
+    code = Column(Integer, autoincrement=False, primary_key=True)
+
+    issue_count = Column(BigInteger, nullable=False)
+
+    new_issue_count = Column(BigInteger, nullable=False)
+
+    fwd_trace_len_sum = Column(BigInteger, nullable=False)
+
+    fwd_trace_len_count = Column(BigInteger, nullable=False)
+
+    bwd_trace_len_sum = Column(BigInteger, nullable=False)
+
+    bwd_trace_len_count = Column(BigInteger, nullable=False)
+
+
 class PrimaryKey(Base, PrepareMixin, RecordMixin):  # noqa
 
     __tablename__ = "primary_keys"
@@ -1390,10 +1715,12 @@ class PrimaryKeyGenerator:
         Run,
         TraceFrame,
         TraceFrameAnnotation,
+        TraceFrameAnnotationText,
     }
 
-    # Map from class name to an ID range (next_id, max_reserved_id)
-    pks: Dict[str, Tuple[int, int]] = {}
+    def __init__(self) -> None:
+        # Map from class name to an ID range (next_id, max_reserved_id)
+        self.pks: Dict[str, Tuple[int, int]] = {}
 
     def reserve(
         self,
@@ -1489,5 +1816,34 @@ class PrimaryKeyGenerator:
         return pk
 
 
-def create(engine):
-    Base.metadata.create_all(engine)
+# Tables whose rows all belong to a single run. In a partitioned database
+# these live in one file per run, next to the shared catalog (see DB).
+RUN_SCOPED_TABLES = [
+    IssueInstance.__table__,
+    IssueInstanceFixInfo.__table__,
+    IssueInstanceSharedTextAssoc.__table__,
+    IssueInstanceTraceFrameAssoc.__table__,
+    TraceFrame.__table__,
+    TraceFrameAnnotation.__table__,
+    TraceFrameAnnotationText.__table__,
+    TraceFrameLeafAssoc.__table__,
+    ShortestTrace.__table__,
+]
+
+
+def create(engine, partitioned=False):
+    if partitioned:
+        Base.metadata.create_all(
+            engine,
+            tables=[
+                table
+                for table in Base.metadata.sorted_tables
+                if table not in RUN_SCOPED_TABLES
+            ],
+        )
+    else:
+        Base.metadata.create_all(engine)
+
+
+def create_run_scoped(engine):
+    Base.metadata.create_all(engine, tables=RUN_SCOPED_TABLES)
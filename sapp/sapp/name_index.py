@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Substring search over the names of callables, files and trace frame callers
+and callees.
+
+Filters like `issues(callables="%foo%")` are LIKE patterns, which can't use a
+B-tree index and scan the whole table. SQLite's FTS5 trigram tokenizer answers
+LIKE patterns from an index instead. The distinct names of each field are kept
+in indexed_names, with the FTS5 table name_index over them. Names are added
+when a run is saved, so indexed_runs records the runs whose names are all in
+the index. Filters on other runs fall back to plain LIKE.
+
+The trigram tokenizer needs SQLite 3.34. Without it, and on other databases,
+the tables aren't created and nothing is indexed.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import exc, select, union_all
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+from sqlalchemy.sql import column, table
+
+from .models import Issue, IssueInstance, Run, TraceFrame
+
+
+log = logging.getLogger("sapp")
+
+NAME_INDEX = table("name_index", column("name"), column("field"))
+
+# Name of each indexed field, as stored in indexed_names
+FIELDS: Dict[str, InstrumentedAttribute] = {
+    "callable": Issue.callable,
+    "filename": IssueInstance.filename,
+    "caller": TraceFrame.caller,
+    "callee": TraceFrame.callee,
+}
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS indexed_names (
+        id INTEGER PRIMARY KEY,
+        field VARCHAR(16) NOT NULL,
+        name TEXT NOT NULL,
+        UNIQUE (field, name)
+    )""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS name_index USING fts5(
+        name,
+        field UNINDEXED,
+        content = 'indexed_names',
+        content_rowid = 'id',
+        tokenize = 'trigram'
+    )""",
+    "CREATE TABLE IF NOT EXISTS indexed_runs (run_id INTEGER PRIMARY KEY)",
+]
+
+
+def create(engine: Engine) -> None:
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as connection:
+        try:
+            connection.execute(SCHEMA[1])
+        except exc.OperationalError as error:
+            log.debug("Not creating the name index: %s", error)
+            return
+        for statement in SCHEMA:
+            connection.execute(statement)
+
+
+def is_supported(connection: Connection) -> bool:
+    """Whether create() can create the index on this database."""
+    if connection.dialect.name != "sqlite":
+        return False
+    version = connection.execute("SELECT sqlite_version()").scalar()
+    options = {row[0] for row in connection.execute("PRAGMA compile_options")}
+    return (
+        tuple(int(part) for part in version.split(".")) >= (3, 34)
+        and "ENABLE_FTS5" in options
+    )
+
+
+def exists(connection: Connection) -> bool:
+    return connection.dialect.has_table(connection, "indexed_runs")
+
+
+def field_of(attribute: InstrumentedAttribute) -> Optional[str]:
+    return next(
+        (name for name, indexed in FIELDS.items() if indexed is attribute), None
+    )
+
+
+def names(
+    issues: Iterable, issue_instances: Iterable, trace_frames: Iterable
+) -> Dict[str, Set[str]]:
+    """The names to index for a run, from the records about to be saved."""
+    frames = list(trace_frames)
+    return {
+        "callable": {issue.callable for issue in issues},
+        "filename": {instance.filename for instance in issue_instances},
+        "caller": {frame.caller for frame in frames},
+        "callee": {frame.callee for frame in frames},
+    }
+
+
+def add_run(engine: Engine, run_id: int, names: Dict[str, Set[str]]) -> None:
+    """Adds the names of a run to the index, and marks the run as indexed."""
+    with engine.begin() as connection:
+        if not exists(connection):
+            return
+        last_id = connection.execute("SELECT MAX(id) FROM indexed_names").scalar()
+        connection.execute(
+            "INSERT OR IGNORE INTO indexed_names (field, name) VALUES (?, ?)",
+            [
+                (field, name)
+                for field, field_names in names.items()
+                for name in field_names
+                if name is not None
+            ],
+        )
+        connection.execute(
+            "INSERT INTO name_index (rowid, name, field) "
+            "SELECT id, name, field FROM indexed_names WHERE id > ?",
+            (last_id or 0,),
+        )
+        connection.execute(
+            "INSERT OR IGNORE INTO indexed_runs (run_id) VALUES (?)", (run_id,)
+        )
+
+
+def is_indexed(session: Session, run_id: int) -> bool:
+    if not exists(session.connection()):
+        return False
+    return (
+        session.execute(
+            "SELECT 1 FROM indexed_runs WHERE run_id = :run_id", {"run_id": run_id}
+        ).scalar()
+        is not None
+    )
+
+
+def matching_names(field: str, patterns: List[str]):
+    """Names of the field matching any of the LIKE patterns. FTS5 only uses
+    its index for a single LIKE, so each pattern gets its own select."""
+    return union_all(
+        *[
+            select([NAME_INDEX.c.name])
+            .where(NAME_INDEX.c.name.like(pattern))
+            .where(NAME_INDEX.c.field == field)
+            for pattern in patterns
+        ]
+    )
+
+
+def backfill(connection: Connection) -> None:
+    """Indexes the names of all runs already in the database."""
+    for field, attribute in FIELDS.items():
+        name, table_name = attribute.key, attribute.class_.__tablename__
+        connection.execute(
+            "INSERT OR IGNORE INTO indexed_names (field, name) "
+            f"SELECT DISTINCT ?, {name} FROM {table_name} WHERE {name} IS NOT NULL",
+            (field,),
+        )
+    connection.execute("INSERT INTO name_index (name_index) VALUES ('rebuild')")
+    connection.execute(
+        f"INSERT OR IGNORE INTO indexed_runs SELECT id FROM {Run.__tablename__}"
+    )
+
+
+def has_unindexed_runs(connection: Connection) -> bool:
+    return (
+        connection.execute(
+            f"SELECT 1 FROM {Run.__tablename__} "
+            "WHERE id NOT IN (SELECT run_id FROM indexed_runs) LIMIT 1"
+        ).scalar()
+        is not None
+    )
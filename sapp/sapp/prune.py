@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Deleting old runs and reclaiming the space they used.
+
+Everything is deleted in short transactions over primary key ranges, so
+other readers and writers only ever wait for a single batch. Ids within a run
+are reserved in contiguous blocks, which keeps the number of ranges per run
+close to rows / batch_size.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import click
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    MetaData,
+    Table,
+    and_,
+    func,
+    select,
+    type_coerce,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .db import DB, DBType
+from .models import (
+    BIGDBIDType,
+    IssueInstance,
+    IssueInstanceFixInfo,
+    IssueInstanceSharedTextAssoc,
+    IssueInstanceTraceFrameAssoc,
+    Run,
+    SharedText,
+    ShortestTrace,
+    TraceFrame,
+    TraceFrameAnnotation,
+    TraceFrameAnnotationText,
+    TraceFrameLeafAssoc,
+    WarningCodeRunStats,
+)
+from .warning_code_stats import remove_run
+
+
+log = logging.getLogger("sapp")
+
+DEFAULT_BATCH_SIZE = 5000
+VACUUM_PAGES_PER_STEP = 2000
+
+# Every column that holds a SharedText id. Rows in messages that none of these
+# refer to are garbage once their runs are gone.
+SHARED_TEXT_REFERENCES = [
+    IssueInstance.__table__.c.message_id,
+    IssueInstance.__table__.c.filename_id,
+    IssueInstance.__table__.c.callable_id,
+    IssueInstanceSharedTextAssoc.__table__.c.feature_id,
+    TraceFrame.__table__.c.caller_id,
+    TraceFrame.__table__.c.callee_id,
+    TraceFrame.__table__.c.filename_id,
+    TraceFrameLeafAssoc.__table__.c.message_id,
+]
+
+
+def runs_to_prune(
+    session: Session, older_than: Optional[int], keep: Optional[int]
+) -> List[int]:
+    """Runs older than `older_than` days, and runs beyond the `keep` most
+    recent ones. When both are given, a run has to match both policies, so
+    `keep` acts as a floor on the number of runs left."""
+    query = session.query(Run.id).order_by(Run.id)
+    if older_than is not None:
+        query = query.filter(Run.date < datetime.now() - timedelta(days=older_than))
+    if keep is not None:
+        kept = session.query(Run.id).order_by(Run.id.desc()).limit(keep).subquery()
+        query = query.filter(Run.id.notin_(select([kept.c.id])))
+    return [int(run_id) for run_id, in query]
+
+
+def _id_bounds(table: Table):
+    # Aggregates of an id column would come back as DBIDs, even when they are
+    # NULL because there are no rows
+    return select(
+        [
+            type_coerce(func.min(table.c.id), BigInteger),
+            type_coerce(func.max(table.c.id), BigInteger),
+        ]
+    )
+
+
+def _id_ranges(session: Session, table: Table, run_id: int, batch_size: int):
+    low, high = session.execute(
+        _id_bounds(table).where(table.c.run_id == run_id)
+    ).fetchone()
+    if low is None:
+        return
+    for start in range(int(low), int(high) + 1, batch_size):
+        yield start, start + batch_size
+
+
+def delete_run(database: DB, run_id: int, batch_size: int) -> Dict[str, int]:
+    """Deletes a run and all rows that belong to it. Children are deleted
+    before their parents and the run itself goes last, so an interrupted prune
+    can simply be run again. Returns the number of deleted rows per table."""
+    counts: Dict[str, int] = {}
+
+    def execute(session, statement):
+        result = session.execute(statement)
+        table_name = statement.table.name
+        counts[table_name] = counts.get(table_name, 0) + result.rowcount
+
+    if database.partitioned:
+        # All rows of the run are in its data file
+        database.drop_run(run_id)
+    else:
+        _delete_run_rows(database, run_id, batch_size, execute)
+
+    with database.make_session() as session:
+        remove_run(session, run_id)
+        stats = WarningCodeRunStats.__table__
+        execute(session, stats.delete().where(stats.c.run_id == run_id))
+        execute(session, Run.__table__.delete().where(Run.__table__.c.id == run_id))
+        session.commit()
+
+    return counts
+
+
+def _delete_run_rows(database: DB, run_id: int, batch_size: int, execute) -> None:
+    instances = IssueInstance.__table__
+    instance_trace_frames = IssueInstanceTraceFrameAssoc.__table__
+    instance_features = IssueInstanceSharedTextAssoc.__table__
+    shortest_traces = ShortestTrace.__table__
+    fix_infos = IssueInstanceFixInfo.__table__
+    frames = TraceFrame.__table__
+    frame_leaves = TraceFrameLeafAssoc.__table__
+    annotations = TraceFrameAnnotation.__table__
+
+    with database.make_session() as session:
+        instance_ranges = list(_id_ranges(session, instances, run_id, batch_size))
+        frame_ranges = list(_id_ranges(session, frames, run_id, batch_size))
+
+    for start, end in instance_ranges:
+        batch = and_(
+            instances.c.id >= start, instances.c.id < end, instances.c.run_id == run_id
+        )
+        batch_ids = select([instances.c.id]).where(batch)
+        with database.make_session() as session:
+            execute(
+                session,
+                instance_trace_frames.delete().where(
+                    instance_trace_frames.c.issue_instance_id.in_(batch_ids)
+                ),
+            )
+            execute(
+                session,
+                instance_features.delete().where(
+                    instance_features.c.issue_instance_id.in_(batch_ids)
+                ),
+            )
+            execute(
+                session,
+                shortest_traces.delete().where(
+                    shortest_traces.c.issue_instance_id.in_(batch_ids)
+                ),
+            )
+            execute(
+                session,
+                fix_infos.delete().where(
+                    fix_infos.c.id.in_(select([instances.c.fix_info_id]).where(batch))
+                ),
+            )
+            execute(session, instances.delete().where(batch))
+            session.commit()
+
+    for start, end in frame_ranges:
+        batch = and_(frames.c.id >= start, frames.c.id < end, frames.c.run_id == run_id)
+        batch_ids = select([frames.c.id]).where(batch)
+        with database.make_session() as session:
+            execute(
+                session,
+                frame_leaves.delete().where(
+                    frame_leaves.c.trace_frame_id.in_(batch_ids)
+                ),
+            )
+            execute(
+                session,
+                annotations.delete().where(annotations.c.trace_frame_id.in_(batch_ids)),
+            )
+            execute(session, frames.delete().where(batch))
+            session.commit()
+
+
+def collect_shared_texts(database: DB, batch_size: int) -> int:
+    """Deletes SharedTexts that nothing refers to any more and returns how many
+    were deleted.
+
+    A run being saved can reuse SharedTexts before it writes the rows that
+    refer to them. So each batch checks the references in the transaction
+    that deletes it, holding the database's write lock for just that batch.
+    """
+    if database.partitioned:
+        return _collect_partitioned_shared_texts(database, batch_size)
+    with database.engine.connect() as connection:
+        return _delete_unreferenced(
+            database,
+            connection,
+            SharedText.__table__,
+            SHARED_TEXT_REFERENCES,
+            batch_size,
+        )
+
+
+def _collect_partitioned_shared_texts(database: DB, batch_size: int) -> int:
+    """The references of a partitioned database are spread over the data
+    files of its runs, too many to attach at once. They are gathered into a
+    temporary table, holding the write lock only while a file is attached.
+    Each batch first adds the files of runs saved since."""
+    messages = SharedText.__table__
+    referenced = Table(
+        "tmp_referenced_messages",
+        MetaData(),
+        Column("id", BIGDBIDType, primary_key=True),
+        prefixes=["TEMPORARY"],
+    )
+    collected = set()
+
+    def collect_new_runs(connection) -> None:
+        for run_id, path in database.run_files().items():
+            if run_id not in collected:
+                _collect_references(connection, referenced, path)
+                collected.add(run_id)
+
+    # The temporary table only exists on this connection
+    with database.engine.connect() as connection:
+        referenced.drop(connection, checkfirst=True)
+        referenced.create(connection)
+        try:
+            for run_id, path in database.run_files().items():
+                with database.write_lock():
+                    _collect_references(connection, referenced, path)
+                collected.add(run_id)
+            return _delete_unreferenced(
+                database,
+                connection,
+                messages,
+                [referenced.c.id],
+                batch_size,
+                prepare_batch=collect_new_runs,
+            )
+        finally:
+            referenced.drop(connection)
+
+
+def _collect_references(connection, referenced: Table, path: str) -> None:
+    connection.execute("ATTACH DATABASE ? AS pruned_run", (path,))
+    try:
+        with connection.begin():
+            for column in SHARED_TEXT_REFERENCES:
+                connection.execute(
+                    f"INSERT OR IGNORE INTO {referenced.name} (id) "
+                    f"SELECT {column.name} FROM pruned_run.{column.table.name} "
+                    f"WHERE {column.name} != 0"
+                )
+    finally:
+        connection.execute("DETACH DATABASE pruned_run")
+
+
+def collect_annotation_texts(database: DB, batch_size: int) -> int:
+    """Deletes annotation texts that no annotation refers to any more and
+    returns how many were deleted, checking the references in each batch like
+    collect_shared_texts. In a partitioned database they are deleted together
+    with the data file of their run."""
+    if database.partitioned:
+        return 0
+    with database.engine.connect() as connection:
+        return _delete_unreferenced(
+            database,
+            connection,
+            TraceFrameAnnotationText.__table__,
+            [TraceFrameAnnotation.__table__.c.text_id],
+            batch_size,
+        )
+
+
+def _delete_unreferenced(
+    database: DB,
+    connection,
+    table: Table,
+    references: List[Column],
+    batch_size: int,
+    prepare_batch: Optional[Callable[[Connection], None]] = None,
+) -> int:
+    deleted = 0
+    low, high = connection.execute(_id_bounds(table)).fetchone()
+    if low is not None:
+        for start in range(int(low), int(high) + 1, batch_size):
+            with database.write_lock():
+                if prepare_batch is not None:
+                    prepare_batch(connection)
+                end = start + batch_size
+                # The reference columns aren't indexed. Correlated NOT EXISTS
+                # checks would scan their tables once per row, these are
+                # scanned once per batch.
+                unreferenced = [
+                    table.c.id.notin_(
+                        select([column]).where(and_(column >= start, column < end))
+                    )
+                    for column in references
+                ]
+                with connection.begin():
+                    deleted += connection.execute(
+                        table.delete().where(
+                            and_(table.c.id >= start, table.c.id < end, *unreferenced)
+                        )
+                    ).rowcount
+    return deleted
+
+
+def incremental_vacuum(database: DB) -> Optional[int]:
+    """Returns free pages to the file system a few at a time. Returns the number
+    of pages freed, or None if the database wasn't created with
+    auto_vacuum=INCREMENTAL."""
+    if database.dbtype != DBType.SQLITE:
+        return None
+    with database.engine.connect() as connection:
+        if connection.execute("PRAGMA auto_vacuum").scalar() != 2:
+            return None
+        freed = 0
+        while True:
+            free_pages = connection.execute("PRAGMA freelist_count").scalar()
+            if free_pages == 0:
+                return freed
+            # Each step is its own short write transaction
+            connection.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})")
+            remaining = connection.execute("PRAGMA freelist_count").scalar()
+            if remaining == free_pages:
+                return freed
+            freed += free_pages - remaining
+
+
+@click.command()
+@click.pass_context
+@click.option("--older-than", type=int, help="prune runs older than this many days")
+@click.option("--keep", type=int, help="number of most recent runs to keep")
+@click.option(
+    "--batch-size",
+    type=int,
+    default=DEFAULT_BATCH_SIZE,
+    help="rows per delete transaction",
+)
+@click.option("--dry-run", is_flag=True, help="only list the runs that would be pruned")
+@click.option(
+    "--full-vacuum",
+    is_flag=True,
+    help=(
+        "rewrite the whole database to enable incremental vacuum on it "
+        "(locks the database until done)"
+    ),
+)
+def prune(
+    click_ctx: click.Context,
+    older_than: Optional[int],
+    keep: Optional[int],
+    batch_size: int,
+    dry_run: bool,
+    full_vacuum: bool,
+) -> None:
+    """Delete old runs and reclaim their space"""
+    if older_than is None and keep is None:
+        raise click.UsageError("Specify --older-than, --keep or both")
+    database = click_ctx.obj.database
+
+    with database.make_session() as session:
+        run_ids = runs_to_prune(session, older_than, keep)
+    if dry_run:
+        click.echo(f"Would prune {len(run_ids)} runs: {run_ids}")
+        return
+
+    totals: Dict[str, int] = {}
+    for run_id in run_ids:
+        log.info("Pruning run %d", run_id)
+        for table_name, count in delete_run(database, run_id, batch_size).items():
+            totals[table_name] = totals.get(table_name, 0) + count
+    click.echo(f"Pruned {len(run_ids)} runs")
+    for table_name, count in sorted(totals.items()):
+        click.echo(f"  {table_name}: {count} rows")
+
+    click.echo(f"Collected {collect_shared_texts(database, batch_size)} messages")
+    click.echo(
+        f"Collected {collect_annotation_texts(database, batch_size)} annotation texts"
+    )
+
+    if full_vacuum and database.dbtype == DBType.SQLITE:
+        with database.engine.connect() as connection:
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("VACUUM")
+        click.echo("Vacuumed database")
+        return
+
+    freed = incremental_vacuum(database)
+    if freed is None:
+        click.echo("Space is reused but not returned; see --full-vacuum")
+    else:
+        click.echo(f"Freed {freed} pages")
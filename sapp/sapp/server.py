@@ -0,0 +1,614 @@
+#!/usr/bin/env python3
+"""
+A local HTTP service answering queries about runs with JSON, for tools that
+would otherwise shell into `sapp explore` or run SQL of their own.
+
+    GET /runs
+    GET /runs/<run_id>/issues[?code=&callable=&filename=]
+    GET /runs/<run_id>/issues/<issue_instance_id>
+    GET /runs/<run_id>/issues/<issue_instance_id>/trace
+    GET /runs/<run_id>/frames[?kind=&caller=&callee=]
+    GET /runs/<run_id>/frames/<trace_frame_id>
+    GET /runs/<run_id>/frames/<trace_frame_id>/parents
+
+Filters can be repeated, and names are LIKE patterns. Listings come in pages
+of `limit` items ordered by id, {"items": [...], "after": <id>}, and the next
+page is requested with `after`. With `stream=1`, all items are written as
+they are read instead, one JSON object per line.
+
+Requests are answered by a pool of threads sharing a pool of read-only
+connections. The data of a finished run doesn't change, so responses are
+cached by run and query.
+"""
+
+import json
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import click
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.query import Query
+from sqlalchemy.sql.expression import or_
+
+from . import name_index
+from .db import DB, DBType
+from .lru_cache import LRUCache
+from .models import (
+    Issue,
+    IssueInstance,
+    IssueInstanceSharedTextAssoc,
+    IssueInstanceTraceFrameAssoc,
+    Run,
+    RunStatus,
+    SharedText,
+    SharedTextKind,
+    ShortestTrace,
+    TraceFrame,
+    TraceFrameLeafAssoc,
+    TraceKind,
+)
+from .trace_graph import TraceGraph
+
+
+log = logging.getLogger("sapp")
+
+Json = Dict[str, Any]
+
+
+class RequestError(Exception):
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+def _frame_json(trace_frame: TraceFrame) -> Json:
+    return {
+        "id": int(trace_frame.id),
+        "kind": trace_frame.kind.name,
+        "caller": trace_frame.caller,
+        "caller_port": trace_frame.caller_port,
+        "callee": trace_frame.callee,
+        "callee_port": trace_frame.callee_port,
+        "filename": trace_frame.filename,
+        "location": str(trace_frame.callee_location),
+    }
+
+
+class QueryServer(ThreadingHTTPServer):
+    """Serves the queries listed above from a read-only SQLite database."""
+
+    daemon_threads = True
+
+    PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
+    CACHE_SIZE = 2000
+    # Gives up on traces that are longer than any real one
+    MAX_TRACE_LENGTH = 100
+
+    ROUTES: List[Tuple[str, str]] = [
+        (r"/runs", "runs"),
+        (r"/runs/(\d+)/issues", "issues"),
+        (r"/runs/(\d+)/issues/(\d+)", "issue"),
+        (r"/runs/(\d+)/issues/(\d+)/trace", "trace"),
+        (r"/runs/(\d+)/frames", "frames"),
+        (r"/runs/(\d+)/frames/(\d+)", "frame"),
+        (r"/runs/(\d+)/frames/(\d+)/parents", "parents"),
+    ]
+
+    def __init__(self, address: Tuple[str, int], dbname: str) -> None:
+        self.dbname = dbname
+        self.database = DB(DBType.SQLITE, dbname, read_only=True)
+        # A partitioned database attaches one run to all connections of a DB,
+        # so each run gets its own
+        self._run_databases: Dict[int, DB] = {}
+        self._lock = threading.Lock()
+        self.cache: LRUCache[bytes] = LRUCache(self.CACHE_SIZE)
+        super().__init__(address, _QueryRequestHandler)
+
+    @contextmanager
+    def make_session(self, run_id: Optional[int] = None) -> Iterator[Session]:
+        database = self.database
+        if run_id is not None and self.database.partitioned:
+            with self._lock:
+                if run_id not in self._run_databases:
+                    run_database = DB(DBType.SQLITE, self.dbname, read_only=True)
+                    run_database.attach_run(run_id)
+                    self._run_databases[run_id] = run_database
+                database = self._run_databases[run_id]
+        with database.make_session() as session:
+            yield session
+
+    def route(self, path: str) -> Tuple[Callable, List[int]]:
+        for pattern, name in self.ROUTES:
+            match = re.fullmatch(pattern, path.rstrip("/"))
+            if match:
+                return getattr(self, name), [int(group) for group in match.groups()]
+        raise RequestError(HTTPStatus.NOT_FOUND, f"No such endpoint: {path}")
+
+    def check_run(self, run_id: int) -> None:
+        def query() -> bool:
+            with self.make_session() as session:
+                status = (
+                    session.query(Run.status)
+                    .filter(Run.id == run_id)
+                    .filter(Run.status == RunStatus.FINISHED)
+                    .scalar()
+                )
+            if status is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, f"No finished run {run_id}")
+            return True
+
+        self.cache.get((run_id, "finished"), query)
+
+    def runs(self, parameters: Dict[str, List[str]]) -> Json:
+        with self.make_session() as session:
+            runs = (
+                session.query(Run.id, Run.date, Run.commit_hash, Run.job_id)
+                .filter(Run.status == RunStatus.FINISHED)
+                .order_by(Run.id.desc())
+                .all()
+            )
+        return {
+            "items": [
+                {
+                    "id": int(run.id),
+                    "date": str(run.date),
+                    "commit_hash": run.commit_hash,
+                    "job_id": run.job_id,
+                }
+                for run in runs
+            ]
+        }
+
+    def _issues_query(
+        self, session: Session, run_id: int, parameters: Dict[str, List[str]]
+    ) -> Query:
+        query = (
+            session.query(
+                IssueInstance.id,
+                Issue.code,
+                Issue.callable,
+                IssueInstance.filename,
+                IssueInstance.location,
+                IssueInstance.is_new_issue,
+                SharedText.contents,
+            )
+            .join(Issue, IssueInstance.issue_id == Issue.id)
+            .join(SharedText, SharedText.id == IssueInstance.message_id)
+            .filter(IssueInstance.run_id == run_id)
+        )
+        if "code" in parameters:
+            query = query.filter(Issue.code.in_(_integers(parameters, "code")))
+        for name, column in [
+            ("callable", Issue.callable),
+            ("filename", IssueInstance.filename),
+        ]:
+            if name in parameters:
+                query = _filter_names(session, run_id, query, column, parameters[name])
+        return query
+
+    @staticmethod
+    def _issue_json(issue: Any) -> Json:
+        return {
+            "id": int(issue.id),
+            "code": issue.code,
+            "message": issue.contents,
+            "callable": issue.callable,
+            "filename": issue.filename,
+            "location": str(issue.location),
+            "is_new_issue": issue.is_new_issue,
+        }
+
+    def issues(self, parameters: Dict[str, List[str]], run_id: int) -> "Listing":
+        return Listing(
+            self,
+            run_id,
+            lambda session: self._issues_query(session, run_id, parameters),
+            IssueInstance.id,
+            self._issue_json,
+        )
+
+    def issue(
+        self, parameters: Dict[str, List[str]], run_id: int, issue_instance_id: int
+    ) -> Json:
+        with self.make_session(run_id) as session:
+            issue = (
+                self._issues_query(session, run_id, {})
+                .filter(IssueInstance.id == issue_instance_id)
+                .first()
+            )
+            if issue is None:
+                raise RequestError(
+                    HTTPStatus.NOT_FOUND, f"No issue instance {issue_instance_id}"
+                )
+            leaves = _issue_leaves(session, issue_instance_id)
+        return {
+            **self._issue_json(issue),
+            "sources": sorted(leaves[SharedTextKind.SOURCE].values()),
+            "sinks": sorted(leaves[SharedTextKind.SINK].values()),
+            "features": sorted(leaves[SharedTextKind.FEATURE].values()),
+        }
+
+    def trace(
+        self, parameters: Dict[str, List[str]], run_id: int, issue_instance_id: int
+    ) -> Json:
+        """The trace shown first by `sapp explore`: the shortest path to a leaf
+        in each direction, with the number of frames to choose from at each
+        step."""
+        with self.make_session(run_id) as session:
+            if (
+                session.query(IssueInstance.id)
+                .filter(IssueInstance.run_id == run_id)
+                .filter(IssueInstance.id == issue_instance_id)
+                .scalar()
+                is None
+            ):
+                raise RequestError(
+                    HTTPStatus.NOT_FOUND, f"No issue instance {issue_instance_id}"
+                )
+            leaves = _issue_leaves(session, issue_instance_id)
+            return {
+                kind.name.lower(): self._trace(
+                    session,
+                    issue_instance_id,
+                    kind,
+                    list(
+                        leaves[
+                            SharedTextKind.SOURCE
+                            if kind == TraceKind.POSTCONDITION
+                            else SharedTextKind.SINK
+                        ]
+                    ),
+                )
+                for kind in [TraceKind.POSTCONDITION, TraceKind.PRECONDITION]
+            }
+
+    def _trace(
+        self,
+        session: Session,
+        issue_instance_id: int,
+        kind: TraceKind,
+        leaf_ids: List[int],
+    ) -> Json:
+        trace = self._stored_trace(session, issue_instance_id, kind)
+        if trace is None:
+            # Runs saved before shortest traces were stored
+            trace = self._walk_trace(session, issue_instance_id, kind, leaf_ids)
+        return {
+            "frames": [
+                {**_frame_json(trace_frame), "branches": branches}
+                for trace_frame, branches in trace
+            ],
+            "complete": not trace or trace[-1][0].callee_port in TraceGraph.LEAF_NAMES,
+        }
+
+    def _stored_trace(
+        self, session: Session, issue_instance_id: int, kind: TraceKind
+    ) -> Optional[List[Tuple[TraceFrame, int]]]:
+        schema = "run" if self.database.partitioned else None
+        if not self.database.engine.dialect.has_table(
+            session.connection(), ShortestTrace.__tablename__, schema=schema
+        ):
+            return None
+        shortest_trace = (
+            session.query(ShortestTrace)
+            .filter(ShortestTrace.issue_instance_id == issue_instance_id)
+            .filter(ShortestTrace.kind == kind)
+            .first()
+        )
+        if shortest_trace is None:
+            return None
+        trace_frames = {
+            int(trace_frame.id): trace_frame
+            for trace_frame in session.query(TraceFrame).filter(
+                TraceFrame.id.in_(shortest_trace.trace_frame_ids)
+            )
+        }
+        if not set(shortest_trace.trace_frame_ids).issubset(trace_frames):
+            return None
+        return [
+            (trace_frames[trace_frame_id], branches)
+            for trace_frame_id, branches in zip(
+                shortest_trace.trace_frame_ids, shortest_trace.branches
+            )
+        ]
+
+    def _walk_trace(
+        self,
+        session: Session,
+        issue_instance_id: int,
+        kind: TraceKind,
+        leaf_ids: List[int],
+    ) -> List[Tuple[TraceFrame, int]]:
+        """Follows the first choice at each step, like `sapp explore` does."""
+        trace_frames = _with_leaves(
+            session.query(TraceFrame)
+            .join(
+                IssueInstanceTraceFrameAssoc,
+                IssueInstanceTraceFrameAssoc.trace_frame_id == TraceFrame.id,
+            )
+            .filter(IssueInstanceTraceFrameAssoc.issue_instance_id == issue_instance_id)
+            .filter(TraceFrame.kind == kind)
+        ).all()
+        trace: List[Tuple[TraceFrame, int]] = []
+        while trace_frames and len(trace) < self.MAX_TRACE_LENGTH:
+            trace_frame = trace_frames[0]
+            trace.append((trace_frame, len(trace_frames)))
+            if trace_frame.callee_port in TraceGraph.LEAF_NAMES:
+                break
+            trace_frames = _with_leaves(
+                session.query(TraceFrame)
+                .filter(TraceFrame.run_id == trace_frame.run_id)
+                .filter(TraceFrame.kind == kind)
+                .filter(TraceFrame.caller == trace_frame.callee)
+                .filter(TraceFrame.caller_port == trace_frame.callee_port)
+                .filter(TraceFrame.caller != TraceFrame.callee),
+                leaf_ids,
+            ).all()
+        return trace
+
+    def _frames_query(
+        self, session: Session, run_id: int, parameters: Dict[str, List[str]]
+    ) -> Query:
+        query = session.query(TraceFrame).filter(TraceFrame.run_id == run_id)
+        if "kind" in parameters:
+            try:
+                kinds = [TraceKind[kind.lower()] for kind in parameters["kind"]]
+            except KeyError as error:
+                raise RequestError(
+                    HTTPStatus.BAD_REQUEST, f"Invalid kind: {error}"
+                ) from error
+            query = query.filter(TraceFrame.kind.in_(kinds))
+        for name, column in [
+            ("caller", TraceFrame.caller),
+            ("callee", TraceFrame.callee),
+        ]:
+            if name in parameters:
+                query = _filter_names(session, run_id, query, column, parameters[name])
+        return query
+
+    def frames(self, parameters: Dict[str, List[str]], run_id: int) -> "Listing":
+        return Listing(
+            self,
+            run_id,
+            lambda session: self._frames_query(session, run_id, parameters),
+            TraceFrame.id,
+            _frame_json,
+        )
+
+    def frame(
+        self, parameters: Dict[str, List[str]], run_id: int, trace_frame_id: int
+    ) -> Json:
+        with self.make_session(run_id) as session:
+            trace_frame = (
+                session.query(TraceFrame)
+                .filter(TraceFrame.run_id == run_id)
+                .filter(TraceFrame.id == trace_frame_id)
+                .first()
+            )
+            if trace_frame is None:
+                raise RequestError(
+                    HTTPStatus.NOT_FOUND, f"No trace frame {trace_frame_id}"
+                )
+            leaves = (
+                session.query(SharedText.contents, TraceFrameLeafAssoc.trace_length)
+                .join(TraceFrameLeafAssoc, TraceFrameLeafAssoc.leaf_id == SharedText.id)
+                .filter(TraceFrameLeafAssoc.trace_frame_id == trace_frame_id)
+                .order_by(SharedText.contents)
+                .all()
+            )
+        return {
+            **_frame_json(trace_frame),
+            "leaves": [
+                {"name": name, "trace_length": trace_length}
+                for name, trace_length in leaves
+            ],
+        }
+
+    def parents(
+        self, parameters: Dict[str, List[str]], run_id: int, trace_frame_id: int
+    ) -> Json:
+        """Frames calling into the caller of the given one."""
+        trace_frame = self.frame(parameters, run_id, trace_frame_id)
+        with self.make_session(run_id) as session:
+            parents = (
+                _with_leaves(
+                    session.query(TraceFrame)
+                    .filter(TraceFrame.run_id == run_id)
+                    .filter(TraceFrame.kind == TraceKind[trace_frame["kind"]])
+                    .filter(TraceFrame.callee == trace_frame["caller"])
+                    .filter(TraceFrame.callee_port == trace_frame["caller_port"])
+                    .filter(TraceFrame.caller != TraceFrame.callee)
+                )
+                .limit(self.MAX_PAGE_SIZE)
+                .all()
+            )
+        return {"items": [_frame_json(parent) for parent in parents]}
+
+
+class Listing:
+    """The items of a listing endpoint, read a page at a time or streamed."""
+
+    def __init__(
+        self,
+        server: QueryServer,
+        run_id: int,
+        query: Callable[[Session], Query],
+        id_column: Any,
+        to_json: Callable[[Any], Json],
+    ) -> None:
+        self.server = server
+        self.run_id = run_id
+        self.query = query
+        self.id_column = id_column
+        self.to_json = to_json
+
+    def page(self, after: Optional[int], limit: int) -> Json:
+        with self.server.make_session(self.run_id) as session:
+            query = self.query(session).order_by(self.id_column)
+            if after is not None:
+                query = query.filter(self.id_column > after)
+            # One more row tells whether there is a next page
+            rows = query.limit(limit + 1).all()
+        items = [self.to_json(row) for row in rows[:limit]]
+        return {
+            "items": items,
+            "after": items[-1]["id"] if len(rows) > limit else None,
+        }
+
+    def stream(self) -> Iterator[Json]:
+        with self.server.make_session(self.run_id) as session:
+            for row in self.query(session).order_by(self.id_column).yield_per(1000):
+                yield self.to_json(row)
+
+
+def _integers(parameters: Dict[str, List[str]], name: str) -> List[int]:
+    try:
+        return [int(value) for value in parameters[name]]
+    except ValueError as error:
+        raise RequestError(
+            HTTPStatus.BAD_REQUEST, f"Invalid {name}: {error}"
+        ) from error
+
+
+def _filter_names(
+    session: Session, run_id: int, query: Query, column: Any, patterns: List[str]
+) -> Query:
+    field = name_index.field_of(column)
+    if (
+        field is not None
+        and any("%" in pattern or "_" in pattern for pattern in patterns)
+        and name_index.is_indexed(session, run_id)
+    ):
+        # Wildcards scan the table, the index finds the matching names
+        return query.filter(column.in_(name_index.matching_names(field, patterns)))
+    return query.filter(or_(*[column.like(pattern) for pattern in patterns]))
+
+
+def _with_leaves(query: Query, leaf_ids: Optional[List[int]] = None) -> Query:
+    """Frames that lead to any of the leaves, or to any leaf at all, in the
+    order `sapp explore` lists them."""
+    query = query.join(TraceFrame.leaf_assoc)
+    if leaf_ids is not None:
+        query = query.filter(TraceFrameLeafAssoc.leaf_id.in_(leaf_ids))
+    return query.group_by(TraceFrame.id).order_by(
+        TraceFrameLeafAssoc.trace_length, TraceFrame.callee_location
+    )
+
+
+def _issue_leaves(
+    session: Session, issue_instance_id: int
+) -> Dict[SharedTextKind, Dict[int, str]]:
+    leaves: Dict[SharedTextKind, Dict[int, str]] = {kind: {} for kind in SharedTextKind}
+    for id, kind, contents in (
+        session.query(SharedText.id, SharedText.kind, SharedText.contents)
+        .join(
+            IssueInstanceSharedTextAssoc,
+            SharedText.id == IssueInstanceSharedTextAssoc.shared_text_id,
+        )
+        .filter(IssueInstanceSharedTextAssoc.issue_instance_id == issue_instance_id)
+    ):
+        leaves[kind][int(id)] = contents
+    return leaves
+
+
+class _QueryRequestHandler(BaseHTTPRequestHandler):
+    server: QueryServer
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        parameters = parse_qs(url.query)
+        try:
+            endpoint, arguments = self.server.route(url.path)
+            run_id = arguments[0] if arguments else None
+            if run_id is not None:
+                self.server.check_run(run_id)
+
+            if parameters.get("stream") == ["1"]:
+                response = endpoint(parameters, *arguments)
+                if not isinstance(response, Listing):
+                    raise RequestError(
+                        HTTPStatus.BAD_REQUEST, f"{url.path} can't be streamed"
+                    )
+                self._stream(response)
+                return
+
+            def compute() -> bytes:
+                response = endpoint(parameters, *arguments)
+                if isinstance(response, Listing):
+                    response = self._page(response, parameters)
+                return json.dumps(response).encode()
+
+            if run_id is None:
+                body = compute()  # New runs show up in the list
+            else:
+                body = self.server.cache.get((run_id, self.path), compute)
+            self._respond(HTTPStatus.OK, body)
+        except RequestError as error:
+            self._respond(
+                error.status, json.dumps({"error": error.message}).encode()
+            )
+
+    def _page(self, listing: Listing, parameters: Dict[str, List[str]]) -> Json:
+        after = _integers(parameters, "after")[0] if "after" in parameters else None
+        limit = (
+            _integers(parameters, "limit")[0]
+            if "limit" in parameters
+            else QueryServer.PAGE_SIZE
+        )
+        if not 0 < limit <= QueryServer.MAX_PAGE_SIZE:
+            raise RequestError(
+                HTTPStatus.BAD_REQUEST,
+                f"limit must be between 1 and {QueryServer.MAX_PAGE_SIZE}",
+            )
+        return listing.page(after, limit)
+
+    def _respond(self, status: HTTPStatus, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, listing: Listing) -> None:
+        items = listing.stream()
+        # Invalid filters only fail once the query runs
+        first = next(items, None)
+        # Without a length, the end of the response is the end of the
+        # connection
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        if first is None:
+            return
+        self.wfile.write(json.dumps(first).encode() + b"\n")
+        for item in items:
+            self.wfile.write(json.dumps(item).encode() + b"\n")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log.debug("%s: %s", self.address_string(), format % args)
+
+
+@click.command()
+@click.pass_context
+@click.option("--host", default="localhost", help="Address to listen on")
+@click.option("--port", type=int, default=8080, help="Port to listen on")
+def serve(click_ctx: click.Context, host: str, port: int) -> None:
+    """Answer queries about runs over HTTP with JSON"""
+    database = click_ctx.obj.database
+    if database.dbtype != DBType.SQLITE:
+        raise click.UsageError("serve needs an SQLite database")
+
+    with QueryServer((host, port), database.dbname) as server:
+        log.info("Serving %s on http://%s:%d", database.dbname, host, port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
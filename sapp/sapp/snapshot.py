@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+In-memory copies of SQLite databases.
+
+Exploring a large database file spends most of its time waiting for cold
+pages. A snapshot is read into memory once up front, after which every query
+runs against RAM. Either the whole file is copied with SQLite's online backup
+API, or only a single run together with the tables shared by all runs.
+"""
+
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import Table
+
+from . import models
+from .db import DB, DBType
+from .errors import AIException
+from .models import (
+    Issue,
+    IssueInstance,
+    IssueInstanceFixInfo,
+    IssueInstanceSharedTextAssoc,
+    IssueInstanceTraceFrameAssoc,
+    Run,
+    ShortestTrace,
+    TraceFrame,
+    TraceFrameAnnotation,
+    TraceFrameAnnotationText,
+    TraceFrameLeafAssoc,
+    WarningCodeRunStats,
+)
+
+
+BACKUP_PAGES_PER_STEP = 1024
+
+# Called with the work done so far and the total amount of work
+Progress = Callable[[int, int], None]
+
+_INSTANCES_OF_RUN = "issue_instance_id IN (SELECT id FROM main.issue_instances)"
+_FRAMES_OF_RUN = "trace_frame_id IN (SELECT id FROM main.trace_frames)"
+
+# The rows of a single run, by table. Conditions may refer to the tables
+# before them, which are already copied. Tables not listed are copied whole.
+RUN_ROWS: Dict[Table, str] = {
+    Run.__table__: "id = :run_id",
+    IssueInstance.__table__: "run_id = :run_id",
+    Issue.__table__: "id IN (SELECT issue_id FROM main.issue_instances)",
+    IssueInstanceFixInfo.__table__: (
+        "id IN (SELECT fix_info_id FROM main.issue_instances)"
+    ),
+    IssueInstanceSharedTextAssoc.__table__: _INSTANCES_OF_RUN,
+    IssueInstanceTraceFrameAssoc.__table__: _INSTANCES_OF_RUN,
+    ShortestTrace.__table__: _INSTANCES_OF_RUN,
+    TraceFrame.__table__: "run_id = :run_id",
+    TraceFrameAnnotation.__table__: _FRAMES_OF_RUN,
+    TraceFrameAnnotationText.__table__: (
+        "id IN (SELECT text_id FROM main.trace_frame_annotations)"
+    ),
+    TraceFrameLeafAssoc.__table__: _FRAMES_OF_RUN,
+    WarningCodeRunStats.__table__: "run_id = :run_id",
+}
+
+
+def snapshot(
+    database: DB, run_id: Optional[int] = None, progress: Optional[Progress] = None
+) -> DB:
+    """Copies the database, or only the run `run_id`, into a new in-memory
+    database. The copy doesn't see later changes to the file."""
+    if database.dbtype != DBType.SQLITE:
+        raise AIException("Only SQLite databases can be copied into memory")
+    memory = DB(
+        DBType.MEMORY,
+        database.dbname,
+        debug=database.debug,
+        assertions=database.assertions,
+    )
+    if run_id is None:
+        _copy_database(database, memory, progress)
+    else:
+        _copy_run(database, memory, run_id, progress)
+    return memory
+
+
+def _copy_database(database: DB, memory: DB, progress: Optional[Progress]) -> None:
+    source = database.engine.raw_connection()
+    target = memory.engine.raw_connection()
+    try:
+        source.connection.backup(
+            target.connection,
+            pages=BACKUP_PAGES_PER_STEP,
+            progress=progress
+            and (lambda status, remaining, total: progress(total - remaining, total)),
+        )
+        if not database.partitioned:
+            return
+        # The backup only has the main file, which has no run-scoped tables
+        models.create_run_scoped(memory.engine)
+        run_files = database.run_files()
+        for done, path in enumerate(run_files.values(), 1):
+            _attach(target, path, "source_run")
+            try:
+                for table in models.RUN_SCOPED_TABLES:
+                    _copy_rows(target, table, "source_run")
+                target.commit()
+            finally:
+                target.execute("DETACH DATABASE source_run")
+            if progress:
+                progress(done, len(run_files))
+    finally:
+        source.close()
+        target.close()
+
+
+def _copy_run(
+    database: DB, memory: DB, run_id: int, progress: Optional[Progress]
+) -> None:
+    tables = list(RUN_ROWS) + [
+        table for table in models.Base.metadata.sorted_tables if table not in RUN_ROWS
+    ]
+    target = memory.engine.raw_connection()
+    try:
+        _attach(target, database.dbname, "source")
+        if database.partitioned:
+            _attach(target, database.run_file(run_id), "source_run")
+        try:
+            for done, table in enumerate(tables, 1):
+                if database.partitioned and table in models.RUN_SCOPED_TABLES:
+                    schema = "source_run"
+                else:
+                    schema = "source"
+                _copy_rows(target, table, schema, RUN_ROWS.get(table), run_id)
+                if progress:
+                    progress(done, len(tables))
+            target.commit()
+        finally:
+            target.execute("DETACH DATABASE source")
+            if database.partitioned:
+                target.execute("DETACH DATABASE source_run")
+    finally:
+        target.close()
+
+
+def _attach(connection, path: str, schema: str) -> None:
+    connection.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+
+
+def _copy_rows(
+    connection,
+    table: Table,
+    schema: str,
+    condition: Optional[str] = None,
+    run_id: Optional[int] = None,
+) -> None:
+    columns = ", ".join(column.name for column in table.columns)
+    statement = (
+        f"INSERT INTO main.{table.name} ({columns}) "
+        f"SELECT {columns} FROM {schema}.{table.name}"
+    )
+    if condition:
+        statement += f" WHERE {condition}"
+    connection.execute(statement, {"run_id": run_id})
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Distributions over the issues and trace frames of a run.
+
+Each statistic fetches the few integer columns it needs for the whole run
+and streams them straight into a NumPy array, without building ORM objects
+or Python lists. Grouping, histograms, percentiles and top-N are then
+vectorized operations over those arrays. Callables and files are grouped by
+their shared text ids, and only the names that make it into a top-N are
+looked up.
+"""
+
+import itertools
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .db import DB
+from .models import Issue, IssueInstance, Run, RunStatus, SharedText, TraceFrame
+
+
+PERCENTILES = [50, 90, 99]
+DEFAULT_BINS = 10
+DEFAULT_TOP = 10
+
+Stats = Dict[str, Any]
+
+
+def _fetch(connection: Connection, query: str, columns: int, **params) -> np.ndarray:
+    """The integer columns of all rows of `query`, one array row each."""
+    result = connection.execution_options(stream_results=True).execute(
+        text(query), **params
+    )
+    try:
+        # Reading the DB-API cursor directly skips building a result row
+        # object per row, which would take most of the time
+        values = np.fromiter(
+            itertools.chain.from_iterable(result.cursor), dtype=np.int64
+        )
+    finally:
+        result.close()
+    return values.reshape(-1, columns)
+
+
+def distribution(values: np.ndarray, bins: int = DEFAULT_BINS) -> Stats:
+    if len(values) == 0:
+        return {"count": 0}
+    low, high = int(values.min()), int(values.max())
+    # Integer values don't need more bins than there are distinct values
+    counts, edges = np.histogram(
+        values, bins=max(1, min(bins, high - low + 1)), range=(low, high + 1)
+    )
+    return {
+        "count": len(values),
+        "min": low,
+        "max": high,
+        "mean": float(values.mean()),
+        "percentiles": {
+            f"p{percentile}": float(value)
+            for percentile, value in zip(
+                PERCENTILES, np.percentile(values, PERCENTILES)
+            )
+        },
+        "histogram": [
+            [float(start), float(end), int(count)]
+            for start, end, count in zip(edges[:-1], edges[1:], counts)
+        ],
+    }
+
+
+def _top(keys: np.ndarray, counts: np.ndarray, n: int) -> List[Tuple[int, int]]:
+    if n <= 0:
+        return []
+    if n < len(counts):
+        # Only the n largest are sorted
+        selected = np.argpartition(-counts, n - 1)[:n]
+    else:
+        selected = np.arange(len(counts))
+    selected = selected[np.lexsort((keys[selected], -counts[selected]))]
+    return [(int(keys[i]), int(counts[i])) for i in selected]
+
+
+def _counts_per_name(
+    name_ids: np.ndarray, top: int, bins: int, names: Dict[int, str]
+) -> Stats:
+    """Counts the rows of each name id, and keeps the ids of the `top` ones
+    in `names` to be looked up later."""
+    keys, counts = np.unique(name_ids, return_counts=True)
+    stats = distribution(counts, bins)
+    stats["top"] = _top(keys, counts, top)
+    names.update((key, "") for key, _ in stats["top"])
+    return stats
+
+
+def _trace_lengths(connection: Connection, run_id: int, bins: int) -> Stats:
+    rows = _fetch(
+        connection,
+        f"SELECT {Issue.__tablename__}.code, "
+        "COALESCE(i.min_trace_length_to_sources, 0), "
+        "COALESCE(i.min_trace_length_to_sinks, 0) "
+        f"FROM {IssueInstance.__tablename__} i "
+        f"JOIN {Issue.__tablename__} ON {Issue.__tablename__}.id = i.issue_id "
+        "WHERE i.run_id = :run_id",
+        3,
+        run_id=run_id,
+    )
+    rows = rows[np.argsort(rows[:, 0], kind="stable")]
+    codes, starts = np.unique(rows[:, 0], return_index=True)
+    return {
+        int(code): {
+            "forward": distribution(group[:, 1], bins),
+            "backward": distribution(group[:, 2], bins),
+        }
+        for code, group in zip(codes, np.split(rows, starts[1:]))
+    }
+
+
+def run_stats(
+    database: DB, run_id: int, top: int = DEFAULT_TOP, bins: int = DEFAULT_BINS
+) -> Stats:
+    """Trace lengths per warning code, issues per callable, outgoing trace
+    frames per caller and trace frames per file of the run."""
+    database.attach_run(run_id)
+    names: Dict[int, str] = {}
+    with database.engine.connect() as connection:
+        stats: Stats = {
+            "run_id": run_id,
+            "trace_lengths": _trace_lengths(connection, run_id, bins),
+        }
+        for name, column, table in [
+            ("issues_per_callable", "callable_id", IssueInstance.__tablename__),
+            ("fanout_per_caller", "caller_id", TraceFrame.__tablename__),
+            ("frames_per_file", "filename_id", TraceFrame.__tablename__),
+        ]:
+            name_ids = _fetch(
+                connection,
+                f"SELECT {column} FROM {table} WHERE run_id = :run_id",
+                1,
+                run_id=run_id,
+            )[:, 0]
+            stats[name] = _counts_per_name(name_ids, top, bins, names)
+
+    if names:
+        with database.make_session() as session:
+            names.update(
+                (int(id), contents)
+                for id, contents in session.query(
+                    SharedText.id, SharedText.contents
+                ).filter(SharedText.id.in_(list(names)))
+            )
+    for name in ["issues_per_callable", "fanout_per_caller", "frames_per_file"]:
+        stats[name]["top"] = [
+            # Names of rows without a shared text id stay unknown
+            {"name": names[key] or None, "count": count}
+            for key, count in stats[name]["top"]
+        ]
+    return stats
+
+
+def _format_distribution(stats: Stats) -> str:
+    if stats["count"] == 0:
+        return "-"
+    percentiles = " ".join(
+        f"{name} {value:g}" for name, value in stats["percentiles"].items()
+    )
+    return (
+        f"min {stats['min']} {percentiles} max {stats['max']} "
+        f"mean {stats['mean']:.2f}"
+    )
+
+
+def _echo_table(stats: Stats) -> None:
+    click.echo(f"Run {stats['run_id']}")
+    click.echo("\nTrace lengths per code")
+    for code, lengths in stats["trace_lengths"].items():
+        click.echo(f"  {code} ({lengths['forward']['count']} issues)")
+        for direction in ["forward", "backward"]:
+            click.echo(f"    {direction:<9} {_format_distribution(lengths[direction])}")
+    for name, title in [
+        ("issues_per_callable", "Issues per callable"),
+        ("fanout_per_caller", "Outgoing trace frames per caller"),
+        ("frames_per_file", "Trace frames per file"),
+    ]:
+        click.echo(f"\n{title}: {_format_distribution(stats[name])}")
+        for entry in stats[name]["top"]:
+            click.echo(f"  {entry['count']:>8} {entry['name'] or '(unnamed)'}")
+
+
+@click.command(name="stats")
+@click.pass_context
+@click.option("--run-id", type=int, help="run to describe (default: latest run)")
+@click.option(
+    "--top",
+    type=int,
+    default=DEFAULT_TOP,
+    show_default=True,
+    help="number of callables and files to list",
+)
+@click.option(
+    "--bins",
+    type=int,
+    default=DEFAULT_BINS,
+    show_default=True,
+    help="maximum number of histogram bins",
+)
+@click.option(
+    "--json", "as_json", is_flag=True, help="write JSON, including histograms"
+)
+def stats_command(
+    click_ctx: click.Context,
+    run_id: Optional[int],
+    top: int,
+    bins: int,
+    as_json: bool,
+) -> None:
+    """Show distributions over the issues and trace frames of a run"""
+    database = click_ctx.obj.database
+    if run_id is None:
+        with database.make_session() as session:
+            latest = (
+                session.query(Run.id)
+                .filter(Run.status == RunStatus.FINISHED)
+                .order_by(Run.id.desc())
+                .first()
+            )
+        if latest is None:
+            raise click.UsageError("No finished runs")
+        run_id = int(latest.id)
+
+    stats = run_stats(database, run_id, top, bins)
+    if as_json:
+        click.echo(json.dumps(stats, indent=2))
+    else:
+        _echo_table(stats)
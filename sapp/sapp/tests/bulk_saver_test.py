@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import os
+import pickle
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from ..bulk_saver import BulkSaver
+from ..db import DB, DBType
+from ..models import (
+    DBID,
+    Issue,
+    IssueDBID,
+    IssueInstance,
+    IssueInstanceSharedTextAssoc,
+    SharedText,
+    SharedTextKind,
+    SourceLocation,
+)
+
+
+class BulkSaverTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db = DB(DBType.SQLITE, os.path.join(self.tempdir.name, "test.db"))
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _add_issue(self, bulk_saver, handle, message):
+        issue = Issue.Record(
+            id=IssueDBID(),
+            handle=handle,
+            code=6016,
+            callable="module.function",
+            status="uncategorized",
+            first_seen=datetime(2019, 1, 1),
+        )
+        instance = IssueInstance.Record(
+            id=DBID(),
+            issue_id=issue.id,
+            location=SourceLocation(1, 2, 3),
+            filename="module.py",
+            run_id=1,
+            message_id=message.id,
+            min_trace_length_to_sources=1,
+            min_trace_length_to_sinks=1,
+            rank=0,
+            callable_count=1,
+            is_new_issue=True,
+        )
+        bulk_saver.add(issue)
+        bulk_saver.add(instance)
+        bulk_saver.add(
+            IssueInstanceSharedTextAssoc.Record(
+                issue_instance_id=instance.id, shared_text_id=message.id
+            )
+        )
+
+    def _save(self, parallel):
+        bulk_saver = BulkSaver()
+        message = SharedText.Record(
+            id=DBID(), contents="Tainted data", kind=SharedTextKind.MESSAGE
+        )
+        bulk_saver.add(message)
+        self._add_issue(bulk_saver, "handle1", message)
+        self._add_issue(bulk_saver, "handle2", message)
+        bulk_saver.save_all(self.db, parallel=parallel)
+
+    def _contents(self):
+        with self.db.make_session() as session:
+            return (
+                sorted(
+                    (row.issue.handle, row.message.contents, row.location)
+                    for row in session.query(IssueInstance)
+                ),
+                session.query(IssueInstanceSharedTextAssoc).count(),
+            )
+
+    def testParallelSaveMatchesSerialSave(self):
+        self._save(parallel=False)
+        serial = self._contents()
+
+        self._save(parallel=True)
+        instances, assoc_count = self._contents()
+
+        # Issues and messages are merged with the existing ones
+        self.assertEqual(instances, sorted(serial[0] * 2))
+        self.assertEqual(assoc_count, serial[1] * 2)
+        with self.db.make_session() as session:
+            self.assertEqual(session.query(Issue).count(), 2)
+            self.assertEqual(session.query(SharedText).count(), 1)
+
+        # Staging files are cleaned up
+        self.assertEqual(
+            sorted(os.listdir(self.tempdir.name)), ["test.db", "test.db.lock"]
+        )
+
+    def testSaveUnpickled(self):
+        bulk_saver = BulkSaver()
+        message = SharedText.Record(
+            id=DBID(), contents="Tainted data", kind=SharedTextKind.MESSAGE
+        )
+        bulk_saver.add(message)
+        self._add_issue(bulk_saver, "handle1", message)
+        # Records keep referring to each other's ids
+        pickle.loads(pickle.dumps(bulk_saver)).save_all(self.db)
+
+        instances, assoc_count = self._contents()
+        self.assertEqual(
+            instances, [("handle1", "Tainted data", SourceLocation(1, 2, 3))]
+        )
+        self.assertEqual(assoc_count, 1)
@@ -6,10 +6,13 @@ import unittest
 from unittest import TestCase
 from unittest.mock import patch
 
+import click
 from click.testing import CliRunner
+from sqlalchemy.pool import QueuePool
 
 from .. import __name__ as client
 from ..cli import cli
+from ..db import DB, DBType
 
 
 PIPELINE_RUN = f"{client}.pipeline.Pipeline.run"
@@ -67,6 +70,57 @@ class TestSappCli(TestCase):
         self.assertEqual(summary_blob["old_linemap_file"][:4], "/tmp")
         self.assertEqual(summary_blob["store_unused_models"], True)
 
+    def test_database_pools_connections(self, mock_analysis_output):
+        pools = []
+
+        def record_pool(pipeline, input_files, summary_blob):
+            database = click.get_current_context().find_root().obj.database
+            pools.append(database.engine.pool)
+
+        with patch(PIPELINE_RUN, record_pool):
+            with isolated_fs() as path:
+                result = self.runner.invoke(
+                    cli, ["--database-name", "sapp.db", "analyze", path]
+                )
+                self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(pools), 1)
+        self.assertIsInstance(pools[0], QueuePool)
+
+    def test_read_only_commands_open_database_read_only(self, mock_analysis_output):
+        with isolated_fs():
+            DB(DBType.SQLITE, "sapp.db")
+            with patch(f"{client}.cli.DB", wraps=DB) as db_class:
+                result = self.runner.invoke(
+                    cli, ["--database-name", "sapp.db", "stats"]
+                )
+        self.assertIn("No finished runs", result.output)
+        self.assertTrue(db_class.call_args.kwargs["read_only"])
+
+    def test_migrate_applies_rebuilds(self, mock_analysis_output):
+        with isolated_fs():
+            engine = DB(DBType.SQLITE, "sapp.db").engine
+            engine.execute("DROP TABLE trace_frame_annotations")
+            engine.execute(
+                "CREATE TABLE trace_frame_annotations ("
+                "id BIGINT NOT NULL PRIMARY KEY, location VARCHAR(255) NOT NULL, "
+                "message VARCHAR(4096) NOT NULL, link VARCHAR(4096), "
+                "trace_key VARCHAR(767), trace_frame_id BIGINT NOT NULL)"
+            )
+            engine.dispose()
+
+            result = self.runner.invoke(cli, ["--database-name", "sapp.db", "stats"])
+            self.assertIn("sapp migrate", str(result.exception))
+            result = self.runner.invoke(
+                cli, ["--database-name", "sapp.db", "migrate", "--dry-run"]
+            )
+            self.assertEqual(
+                result.output, "shared_annotation_texts\ninteger_source_locations\n"
+            )
+            result = self.runner.invoke(cli, ["--database-name", "sapp.db", "migrate"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("shared_annotation_texts", result.output)
+            self.assertEqual(DB(DBType.SQLITE, "sapp.db").pending_rebuilds(), [])
+
     def test_base_summary_blob(self, mock_analysis_output):
         with patch(PIPELINE_RUN, self.verify_base_summary_blob):
             with isolated_fs() as path:
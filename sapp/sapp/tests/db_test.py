@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import fcntl
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy.exc import OperationalError
+
+from ..db import DB, DBType
+from ..errors import AIException
+from ..models import Run, SharedText, SourceLocation, TraceFrame, TraceKind
+
+
+class DBTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.dbname = os.path.join(self.tempdir.name, "test db?.db")
+        with DB(DBType.SQLITE, self.dbname).make_session() as session:
+            session.add(SharedText(id=1, contents="via tito", kind="feature"))
+            session.commit()
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _connection_id(self, session):
+        return id(session.connection().connection.connection)
+
+    def testSessionsReusePooledConnections(self):
+        db = DB(DBType.SQLITE, self.dbname)
+        with db.make_session() as session:
+            first = self._connection_id(session)
+        with db.make_session() as session:
+            self.assertEqual(self._connection_id(session), first)
+
+    def testWriteLock(self):
+        db = DB(DBType.SQLITE, self.dbname)
+        with open(self.dbname + ".lock") as other:
+            with db.write_lock():
+                with self.assertRaises(BlockingIOError):
+                    fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def testOnlySetUpTakesWriteLock(self):
+        with patch.object(DB, "write_lock") as write_lock:
+            DB(DBType.SQLITE, self.dbname)
+            write_lock.assert_not_called()
+            DB(DBType.SQLITE, os.path.join(self.tempdir.name, "new.db"))
+            write_lock.assert_called_once()
+
+    def testPendingRebuildRefusesWrites(self):
+        engine = DB(DBType.SQLITE, self.dbname).engine
+        engine.execute("DROP TABLE trace_frame_annotations")
+        engine.execute(
+            "CREATE TABLE trace_frame_annotations (id BIGINT NOT NULL PRIMARY KEY, "
+            "location VARCHAR(255) NOT NULL, message VARCHAR(4096) NOT NULL, "
+            "link VARCHAR(4096), trace_key VARCHAR(767), "
+            "trace_frame_id BIGINT NOT NULL)"
+        )
+        engine.dispose()
+
+        with self.assertRaisesRegex(AIException, "sapp migrate"):
+            DB(DBType.SQLITE, self.dbname)
+        db = DB(DBType.SQLITE, self.dbname, allow_pending_rebuilds=True)
+        self.assertEqual(
+            db.pending_rebuilds(),
+            ["integer_source_locations", "shared_annotation_texts"],
+        )
+        DB(DBType.SQLITE, self.dbname, read_only=True)
+
+    def testReadOnly(self):
+        for immutable in [False, True]:
+            db = DB(DBType.SQLITE, self.dbname, read_only=True, immutable=immutable)
+            with db.make_session() as session:
+                self.assertEqual(session.query(SharedText).count(), 1)
+                session.add(SharedText(id=2, contents="other", kind="feature"))
+                with self.assertRaises(OperationalError):
+                    session.commit()
+
+    def testReadOnlyDoesNotCreateDatabase(self):
+        db = DB(
+            DBType.SQLITE, os.path.join(self.tempdir.name, "missing.db"), read_only=True
+        )
+        with self.assertRaises(OperationalError):
+            db.make_session_object().execute("SELECT 1")
+
+    def testPartitionedRuns(self):
+        dbname = os.path.join(self.tempdir.name, "partitioned.db")
+        db = DB(DBType.SQLITE, dbname, partitioned=True)
+        self.assertFalse(db.engine.has_table(TraceFrame.__tablename__))
+
+        for run_id in [1, 2]:
+            db.attach_run(run_id, create=True)
+            with db.make_session() as session:
+                session.add(Run(id=run_id, date=datetime.now()))
+                session.add(
+                    TraceFrame(
+                        id=run_id,
+                        kind=TraceKind.POSTCONDITION,
+                        caller="caller",
+                        callee="callee",
+                        callee_location=SourceLocation(run_id, 1, 2),
+                        filename="file.py",
+                        run_id=run_id,
+                    )
+                )
+                session.commit()
+        self.assertEqual(sorted(db.run_files()), [1, 2])
+
+        # Existing partitioned databases are recognized
+        db = DB(DBType.SQLITE, dbname)
+        self.assertTrue(db.partitioned)
+        for run_id in [1, 2]:
+            db.attach_run(run_id)
+            with db.make_session() as session:
+                self.assertEqual(
+                    [int(frame.run_id) for frame in session.query(TraceFrame)],
+                    [run_id],
+                )
+
+        db.drop_run(2)
+        self.assertEqual(sorted(db.run_files()), [1])
+        self.assertIsNone(db.attached_run_id)
+        with self.assertRaises(AIException):
+            db.attach_run(2)
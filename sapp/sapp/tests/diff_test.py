@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from ..db import DB, DBType
+from ..diff import DiffStatus, diff_runs
+from ..errors import AIException
+from ..models import Issue, IssueInstance, Run, RunStatus, SourceLocation
+
+
+class DiffTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _create_db(self, partitioned=False):
+        db = DB(
+            DBType.SQLITE,
+            os.path.join(self.tempdir.name, "test.db"),
+            partitioned=partitioned,
+        )
+        with db.make_session() as session:
+            for id, handle, code in [
+                (1, "persisting", 6016),
+                (2, "fixed", 6016),
+                (3, "moved_from", 5000),
+                (4, "moved_to", 5000),
+                (5, "new", 6016),
+            ]:
+                session.add(
+                    Issue(
+                        id=id,
+                        handle=handle,
+                        code=code,
+                        callable=f"module.{handle}",
+                        status="uncategorized",
+                        first_seen=datetime(2020, 1, 1),
+                    )
+                )
+            for run_id in [1, 2]:
+                session.add(
+                    Run(
+                        id=run_id,
+                        date=datetime(2020, 1, run_id),
+                        status=RunStatus.FINISHED,
+                    )
+                )
+            session.commit()
+
+        instance_id = 0
+        for run_id, issues in [
+            (1, [(1, 10), (2, 20), (3, 30)]),
+            (2, [(1, 11), (4, 32), (5, 40)]),
+        ]:
+            db.attach_run(run_id, create=True)
+            with db.make_session() as session:
+                for issue_id, line in issues:
+                    instance_id += 1
+                    session.add(
+                        IssueInstance(
+                            id=instance_id,
+                            location=SourceLocation(line, 1, 2),
+                            filename="b.py" if issue_id in (3, 4) else "a.py",
+                            run_id=run_id,
+                            issue_id=issue_id,
+                            message_id=1,
+                            min_trace_length_to_sources=1,
+                            min_trace_length_to_sinks=1,
+                        )
+                    )
+                session.commit()
+        db.attach_run(None)
+        return db
+
+    def _entries(self, db, linemap=None):
+        with diff_runs(db, 1, 2, linemap) as run_diff:
+            entries = [
+                (entry.status, entry.code, entry.filename, entry.location.line_no)
+                for entry in run_diff.entries(list(DiffStatus))
+            ]
+            return entries, run_diff.counts()
+
+    def testDiff(self):
+        entries, counts = self._entries(self._create_db())
+        self.assertEqual(
+            entries,
+            [
+                (DiffStatus.fixed, 5000, "b.py", 30),
+                (DiffStatus.new, 5000, "b.py", 32),
+                (DiffStatus.persisting, 6016, "a.py", 11),
+                (DiffStatus.fixed, 6016, "a.py", 20),
+                (DiffStatus.new, 6016, "a.py", 40),
+            ],
+        )
+        self.assertEqual(
+            counts,
+            {
+                DiffStatus.new: 2,
+                DiffStatus.moved: 0,
+                DiffStatus.fixed: 2,
+                DiffStatus.persisting: 1,
+            },
+        )
+
+    def testDiffWithLinemap(self):
+        db = self._create_db()
+        # Only lines of the same file count
+        linemap = {"b.py": {"32": [29, 30]}, "a.py": {"32": [20]}}
+        entries, counts = self._entries(db, linemap)
+        self.assertEqual(
+            entries,
+            [
+                (DiffStatus.moved, 5000, "b.py", 32),
+                (DiffStatus.persisting, 6016, "a.py", 11),
+                (DiffStatus.fixed, 6016, "a.py", 20),
+                (DiffStatus.new, 6016, "a.py", 40),
+            ],
+        )
+        self.assertEqual(counts[DiffStatus.moved], 1)
+        self.assertEqual(counts[DiffStatus.fixed], 1)
+
+    def testDiffPartitioned(self):
+        db = self._create_db(partitioned=True)
+        entries, _ = self._entries(db, {"b.py": {"32": [30]}})
+        self.assertEqual(
+            [status for status, *_ in entries],
+            [
+                DiffStatus.moved,
+                DiffStatus.persisting,
+                DiffStatus.fixed,
+                DiffStatus.new,
+            ],
+        )
+        # The connection's run files are detached again
+        entries_again, _ = self._entries(db)
+        self.assertEqual(len(entries_again), 5)
+
+    def testMissingRun(self):
+        db = self._create_db()
+        with self.assertRaises(AIException):
+            with diff_runs(db, 1, 3):
+                pass
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from ..bulk_saver import BulkSaver
+from ..db import DB, DBType
+from ..export import export_run, import_run
+from ..models import (
+    DBID,
+    Issue,
+    IssueDBID,
+    IssueInstance,
+    IssueInstanceFixInfo,
+    IssueInstanceSharedTextAssoc,
+    IssueInstanceTraceFrameAssoc,
+    PrimaryKeyGenerator,
+    Run,
+    RunStatus,
+    SharedText,
+    SharedTextKind,
+    SourceLocation,
+    TraceFrame,
+    TraceFrameAnnotation,
+    TraceFrameAnnotationText,
+    TraceFrameLeafAssoc,
+    TraceKind,
+)
+
+
+class ExportTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _db(self, name, **kwargs):
+        return DB(DBType.SQLITE, os.path.join(self.tempdir.name, name), **kwargs)
+
+    def _save_run(self, db, message_contents):
+        with db.make_session() as session:
+            run_id = PrimaryKeyGenerator().reserve(session, [Run]).get(Run)
+            session.add(
+                Run(
+                    id=run_id,
+                    job_id=message_contents,
+                    date=datetime(2019, 1, 1),
+                    status=RunStatus.FINISHED,
+                    kind="master",
+                )
+            )
+            session.commit()
+        db.attach_run(run_id, create=True)
+
+        bulk_saver = BulkSaver()
+        feature = SharedText.Record(
+            id=DBID(), contents="via tito", kind=SharedTextKind.FEATURE
+        )
+        message = SharedText.Record(
+            id=DBID(), contents=message_contents, kind=SharedTextKind.MESSAGE
+        )
+        source = SharedText.Record(
+            id=DBID(), contents="UserControlled", kind=SharedTextKind.SOURCE
+        )
+        issue = Issue.Record(
+            id=IssueDBID(),
+            handle="handle",
+            code=6016,
+            callable="module.function",
+            status="uncategorized",
+            first_seen=datetime(2019, 1, 1),
+        )
+        fix_info = IssueInstanceFixInfo.Record(id=DBID(), fix_info="fix")
+        instance = IssueInstance.Record(
+            id=DBID(),
+            issue_id=issue.id,
+            location=SourceLocation(1, 2, 3),
+            filename="module.py",
+            run_id=run_id,
+            message_id=message.id,
+            fix_info_id=fix_info.id,
+            min_trace_length_to_sources=1,
+            min_trace_length_to_sinks=1,
+            rank=0,
+            callable_count=1,
+            is_new_issue=False,
+        )
+        frames = [
+            TraceFrame.Record(
+                id=DBID(),
+                kind=TraceKind.POSTCONDITION,
+                caller="module.function",
+                caller_id=0,
+                caller_port="root",
+                callee=callee,
+                callee_id=0,
+                callee_port="source",
+                callee_location=SourceLocation(line, 2, 3),
+                filename="module.py",
+                filename_id=0,
+                run_id=run_id,
+                type_interval_lower=0,
+                type_interval_upper=0,
+                migrated_id=None,
+                preserves_type_context=False,
+                titos=[SourceLocation(line, 4, 5)],
+            )
+            for line, callee in enumerate(["module.source", "module.other"])
+        ]
+        bulk_saver.add_all([feature, message, source])
+        bulk_saver.add(issue)
+        bulk_saver.add(fix_info)
+        bulk_saver.add(instance)
+        bulk_saver.add_all(frames)
+        bulk_saver.add(
+            IssueInstanceSharedTextAssoc.Record(
+                issue_instance_id=instance.id, shared_text_id=feature.id
+            )
+        )
+        for frame in frames:
+            bulk_saver.add(
+                IssueInstanceTraceFrameAssoc.Record(
+                    issue_instance_id=instance.id, trace_frame_id=frame.id
+                )
+            )
+            bulk_saver.add(
+                TraceFrameLeafAssoc.Record(
+                    trace_frame_id=frame.id, leaf_id=source.id, trace_length=0
+                )
+            )
+        text = TraceFrameAnnotationText.Record(
+            id=DBID(), message="annotation", link=None, trace_key=None
+        )
+        bulk_saver.add(text)
+        for frame in frames:
+            bulk_saver.add(
+                TraceFrameAnnotation.Record(
+                    id=DBID(),
+                    location=SourceLocation(7, 8, 9),
+                    text_id=text.id,
+                    trace_frame_id=frame.id,
+                )
+            )
+        bulk_saver.save_all(db)
+        return run_id
+
+    def _contents(self, db, run_id):
+        db.attach_run(run_id)
+        with db.make_session() as session:
+            run = session.query(Run).filter(Run.id == run_id).one()
+            instance = (
+                session.query(IssueInstance)
+                .filter(IssueInstance.run_id == run_id)
+                .one()
+            )
+            return (
+                (run.job_id, run.kind, run.status, run.date),
+                (
+                    instance.issue.handle,
+                    instance.message.contents,
+                    instance.location,
+                    instance.fix_info.fix_info,
+                    sorted(text.contents for text in instance.shared_texts),
+                ),
+                sorted(
+                    (
+                        frame.callee,
+                        frame.callee_location,
+                        frame.titos,
+                        [leaf.contents for leaf in frame.leaves],
+                        [annotation.message for annotation in frame.annotations],
+                        len(frame.issue_instances),
+                    )
+                    for frame in session.query(TraceFrame).filter(
+                        TraceFrame.run_id == run_id
+                    )
+                ),
+            )
+
+    def testExportImportRoundTrip(self):
+        source_db = self._db("source.db", partitioned=True)
+        self._save_run(source_db, "first")
+        run_id = self._save_run(source_db, "second")
+
+        output = io.StringIO()
+        counts = export_run(source_db, run_id, output, batch_size=1)
+        self.assertEqual(
+            counts,
+            {
+                "Run": 1,
+                "SharedText": 3,
+                "Issue": 1,
+                "IssueInstanceFixInfo": 1,
+                "IssueInstance": 1,
+                "IssueInstanceSharedTextAssoc": 1,
+                "TraceFrame": 2,
+                "IssueInstanceTraceFrameAssoc": 2,
+                "TraceFrameAnnotationText": 1,
+                "TraceFrameAnnotation": 2,
+                "TraceFrameLeafAssoc": 2,
+            },
+        )
+
+        target_db = self._db("target.db")
+        self._save_run(target_db, "existing")
+        lines = output.getvalue().splitlines()
+        new_run_id = import_run(target_db, lines)
+
+        self.assertEqual(
+            self._contents(target_db, new_run_id), self._contents(source_db, run_id)
+        )
+        with target_db.make_session() as session:
+            # Issues and messages are merged with the existing ones
+            self.assertEqual(session.query(Issue).count(), 1)
+            self.assertEqual(
+                sorted(text.contents for text in session.query(SharedText)),
+                ["UserControlled", "existing", "second", "via tito"],
+            )
+            self.assertEqual(session.query(TraceFrameAnnotationText).count(), 1)
+
+    def testImportAnnotationsWithoutTexts(self):
+        source_db = self._db("source.db")
+        run_id = self._save_run(source_db, "first")
+        output = io.StringIO()
+        export_run(source_db, run_id, output)
+
+        # Exports used to have the text in every annotation
+        lines = []
+        for line in output.getvalue().splitlines():
+            values = json.loads(line)
+            if values["model"] == TraceFrameAnnotationText.__name__:
+                continue
+            if values["model"] == TraceFrameAnnotation.__name__:
+                del values["text_id"]
+                values.update(message="annotation", link=None, trace_key=None)
+            lines.append(json.dumps(values))
+
+        target_db = self._db("target.db")
+        new_run_id = import_run(target_db, lines)
+        self.assertEqual(
+            self._contents(target_db, new_run_id), self._contents(source_db, run_id)
+        )
+        with target_db.make_session() as session:
+            self.assertEqual(session.query(TraceFrameAnnotationText).count(), 1)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy.sql import func
+
+from ..db import DB, DBType
+from ..ingest import IngestionCoordinator
+from ..models import Issue, IssueInstance, Run, RunStatus, SharedText, TraceFrame
+from ..pysa_taint_parser import Parser
+
+
+def _issue(callable: str):
+    return {
+        "kind": "issue",
+        "data": {
+            "code": 5000,
+            "line": 10,
+            "callable_line": 5,
+            "start": 2,
+            "end": 9,
+            "callable": callable,
+            "message": "Data flows to sink",
+            "filename": "/repo/module.py",
+            "traces": [
+                {
+                    "name": "forward",
+                    "roots": [
+                        {
+                            "call": {
+                                "position": {
+                                    "filename": "/repo/module.py",
+                                    "line": 11,
+                                    "start": 1,
+                                    "end": 5,
+                                },
+                                "port": "result",
+                                "resolves_to": ["module.source"],
+                                "length": 1,
+                            },
+                            "leaves": [{"kind": "UserControlled"}],
+                        }
+                    ],
+                },
+                {
+                    "name": "backward",
+                    "roots": [
+                        {
+                            "root": {
+                                "filename": "/repo/module.py",
+                                "line": 12,
+                                "start": 1,
+                                "end": 5,
+                            },
+                            "leaves": [{"kind": "RCE"}],
+                        }
+                    ],
+                },
+            ],
+        },
+    }
+
+
+class IngestionCoordinatorTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db = DB(DBType.SQLITE, os.path.join(self.tempdir.name, "sapp.db"))
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _write_output(self, name: str, callables) -> str:
+        path = os.path.join(self.tempdir.name, name)
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "config": {"repo": "/repo"},
+                    "results": [_issue(callable) for callable in callables],
+                },
+                f,
+            )
+        return path
+
+    def testIngest(self):
+        input_files = [
+            self._write_output("a.json", ["module.a"]),
+            self._write_output("b.json", ["module.a", "module.b"]),
+            self._write_output("c.json", ["module.c"]),
+        ]
+        summary_blob = {
+            "run_kind": None,
+            "repository": "/repo",
+            "branch": None,
+            "commit_hash": None,
+            "job_id": None,
+            "old_linemap_file": None,
+            "store_unused_models": False,
+        }
+        run_summaries = IngestionCoordinator(
+            self.db, Parser, summary_blob, processes=2
+        ).ingest(input_files)
+
+        self.assertEqual(len(run_summaries), 3)
+        with self.db.make_session() as session:
+            runs = session.query(Run).all()
+            self.assertEqual(len(runs), 3)
+            self.assertTrue(all(run.status == RunStatus.FINISHED for run in runs))
+            self.assertEqual(
+                sorted(
+                    count
+                    for _, count in session.query(
+                        IssueInstance.run_id, func.count(IssueInstance.id)
+                    ).group_by(IssueInstance.run_id)
+                ),
+                [1, 1, 2],
+            )
+            # Issues and messages are shared between the runs
+            self.assertEqual(
+                sorted(callable for callable, in session.query(Issue.callable)),
+                ["module.a", "module.b", "module.c"],
+            )
+            self.assertEqual(
+                session.query(SharedText)
+                .filter(SharedText.contents == "Data flows to sink")
+                .count(),
+                1,
+            )
+            trace_frame_ids = [int(id) for id, in session.query(TraceFrame.id)]
+            self.assertEqual(len(trace_frame_ids), len(set(trace_frame_ids)))
+
+            # Summaries are computed while saving, but agree with the database
+            for run_summary in run_summaries:
+                saved_summary = (
+                    session.query(Run).filter(Run.id == run_summary.id).one()
+                ).get_summary()
+                self.assertEqual(
+                    (
+                        run_summary.num_new_issues,
+                        run_summary.num_total_issues,
+                        run_summary.alarm_counts,
+                    ),
+                    (
+                        saved_summary.num_new_issues,
+                        saved_summary.num_total_issues,
+                        saved_summary.alarm_counts,
+                    ),
+                )
+            self.assertEqual(
+                sum(run_summary.num_new_issues for run_summary in run_summaries), 3
+            )
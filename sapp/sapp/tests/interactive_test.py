@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 
+import json
 import os
 import sys
+import tempfile
 from datetime import datetime
 from io import StringIO
 from unittest import TestCase
 from unittest.mock import mock_open, patch
 
-from ..db import DB
+from sqlalchemy import event
+
+from .. import name_index
+from ..db import DB, DBType
 from ..decorators import UserError
+from ..ingest import IngestionCoordinator
 from ..interactive import Interactive, IssueQueryResult, TraceTuple
 from ..models import (
     Issue,
@@ -19,11 +25,33 @@ from ..models import (
     RunStatus,
     SharedText,
     SharedTextKind,
+    ShortestTrace,
     SourceLocation,
     TraceFrame,
     TraceFrameLeafAssoc,
     TraceKind,
 )
+from ..pysa_taint_parser import Parser
+
+
+def _pysa_position(line):
+    return {"filename": "/repo/module.py", "line": line, "start": 1, "end": 5}
+
+
+def _pysa_call(callees, line, length):
+    return {
+        "call": {
+            "position": _pysa_position(line),
+            "port": "result",
+            "resolves_to": callees,
+            "length": length,
+        },
+        "leaves": [{"kind": "UserControlled"}],
+    }
+
+
+def _pysa_root(line, leaf="UserControlled"):
+    return {"root": _pysa_position(line), "leaves": [{"kind": leaf}]}
 
 
 class InteractiveTest(TestCase):
@@ -147,6 +175,73 @@ class InteractiveTest(TestCase):
         self.assertNotIn("Issue 1", output)
         self.assertIn("Issue 2", output)
 
+    def testListIssuesPagination(self):
+        run = Run(id=1, date=datetime.now(), status=RunStatus.FINISHED)
+        issue_instances = [
+            self._generic_issue_instance(id=i, issue_id=i) for i in range(1, 4)
+        ]
+        shared_texts = [
+            SharedText(id=1, contents="Issue message", kind=SharedTextKind.MESSAGE),
+            SharedText(id=2, contents="source1", kind=SharedTextKind.SOURCE),
+            SharedText(id=3, contents="sink1", kind=SharedTextKind.SINK),
+        ]
+        assocs = [
+            IssueInstanceSharedTextAssoc(issue_instance_id=1, shared_text_id=2),
+            IssueInstanceSharedTextAssoc(issue_instance_id=3, shared_text_id=3),
+        ]
+
+        with self.db.make_session() as session:
+            session.add(run)
+            self._add_to_session(session, shared_texts)
+            self._add_to_session(
+                session, [self._generic_issue(id=i) for i in range(1, 4)]
+            )
+            self._add_to_session(session, issue_instances)
+            self._add_to_session(session, assocs)
+            session.commit()
+
+        self.interactive.setup()
+        # Leaves are fetched per batch
+        self.interactive.ISSUES_BATCH_SIZE = 2
+        self.interactive.issues()
+        output = self.stdout.getvalue().strip()
+        self.assertIn("Issue 1", output)
+        self.assertIn("Sources: source1", output)
+        self.assertIn("Sinks: sink1", output)
+        self.assertEqual(output.count("No sources"), 2)
+        self.assertEqual(output.count("No sinks"), 2)
+        self.assertIn("Found 3 issues", output)
+
+        self._clear_stdout()
+        self.interactive.issues(limit=2)
+        output = self.stdout.getvalue().strip()
+        self.assertIn("Issue 1", output)
+        self.assertIn("Issue 2", output)
+        self.assertNotIn("Issue 3", output)
+        self.assertIn("issues(limit=2, after=2)", output)
+
+        self._clear_stdout()
+        self.interactive.issues(codes=[1000, 1002], filenames="%.py", limit=1)
+        output = self.stdout.getvalue().strip()
+        self.assertIn("Issue 1", output)
+        self.assertIn(
+            "issues(codes=[1000, 1002], filenames='%.py', limit=1, after=1)", output
+        )
+
+        self._clear_stdout()
+        self.interactive.issues(after=2)
+        output = self.stdout.getvalue().strip()
+        self.assertNotIn("Issue 2", output)
+        self.assertIn("Issue 3", output)
+        self.assertIn("Found 1 issues", output)
+
+        self._clear_stdout()
+        self.interactive.issues(limit=1, offset=1)
+        output = self.stdout.getvalue().strip()
+        self.assertNotIn("Issue 1", output)
+        self.assertIn("Issue 2", output)
+        self.assertNotIn("Issue 3", output)
+
     def _list_issues_filter_setup(self):
         run = Run(id=1, date=datetime.now(), status=RunStatus.FINISHED)
         issues = [
@@ -233,6 +328,36 @@ class InteractiveTest(TestCase):
         self.assertNotIn("Issue 2", output)
         self.assertIn("Issue 3", output)
 
+    def testListIssuesFilterNameIndex(self):
+        self._list_issues_filter_setup()
+        with self.db.make_session() as session:
+            names = name_index.names(
+                session.query(Issue), session.query(IssueInstance), []
+            )
+        name_index.add_run(self.db.engine, 1, names)
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context, many):
+            statements.append(statement)
+
+        self.interactive.setup()
+        event.listen(self.db.engine, "before_cursor_execute", record_statement)
+        try:
+            self.interactive.issues(callables=["%sub%", "%function3"])
+            self.interactive.issues(filenames="module/s%")
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", record_statement)
+        output = self.stdout.getvalue().strip()
+        self.assertIn("Issue 1", output)
+        self.assertIn("Issue 2", output)
+        self.assertIn("Issue 3", output)
+        self.assertIn("Found 3 issues", output)
+        self.assertIn("Found 2 issues", output)
+        self.assertEqual(
+            len([statement for statement in statements if "name_index" in statement]),
+            2,
+        )
+
     def testNoRunsFound(self):
         self.interactive.setup()
         stderr = self.stderr.getvalue().strip()
@@ -560,6 +685,42 @@ class InteractiveTest(TestCase):
             self.assertEqual(len(next_frames), 1)
             self.assertEqual(int(next_frames[0].id), int(trace_frames[0].id))
 
+    def testNextTraceFramesUseRunIndexes(self):
+        run = Run(id=1, date=datetime.now(), status=RunStatus.FINISHED)
+        trace_frames = self._basic_trace_frames()
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context, many):
+            if "FROM trace_frames JOIN trace_frame_message_assoc" in statement:
+                statements.append((statement, parameters))
+
+        with self.db.make_session() as session:
+            self._add_to_session(session, trace_frames)
+            session.add(run)
+            session.commit()
+
+            self.interactive.setup()
+            event.listen(self.db.engine, "before_cursor_execute", record_statement)
+            try:
+                self.interactive._next_forward_trace_frames(session, trace_frames[0])
+                self.interactive._next_backward_trace_frames(session, trace_frames[1])
+            finally:
+                event.remove(self.db.engine, "before_cursor_execute", record_statement)
+
+            plans = [
+                " ".join(
+                    row[-1]
+                    for row in session.connection().execute(
+                        "EXPLAIN QUERY PLAN " + statement, parameters
+                    )
+                )
+                for statement, parameters in statements
+            ]
+
+        self.assertEqual(len(plans), 2)
+        self.assertIn("USING INDEX ix_traceframe_run_caller_and_port", plans[0])
+        self.assertIn("USING INDEX ix_traceframe_run_callee_and_port", plans[1])
+
     def testNavigateTraceFrames(self):
         run = Run(id=1, date=datetime.now(), status=RunStatus.FINISHED)
         trace_frames = self._basic_trace_frames()
@@ -579,6 +740,75 @@ class InteractiveTest(TestCase):
             self.assertEqual(int(result[0][0].id), 1)
             self.assertEqual(int(result[1][0].id), 2)
 
+    def testNavigateTraceFramesQueryCount(self):
+        run = Run(id=1, date=datetime.now(), status=RunStatus.FINISHED)
+        depth = 10
+        trace_frames = [
+            TraceFrame(
+                id=i,
+                kind=TraceKind.PRECONDITION,
+                caller=f"call{i}",
+                caller_port="root" if i == 1 else "param0",
+                callee="leaf" if i == depth else f"call{i + 1}",
+                callee_port="sink" if i == depth else "param0",
+                callee_location=SourceLocation(1, i),
+                filename="file.py",
+                run_id=1,
+            )
+            for i in range(1, depth + 1)
+        ]
+        # A branch that leads to a sink which isn't in the filter
+        trace_frames.append(
+            TraceFrame(
+                id=depth + 1,
+                kind=TraceKind.PRECONDITION,
+                caller="call2",
+                caller_port="param0",
+                callee="other",
+                callee_port="sink",
+                callee_location=SourceLocation(1, 0),
+                filename="file.py",
+                run_id=1,
+            )
+        )
+        sinks = [
+            SharedText(id=1, contents="sink1", kind=SharedTextKind.SINK),
+            SharedText(id=2, contents="sink2", kind=SharedTextKind.SINK),
+        ]
+        assocs = [
+            TraceFrameLeafAssoc(trace_frame_id=i, leaf_id=1, trace_length=depth - i)
+            for i in range(1, depth + 1)
+        ] + [TraceFrameLeafAssoc(trace_frame_id=depth + 1, leaf_id=2, trace_length=0)]
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context, many):
+            statements.append(statement)
+
+        with self.db.make_session() as session:
+            self._add_to_session(session, trace_frames)
+            self._add_to_session(session, sinks)
+            self._add_to_session(session, assocs)
+            session.add(run)
+            session.commit()
+
+            self.interactive.setup()
+            self.interactive.sinks = {"sink1"}
+            session.refresh(trace_frames[0])
+            event.listen(self.db.engine, "before_cursor_execute", record_statement)
+            try:
+                result = self.interactive._navigate_trace_frames(
+                    session, [trace_frames[0]]
+                )
+            finally:
+                event.remove(self.db.engine, "before_cursor_execute", record_statement)
+
+        self.assertEqual(
+            [(int(frame.id), branches) for frame, branches in result],
+            [(i, 1) for i in range(1, depth + 1)],
+        )
+        # One query for the reachable frames and one for their leaves
+        self.assertEqual(len(statements), 2)
+
     def testCreateTraceTuples(self):
         # reverse order
         postcondition_traces = [
@@ -1091,6 +1321,219 @@ class InteractiveTest(TestCase):
             self._add_to_session(session, assocs)
             session.commit()
 
+    def testTraceFromShortestTrace(self):
+        self._set_up_branched_trace()
+        with self.db.make_session() as session:
+            session.add(
+                ShortestTrace(
+                    issue_instance_id=1,
+                    kind=TraceKind.POSTCONDITION,
+                    trace_frame_ids=[2],
+                    branches=[2],
+                )
+            )
+            session.add(
+                ShortestTrace(
+                    issue_instance_id=1,
+                    kind=TraceKind.PRECONDITION,
+                    trace_frame_ids=[4],
+                    branches=[2],
+                )
+            )
+            session.commit()
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context, many):
+            statements.append(statement)
+
+        self.interactive.setup()
+        event.listen(self.db.engine, "before_cursor_execute", record_statement)
+        try:
+            self.interactive.issue(1)
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", record_statement)
+        self.assertFalse(any("RECURSIVE" in statement for statement in statements))
+
+        self._clear_stdout()
+        self.interactive.trace()
+        output = self.stdout.getvalue().strip()
+        self.assertIn("     1 +2 leaf       source file.py:1|1|1", output)
+        self.assertIn(" --> 2    call1      root   file.py:1|2|3", output)
+        self.assertIn("     3 +2 call2      param2 file.py:3|3|3", output)
+        self.assertIn("     4  [Missing trace frame: call2:param2]", output)
+
+    def _save_pysa_output(self, forward_roots, models):
+        """Saves an issue with the given forward trace roots and the models
+        of the callables they lead to, like `sapp analyze` does."""
+        issue = {
+            "kind": "issue",
+            "data": {
+                "code": 5000,
+                "line": 10,
+                "callable_line": 5,
+                "start": 2,
+                "end": 9,
+                "callable": "module.issue",
+                "message": "Data flows to sink",
+                "filename": "/repo/module.py",
+                "traces": [
+                    {"name": "forward", "roots": forward_roots},
+                    {"name": "backward", "roots": [_pysa_root(13, "RCE")]},
+                ],
+            },
+        }
+        models = [
+            {
+                "kind": "model",
+                "data": {
+                    "callable": callable,
+                    "sources": [{"port": "result", "taint": [trace]}],
+                    "sinks": [],
+                },
+            }
+            for callable, trace in models
+        ]
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "output.json")
+            with open(path, "w") as f:
+                json.dump({"config": {"repo": "/repo"}, "results": [issue] + models}, f)
+            coordinator = IngestionCoordinator(
+                self.db,
+                Parser,
+                {
+                    "run_kind": None,
+                    "repository": "/repo",
+                    "branch": None,
+                    "commit_hash": None,
+                    "job_id": None,
+                    "old_linemap_file": None,
+                    "store_unused_models": False,
+                },
+            )
+            coordinator.save(*coordinator.prepare(path))
+
+    def _stored_and_navigated_traces(self):
+        self.interactive.setup()
+        self.interactive.issue(1)
+        with self.db.make_session() as session:
+            stored = self.interactive._query_shortest_trace(
+                session, 1, TraceKind.POSTCONDITION
+            )
+            initial_trace_frames = self.interactive._initial_trace_frames(
+                session, 1, TraceKind.POSTCONDITION
+            )
+            navigated = [
+                self.interactive._navigate_shortest_trace(
+                    session, initial_trace_frames
+                ),
+                self.interactive._navigate_trace_frames(session, initial_trace_frames),
+            ]
+        return (
+            [(int(frame.id), frame.callee, branches) for frame, branches in stored],
+            [
+                [(int(frame.id), frame.callee, branches) for frame, branches in trace]
+                for trace in navigated
+            ],
+        )
+
+    def testShortestTraceMatchesNavigation(self):
+        # Both sources claim the same trace length, but only module.source2
+        # calls the leaf directly
+        self._save_pysa_output(
+            [
+                _pysa_call(["module.source"], 11, 1),
+                _pysa_call(["module.source2"], 12, 1),
+            ],
+            [
+                ("module.source", _pysa_call(["module.deeper"], 20, 1)),
+                ("module.deeper", _pysa_root(30)),
+                ("module.source2", _pysa_root(40)),
+            ],
+        )
+        stored, (navigated, _) = self._stored_and_navigated_traces()
+        self.assertEqual(
+            [(callee, branches) for _, callee, branches in stored],
+            [("module.source2", 2), ("leaf", 1)],
+        )
+        self.assertEqual(stored, navigated)
+
+    def testShortestTraceBreaksTiesById(self):
+        # All callees are called at the same location with the same length
+        self._save_pysa_output(
+            [_pysa_call(["module.a", "module.b", "module.c"], 11, 1)],
+            [
+                ("module.a", _pysa_root(20)),
+                ("module.b", _pysa_root(20)),
+                ("module.c", _pysa_root(20)),
+            ],
+        )
+        stored, navigated = self._stored_and_navigated_traces()
+        self.assertEqual(
+            [(callee, branches) for _, callee, branches in stored],
+            [("module.a", 3), ("leaf", 1)],
+        )
+        self.assertEqual(navigated, [stored, stored])
+
+    def testTraceCache(self):
+        self._set_up_branched_trace()
+        with self.db.make_session() as session:
+            session.add(Run(id=2, date=datetime.now(), status=RunStatus.FINISHED))
+            session.commit()
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context, many):
+            if "trace_frame" in statement:
+                statements.append(statement)
+
+        self.interactive.setup()
+        self.interactive.run(1)
+        self.interactive.issue(1)
+        self.interactive.branch(2)
+        self.assertGreater(self.interactive.cache.misses, 0)
+        hits = self.interactive.cache.hits
+
+        # Going back to the same issue and branch doesn't query trace frames
+        event.listen(self.db.engine, "before_cursor_execute", record_statement)
+        try:
+            self.interactive.issue(1)
+            self.interactive.branch(2)
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", record_statement)
+        self.assertEqual(statements, [])
+        self.assertGreater(self.interactive.cache.hits, hits)
+
+        self._clear_stdout()
+        self.interactive.state()
+        self.assertIn(f"Cache: {self.interactive.cache}", self.stdout.getvalue())
+
+        # Changing the run invalidates the cache
+        self.interactive.run(2)
+        self.assertEqual(len(self.interactive.cache), 0)
+
+    def testWarmCache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.db = DB(DBType.SQLITE, os.path.join(directory, "warm.db"))
+            self.interactive = Interactive(self.db, "")
+            self._set_up_branched_trace()
+
+            self.interactive.setup()
+            self.interactive._warming_thread.join()
+            self.assertIn((1, "issue", 1), self.interactive.cache)
+            self.assertIn(
+                (1, "initial", 1, TraceKind.POSTCONDITION), self.interactive.cache
+            )
+
+            hits = self.interactive.cache.hits
+            self.interactive.issue(1)
+            self.assertGreater(self.interactive.cache.hits, hits)
+            self.assertEqual(self.interactive.sources, {"source1"})
+            self.assertEqual(self.interactive.visited_codes, {1000: 1})
+
+            # Selecting another run cancels the running warmer
+            stop = self.interactive._warming_stop
+            self.interactive.current_run_id = -1
+            self.assertTrue(stop.is_set())
+
     def testTraceBranchNumber(self):
         self._set_up_branched_trace()
 
@@ -1517,32 +1960,6 @@ else:
             self.assertIn("Couldn't open", self.stderr.getvalue())
             self.assertNotIn("file.py", self.stdout.getvalue())
 
-    def testGroupTraceFrames(self):
-        trace_frames = [
-            TraceFrame(id=1, caller="caller1", caller_port="port1"),
-            TraceFrame(id=2, caller="caller1", caller_port="port1"),
-            TraceFrame(id=3, caller="caller2", caller_port="port2"),
-            TraceFrame(id=4, caller="caller2", caller_port="port2"),
-            TraceFrame(id=5, caller="caller2", caller_port="port3"),
-        ]
-
-        buckets = self.interactive._group_trace_frames(trace_frames, 5)
-
-        self.assertEqual(3, len(buckets.keys()))
-        self.assertIn(("caller1", "port1"), buckets.keys())
-        self.assertIn(("caller2", "port2"), buckets.keys())
-        self.assertIn(("caller2", "port3"), buckets.keys())
-
-        self.assertEqual(
-            [1, 2], [int(frame.id) for frame in buckets[("caller1", "port1")]]
-        )
-        self.assertEqual(
-            [3, 4], [int(frame.id) for frame in buckets[("caller2", "port2")]]
-        )
-        self.assertEqual(
-            [5], [int(frame.id) for frame in buckets[("caller2", "port3")]]
-        )
-
     def testListTracesBasic(self):
         trace_frames = [
             TraceFrame(
@@ -1676,11 +2093,29 @@ else:
                 "1        leaf:source",
                 "...",
                 "Showing 3/6 matching frames. To see more, call 'frames' with "
-                "the 'limit' argument.",
+                "after=1.",
                 "",
             ],
         )
 
+        self._clear_stdout()
+        self.interactive.frames(limit=3, after=1)
+        self.assertEqual(
+            self.stdout.getvalue().split("\n"),
+            [
+                "[id] [caller:caller_port -> callee:callee_port]",
+                "---- call1:root ->",
+                "2        leaf:source",
+                "---- call2:param2 ->",
+                "5        leaf:sink",
+                "6        leaf:sink",
+                "",
+            ],
+        )
+
+        self.interactive.frames(after=7)
+        self.assertIn("Trace frame 7 doesn't exist", self.stderr.getvalue())
+
     def testSetFrame(self):
         trace_frames = self._basic_trace_frames()
         shared_text = SharedText(id=1, contents="sink", kind=SharedTextKind.SINK)
@@ -1800,6 +2235,30 @@ else:
         self.interactive.parents()
         self.assertIn("Try running from a non-leaf node", self.stderr.getvalue())
 
+    def testParentsWithLimit(self):
+        self._set_up_branched_trace()
+        self.interactive.setup()
+
+        self.interactive.frame(3)
+        self.interactive.current_trace_frame_index = 1
+
+        self._clear_stdout()
+        with patch("click.prompt", return_value=0):
+            self.interactive.parents(limit=1)
+        self.assertEqual(
+            self.stdout.getvalue().split("\n"),
+            [
+                "[1] call1 : root",
+                "Showing 1/2 parents. To see more, call 'parents' with after=3.",
+                "",
+            ],
+        )
+
+        self._clear_stdout()
+        with patch("click.prompt", return_value=0):
+            self.interactive.parents(limit=1, after=3)
+        self.assertEqual(self.stdout.getvalue().split("\n"), ["[1] call1 : root", ""])
+
     def testParentsSelectParent(self):
         self._set_up_branched_trace()
         self.interactive.setup()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import socket
+import tempfile
+import threading
+from datetime import datetime
+from unittest import TestCase
+
+from ..db import DB, DBType
+from ..lint import LintServer
+from ..models import (
+    Issue,
+    IssueInstance,
+    Run,
+    RunStatus,
+    SharedText,
+    SourceLocation,
+    TraceFrame,
+    TraceKind,
+)
+
+
+class LintServerTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.repository = os.path.join(self.tempdir.name, "repository")
+        self.db = DB(DBType.SQLITE, os.path.join(self.tempdir.name, "sapp.db"))
+        with self.db.make_session() as session:
+            session.add(SharedText(id=1, contents="message"))
+            session.add(
+                Issue(
+                    id=1,
+                    handle="handle",
+                    code=6016,
+                    callable="module.function",
+                    first_seen=datetime.now(),
+                )
+            )
+            session.commit()
+        self._add_run(1, "module.py")
+
+        self.server = LintServer(
+            os.path.join(self.tempdir.name, "lint.sock"), self.db, self.repository
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.tempdir.cleanup()
+
+    def _add_run(self, run_id: int, filename: str) -> None:
+        with self.db.make_session() as session:
+            session.add(Run(id=run_id, date=datetime.now(), status=RunStatus.FINISHED))
+            session.add(
+                IssueInstance(
+                    id=run_id,
+                    location=SourceLocation(3, 4, 5),
+                    filename=filename,
+                    run_id=run_id,
+                    issue_id=1,
+                    message_id=1,
+                )
+            )
+            session.add(
+                TraceFrame(
+                    id=run_id,
+                    kind=TraceKind.POSTCONDITION,
+                    caller="caller",
+                    caller_port="root",
+                    callee="callee",
+                    callee_port="source",
+                    callee_location=SourceLocation(1, 2, 3),
+                    filename=filename,
+                    run_id=run_id,
+                )
+            )
+            session.commit()
+
+    def _request(self, connection, request) -> dict:
+        connection.sendall(json.dumps(request).encode() + b"\n")
+        return json.loads(connection.makefile().readline())
+
+    def testLint(self):
+        with socket.socket(socket.AF_UNIX) as connection:
+            connection.connect(self.server.server_address)
+            response = self._request(
+                connection,
+                {"filenames": [os.path.join(self.repository, "module.py"), "other.py"]},
+            )
+            self.assertEqual(response["run_id"], 1)
+            self.assertEqual(
+                response["lints"],
+                [
+                    {
+                        "filename": os.path.join(self.repository, "module.py"),
+                        "code": "postcondition",
+                        "message": "caller:root -> callee->source",
+                        "line": 1,
+                        "col": 2,
+                        "length": 6,
+                    },
+                    {
+                        "filename": os.path.join(self.repository, "module.py"),
+                        "code": "6016",
+                        "message": "message",
+                        "line": 3,
+                        "col": 4,
+                        "length": 10,
+                    },
+                ],
+            )
+
+            self.assertIn("error", self._request(connection, {"files": []}))
+
+            # A newer finished run replaces the index
+            self._add_run(2, "other.py")
+            response = self._request(connection, {"filenames": ["other.py"]})
+            self.assertEqual(response["run_id"], 2)
+            self.assertEqual(len(response["lints"]), 2)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+from unittest import TestCase
+
+from ..lru_cache import LRUCache
+
+
+class LRUCacheTest(TestCase):
+    def testGet(self):
+        cache = LRUCache(2)
+        self.assertEqual(cache.get("a", lambda: 1), 1)
+        self.assertEqual(cache.get("a", lambda: 2), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(str(cache), "1 hits, 1 misses, 1/2 entries")
+
+    def testEvictsLeastRecentlyUsed(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a", lambda: None)
+        cache.put("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(len(cache), 2)
+
+    def testClear(self):
+        cache = LRUCache(2)
+        cache.get("a", lambda: 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+from unittest import TestCase
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from .. import migrations, models, name_index
+from ..models import SharedText, SourceLocation, TraceFrame, TraceFrameAnnotation
+
+
+class MigrationsTest(TestCase):
+    def setUp(self) -> None:
+        self.engine = sqlalchemy.create_engine("sqlite://")
+
+    def _index_names(self, table_name):
+        return {
+            index["name"]
+            for index in sqlalchemy.inspect(self.engine).get_indexes(table_name)
+        }
+
+    def testNewDatabaseNeedsNoMigrations(self):
+        models.create(self.engine)
+        self.assertEqual(migrations.migrate(self.engine), [])
+
+    def testSharedTextContentsHash(self):
+        self.engine.execute(
+            """
+            CREATE TABLE messages (
+                id BIGINT NOT NULL PRIMARY KEY,
+                contents VARCHAR(4096) NOT NULL,
+                kind VARCHAR(8) DEFAULT 'feature' NOT NULL
+            )
+            """
+        )
+        self.engine.execute(
+            "CREATE INDEX ix_messages_handle ON messages (contents, kind)"
+        )
+        self.engine.execute(
+            "INSERT INTO messages (id, contents, kind) VALUES "
+            "(1, 'via tito', 'feature'), (2, 'UserControlled', 'source')"
+        )
+        models.create(self.engine)
+
+        self.assertEqual(migrations.migrate(self.engine), ["shared_text_contents_hash"])
+        self.assertEqual(
+            dict(
+                self.engine.execute(
+                    "SELECT contents, contents_hash FROM messages"
+                ).fetchall()
+            ),
+            {
+                "via tito": SharedText.hash_contents("via tito"),
+                "UserControlled": SharedText.hash_contents("UserControlled"),
+            },
+        )
+        indexes = self._index_names("messages")
+        self.assertIn("ix_messages_kind_contents_hash", indexes)
+        self.assertNotIn("ix_messages_handle", indexes)
+
+        # Migrations are idempotent
+        self.assertEqual(migrations.migrate(self.engine), [])
+
+    def testOptionalMigrations(self):
+        models.create(self.engine)
+        for index_name in migrations.TRACE_FRAME_NAVIGATION_INDEXES:
+            self.engine.execute(f"DROP INDEX {index_name}")
+
+        self.assertEqual(migrations.migrate(self.engine), [])
+        self.assertEqual(
+            [migration.name for migration in migrations.pending(self.engine)],
+            ["trace_frame_navigation_indexes"],
+        )
+
+        self.assertEqual(
+            migrations.migrate(self.engine, include_optional=True),
+            ["trace_frame_navigation_indexes"],
+        )
+        self.assertTrue(
+            set(migrations.TRACE_FRAME_NAVIGATION_INDEXES).issubset(
+                self._index_names(TraceFrame.__tablename__)
+            )
+        )
+        self.assertEqual(migrations.pending(self.engine), [])
+
+    def testNameIndexBackfill(self):
+        models.create(self.engine)
+        name_index.create(self.engine)
+        self.assertEqual(migrations.pending(self.engine), [])
+        self.engine.execute(
+            "INSERT INTO runs (id, date, status, job_id) "
+            "VALUES (1, '2020-01-01 00:00:00', 'finished', '')"
+        )
+        self.engine.execute(
+            "INSERT INTO issues (id, handle, code, callable, first_seen) "
+            "VALUES (1, 'handle', 6016, 'module.function', '2020-01-01 00:00:00')"
+        )
+
+        self.assertEqual(
+            [migration.name for migration in migrations.pending(self.engine)],
+            ["name_index_backfill"],
+        )
+        self.assertEqual(
+            migrations.migrate(self.engine, include_optional=True),
+            ["name_index_backfill"],
+        )
+        self.assertEqual(
+            self.engine.execute(
+                name_index.matching_names("callable", ["%func%"])
+            ).fetchall(),
+            [("module.function",)],
+        )
+        self.assertEqual(migrations.pending(self.engine), [])
+
+    def testWarningCodeStatsBackfill(self):
+        models.create(self.engine)
+        self.engine.execute(
+            "INSERT INTO runs (id, date, status, job_id) VALUES "
+            "(1, '2020-01-01 00:00:00', 'finished', '1'), "
+            "(2, '2020-01-02 00:00:00', 'incomplete', '2')"
+        )
+        self.engine.execute(
+            "INSERT INTO issues (id, handle, code, callable, first_seen) VALUES "
+            "(1, 'handle1', 6016, 'module.f', '2020-01-01 00:00:00'), "
+            "(2, 'handle2', 6016, 'module.g', '2020-01-01 00:00:00'), "
+            "(3, 'handle3', 5000, 'module.h', '2020-01-01 00:00:00')"
+        )
+        for id, run_id, issue_id, is_new_issue in [
+            (1, 1, 1, 1),
+            (2, 1, 2, 0),
+            (3, 1, 3, 1),
+            (4, 2, 1, 0),
+        ]:
+            self.engine.execute(
+                "INSERT INTO issue_instances (id, location, filename, run_id, "
+                "issue_id, message_id, min_trace_length_to_sources, "
+                "min_trace_length_to_sinks, is_new_issue) "
+                f"VALUES ({id}, '1|2|3', 'module.py', {run_id}, {issue_id}, 1, "
+                f"{id}, 1, {is_new_issue})"
+            )
+
+        self.assertEqual(
+            [migration.name for migration in migrations.pending(self.engine)],
+            ["warning_code_stats_backfill"],
+        )
+        self.assertEqual(
+            migrations.migrate(self.engine, include_optional=True),
+            ["warning_code_stats_backfill"],
+        )
+        self.assertEqual(
+            self.engine.execute(
+                "SELECT run_id, code, issue_count, new_issue_count, "
+                "fwd_trace_len_sum, fwd_trace_len_count, bwd_trace_len_sum, "
+                "bwd_trace_len_count, rolled_up FROM warning_code_run_stats "
+                "ORDER BY code"
+            ).fetchall(),
+            [(1, 5000, 1, 1, 3, 1, 1, 1, 0), (1, 6016, 2, 1, 3, 2, 2, 2, 0)],
+        )
+        self.assertEqual(migrations.pending(self.engine), [])
+
+    def testIntegerSourceLocations(self):
+        models.create(self.engine)
+        self.engine.execute("DROP TABLE trace_frames")
+        self.engine.execute(
+            """
+            CREATE TABLE trace_frames (
+                id BIGINT NOT NULL PRIMARY KEY,
+                kind VARCHAR(14) NOT NULL,
+                caller VARCHAR(767) NOT NULL,
+                caller_port VARCHAR(767) DEFAULT '' NOT NULL,
+                callee VARCHAR(767) NOT NULL,
+                callee_location VARCHAR(255) NOT NULL,
+                callee_port VARCHAR(767) DEFAULT '' NOT NULL,
+                filename VARCHAR(4096) NOT NULL,
+                run_id BIGINT NOT NULL,
+                titos VARCHAR(4096) DEFAULT '' NOT NULL
+            )
+            """
+        )
+        self.engine.execute(
+            "CREATE INDEX ix_trace_frames_run_id ON trace_frames (run_id)"
+        )
+        self.engine.execute(
+            "INSERT INTO trace_frames VALUES "
+            "(1, 'postcondition', 'a', 'root', 'b', '10|1|5', 'source', 'f.py', 1, "
+            "'11|2|3,12|4|5'), "
+            "(2, 'postcondition', 'a', 'root', 'c', '9|1|5', 'source', 'f.py', 1, '')"
+        )
+
+        # Rebuilding tables is left to `sapp migrate`
+        self.assertEqual(migrations.migrate(self.engine), [])
+        self.assertEqual(
+            migrations.pending_rebuilds(self.engine, {}), ["integer_source_locations"]
+        )
+        with self.assertLogs("sapp", level="WARNING") as logs:
+            self.assertIn(
+                "integer_source_locations",
+                migrations.migrate(self.engine, include_optional=True),
+            )
+        self.assertIn("Rewriting all 2 rows of trace_frames", logs.output[0])
+        self.assertEqual(migrations.pending_rebuilds(self.engine, {}), [])
+        self.assertEqual(
+            self.engine.execute(
+                "SELECT typeof(callee_location), typeof(titos) FROM trace_frames"
+            ).fetchall(),
+            [("integer", "blob"), ("integer", "blob")],
+        )
+        self.assertTrue(
+            set(migrations.TRACE_FRAME_NAVIGATION_INDEXES).issubset(
+                self._index_names(TraceFrame.__tablename__)
+            )
+        )
+
+        session = Session(bind=self.engine)
+        frames = session.query(TraceFrame).order_by(TraceFrame.callee_location).all()
+        self.assertEqual(
+            [(frame.callee, frame.callee_location, frame.titos) for frame in frames],
+            [
+                ("c", SourceLocation(9, 1, 5), []),
+                (
+                    "b",
+                    SourceLocation(10, 1, 5),
+                    [SourceLocation(11, 2, 3), SourceLocation(12, 4, 5)],
+                ),
+            ],
+        )
+        # Columns the old table didn't have get their defaults
+        self.assertEqual([int(frame.caller_id) for frame in frames], [0, 0])
+
+    def _create_legacy_annotations(self, engine, location_type="BIGINT"):
+        engine.execute("DROP TABLE trace_frame_annotations")
+        engine.execute(
+            f"""
+            CREATE TABLE trace_frame_annotations (
+                id BIGINT NOT NULL PRIMARY KEY,
+                location {location_type} NOT NULL,
+                message VARCHAR(4096) NOT NULL,
+                link VARCHAR(4096),
+                trace_key VARCHAR(767),
+                trace_frame_id BIGINT NOT NULL
+            )
+            """
+        )
+        engine.execute(
+            "CREATE INDEX ix_trace_frame_annotations_trace_frame_id "
+            "ON trace_frame_annotations (trace_frame_id)"
+        )
+
+    def testSharedAnnotationTexts(self):
+        models.create(self.engine)
+        self._create_legacy_annotations(self.engine, location_type="VARCHAR(255)")
+        self.engine.execute(
+            "INSERT INTO trace_frame_annotations VALUES "
+            "(1, '1|2|3', 'message', NULL, NULL, 10), "
+            "(2, '4|5|6', 'message', NULL, NULL, 11), "
+            "(3, '7|8|9', 'message', 'link', 'key', 11)"
+        )
+        self.engine.execute(
+            "INSERT INTO primary_keys (table_name, current_id) "
+            "VALUES ('TraceFrameAnnotation', 3)"
+        )
+
+        self.assertEqual(migrations.migrate(self.engine), [])
+        self.assertEqual(
+            migrations.migrate(self.engine, include_optional=True),
+            ["shared_annotation_texts"],
+        )
+        session = Session(bind=self.engine)
+        self.assertEqual(
+            [
+                (
+                    int(annotation.id),
+                    annotation.location,
+                    int(annotation.text_id),
+                    annotation.message,
+                    annotation.link,
+                    annotation.trace_key,
+                )
+                for annotation in session.query(TraceFrameAnnotation).order_by(
+                    TraceFrameAnnotation.id
+                )
+            ],
+            [
+                (1, SourceLocation(1, 2, 3), 1, "message", None, None),
+                (2, SourceLocation(4, 5, 6), 1, "message", None, None),
+                (3, SourceLocation(7, 8, 9), 3, "message", "link", "key"),
+            ],
+        )
+        self.assertEqual(
+            self.engine.execute(
+                "SELECT current_id FROM primary_keys "
+                "WHERE table_name = 'TraceFrameAnnotationText'"
+            ).scalar(),
+            3,
+        )
+        self.assertIn(
+            "ix_trace_frame_annotations_trace_frame_id",
+            self._index_names(TraceFrameAnnotation.__tablename__),
+        )
+        self.assertEqual(migrations.pending_rebuilds(self.engine, {}), [])
+
+    def testMigrateRunFiles(self):
+        with tempfile.TemporaryDirectory() as directory:
+            models.create(self.engine, partitioned=True)
+            self.engine.execute(
+                "INSERT INTO primary_keys (table_name, current_id) "
+                "VALUES ('TraceFrameAnnotation', 2)"
+            )
+            run_files = {}
+            for run_id in [1, 2]:
+                run_files[run_id] = os.path.join(directory, f"run_{run_id}.db")
+                engine = sqlalchemy.create_engine(f"sqlite:///{run_files[run_id]}")
+                models.create_run_scoped(engine)
+                self._create_legacy_annotations(engine)
+                engine.execute(
+                    "INSERT INTO trace_frame_annotations VALUES "
+                    f"({run_id}, 1, 'message', NULL, NULL, 10)"
+                )
+                engine.dispose()
+
+            self.assertEqual(
+                migrations.pending_rebuilds(self.engine, run_files),
+                ["shared_annotation_texts"],
+            )
+            self.assertEqual(
+                migrations.migrate_run_files(self.engine, run_files),
+                ["shared_annotation_texts"],
+            )
+            for run_id, path in run_files.items():
+                engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+                self.assertEqual(
+                    engine.execute(
+                        "SELECT text_id, message FROM trace_frame_annotations "
+                        "JOIN trace_frame_annotation_texts t ON t.id = text_id"
+                    ).fetchall(),
+                    [(run_id, "message")],
+                )
+                engine.dispose()
+            self.assertEqual(migrations.migrate_run_files(self.engine, run_files), [])
+            self.assertEqual(migrations.pending_rebuilds(self.engine, run_files), [])
+
+    def testHashContentsFitsInBigInteger(self):
+        for contents in ["", "a", "x" * 4096, "unicode ✓"]:
+            contents_hash = SharedText.hash_contents(contents)
+            self.assertGreaterEqual(contents_hash, -(1 << 63))
+            self.assertLess(contents_hash, 1 << 63)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+from datetime import datetime
+from unittest import TestCase
+
+from ..db import DB
+from ..models import (
+    DBID,
+    Issue,
+    IssueDBID,
+    SharedText,
+    SharedTextKind,
+    SourceLocation,
+    SourceLocationsType,
+    SourceLocationType,
+    TraceFrame,
+    TraceKind,
+)
+
+
+class ModelsTest(TestCase):
+    def setUp(self) -> None:
+        self.db = DB("memory")
+
+    def testMergeSharedTextsWithExisting(self):
+        with self.db.make_session() as session:
+            session.add(SharedText(id=1, contents="via tito", kind="feature"))
+            session.add(SharedText(id=2, contents="UserControlled", kind="source"))
+            session.commit()
+
+        items = [
+            SharedText.Record(
+                id=DBID(), contents="via tito", kind=SharedTextKind.FEATURE
+            ),
+            # Same contents, different kind: not a match
+            SharedText.Record(
+                id=DBID(), contents="via tito", kind=SharedTextKind.SOURCE
+            ),
+            SharedText.Record(
+                id=DBID(), contents="UserControlled", kind=SharedTextKind.SOURCE
+            ),
+            # Duplicate of a new item
+            SharedText.Record(
+                id=DBID(), contents="via tito", kind=SharedTextKind.SOURCE
+            ),
+        ]
+
+        with self.db.make_session() as session:
+            new_items = list(SharedText.merge(session, iter(items)))
+
+        self.assertEqual(new_items, [items[1]])
+        self.assertEqual(items[0].id.resolved(), 1)
+        self.assertFalse(items[0].id.is_new)
+        self.assertEqual(items[2].id.resolved(), 2)
+        items[1].id.resolve(3)
+        self.assertEqual(items[3].id.resolved(), 3)
+
+    def testMergeIssuesByHandle(self):
+        with self.db.make_session() as session:
+            session.add(
+                Issue(
+                    id=7,
+                    handle="existing",
+                    code=6016,
+                    callable="module.function",
+                    first_seen=datetime.now(),
+                )
+            )
+            session.commit()
+
+        issues = [
+            Issue.Record(id=IssueDBID(), handle="existing"),
+            Issue.Record(id=IssueDBID(), handle="new"),
+        ]
+
+        with self.db.make_session() as session:
+            new_issues = list(Issue.merge(session, iter(issues)))
+            # The temporary key table is dropped once the merge is done
+            self.assertNotIn(
+                "tmp_merge_issues",
+                [
+                    name
+                    for name, in session.execute(
+                        "SELECT name FROM sqlite_temp_master WHERE type = 'table'"
+                    )
+                ],
+            )
+
+        self.assertEqual(new_issues, [issues[1]])
+        self.assertEqual(issues[0].id.resolved(), 7)
+
+    def testMergeNothing(self):
+        with self.db.make_session() as session:
+            self.assertEqual(list(SharedText.merge(session, iter([]))), [])
+
+    def testSourceLocationsAsIntegers(self):
+        locations = [SourceLocation(2, 1, 70000), SourceLocation(10, 3, 4)]
+        with self.assertLogs("sapp", level="WARNING") as logs:
+            for location in locations:
+                self.assertEqual(
+                    SourceLocation.from_int(SourceLocation.to_int(location)),
+                    SourceLocation(location.line_no, location.begin_column, 0xFFFF)
+                    if location.end_column > 0xFFFF
+                    else location,
+                )
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Column 70000 of location 2|1|70000", logs.output[0])
+        # Packed locations order numerically by line, unlike strings
+        self.assertLess(
+            SourceLocation.to_int(SourceLocation(9, 80, 80)),
+            SourceLocation.to_int(SourceLocation(10, 1, 1)),
+        )
+
+        locations_type = SourceLocationsType()
+        packed = locations_type.process_bind_param(locations, None)
+        self.assertEqual(len(packed), 16)
+        self.assertEqual(
+            locations_type.process_result_value(packed, None),
+            [SourceLocation(2, 1, 0xFFFF), SourceLocation(10, 3, 4)],
+        )
+        # Strings from older databases
+        self.assertEqual(
+            locations_type.process_result_value("2|1|5,10|3|4", None),
+            [SourceLocation(2, 1, 5), SourceLocation(10, 3, 4)],
+        )
+        self.assertEqual(locations_type.process_result_value("", None), [])
+
+    def testQueryLocationsByLines(self):
+        with self.db.make_session() as session:
+            for id, line in enumerate([9, 10, 11, 12], start=1):
+                session.add(
+                    TraceFrame(
+                        id=id,
+                        kind=TraceKind.POSTCONDITION,
+                        caller="caller",
+                        caller_port="root",
+                        callee="callee",
+                        callee_port="source",
+                        callee_location=SourceLocation(line, 5, 20),
+                        filename="file.py",
+                        run_id=1,
+                        titos=[SourceLocation(line, 1, 2)],
+                    )
+                )
+            session.commit()
+
+            frames = (
+                session.query(TraceFrame)
+                .filter(SourceLocationType.in_lines(TraceFrame.callee_location, 10, 11))
+                .order_by(TraceFrame.callee_location)
+                .all()
+            )
+            self.assertEqual(
+                [frame.callee_location.line_no for frame in frames], [10, 11]
+            )
+            self.assertEqual(frames[0].titos, [SourceLocation(10, 1, 2)])
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import fcntl
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from ..bulk_saver import BulkSaver
+from ..db import DB, DBType
+from ..models import (
+    DBID,
+    Issue,
+    IssueDBID,
+    IssueInstance,
+    IssueInstanceSharedTextAssoc,
+    IssueInstanceTraceFrameAssoc,
+    PrimaryKeyGenerator,
+    Run,
+    RunStatus,
+    SharedText,
+    SharedTextKind,
+    SourceLocation,
+    TraceFrame,
+    TraceFrameAnnotation,
+    TraceFrameAnnotationText,
+    TraceFrameLeafAssoc,
+    TraceKind,
+)
+from ..prune import (
+    collect_annotation_texts,
+    collect_shared_texts,
+    delete_run,
+    incremental_vacuum,
+    runs_to_prune,
+)
+
+
+class PruneTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db = DB(DBType.SQLITE, os.path.join(self.tempdir.name, "test.db"))
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _save_run(self, age_in_days, message_contents):
+        with self.db.make_session() as session:
+            run_id = PrimaryKeyGenerator().reserve(session, [Run]).get(Run)
+            session.add(
+                Run(
+                    id=run_id,
+                    date=datetime.now() - timedelta(days=age_in_days),
+                    status=RunStatus.FINISHED,
+                )
+            )
+            session.commit()
+        self.db.attach_run(run_id, create=True)
+
+        bulk_saver = BulkSaver()
+        shared = SharedText.Record(
+            id=DBID(), contents="shared", kind=SharedTextKind.MESSAGE
+        )
+        message = SharedText.Record(
+            id=DBID(), contents=message_contents, kind=SharedTextKind.MESSAGE
+        )
+        issue = Issue.Record(
+            id=IssueDBID(),
+            handle="handle",
+            code=6016,
+            callable="module.function",
+            status="uncategorized",
+            first_seen=datetime.now(),
+        )
+        instance = IssueInstance.Record(
+            id=DBID(),
+            issue_id=issue.id,
+            location=SourceLocation(1, 2, 3),
+            filename="module.py",
+            run_id=run_id,
+            message_id=message.id,
+            min_trace_length_to_sources=1,
+            min_trace_length_to_sinks=1,
+            rank=0,
+            callable_count=1,
+            is_new_issue=False,
+        )
+        frame = TraceFrame.Record(
+            id=DBID(),
+            kind=TraceKind.POSTCONDITION,
+            caller="module.function",
+            caller_id=0,
+            caller_port="root",
+            callee="module.source",
+            callee_id=0,
+            callee_port="source",
+            callee_location=SourceLocation(1, 2, 3),
+            filename="module.py",
+            filename_id=0,
+            run_id=run_id,
+            type_interval_lower=0,
+            type_interval_upper=0,
+            migrated_id=None,
+            preserves_type_context=False,
+            titos=[],
+        )
+        bulk_saver.add_all([shared, message])
+        bulk_saver.add(issue)
+        bulk_saver.add(instance)
+        bulk_saver.add(frame)
+        bulk_saver.add(
+            IssueInstanceSharedTextAssoc.Record(
+                issue_instance_id=instance.id, shared_text_id=shared.id
+            )
+        )
+        bulk_saver.add(
+            IssueInstanceTraceFrameAssoc.Record(
+                issue_instance_id=instance.id, trace_frame_id=frame.id
+            )
+        )
+        bulk_saver.add(
+            TraceFrameLeafAssoc.Record(
+                trace_frame_id=frame.id, leaf_id=shared.id, trace_length=0
+            )
+        )
+        text = TraceFrameAnnotationText.Record(
+            id=DBID(), message=message_contents, link=None, trace_key=None
+        )
+        bulk_saver.add(text)
+        bulk_saver.add(
+            TraceFrameAnnotation.Record(
+                id=DBID(),
+                location=SourceLocation(1, 2, 3),
+                text_id=text.id,
+                trace_frame_id=frame.id,
+            )
+        )
+        bulk_saver.save_all(self.db)
+        return run_id
+
+    def testRunsToPrune(self):
+        old = self._save_run(30, "old")
+        older = self._save_run(60, "older")
+        new = self._save_run(0, "new")
+
+        with self.db.make_session() as session:
+            self.assertEqual(runs_to_prune(session, 10, None), [old, older])
+            self.assertEqual(runs_to_prune(session, None, 1), [old, older])
+            self.assertEqual(runs_to_prune(session, None, 5), [])
+            # Both policies have to match
+            self.assertEqual(runs_to_prune(session, 10, 2), [old])
+            self.assertEqual(runs_to_prune(session, 45, 1), [older])
+            self.assertEqual(runs_to_prune(session, 0, 0), [old, older, new])
+
+    def testDeleteEmptyRun(self):
+        with self.db.make_session() as session:
+            session.add(Run(id=1, date=datetime.now(), status=RunStatus.FINISHED))
+            session.commit()
+
+        counts = delete_run(self.db, 1, batch_size=1)
+        self.assertEqual(counts, {"warning_code_run_stats": 0, "runs": 1})
+        with self.db.make_session() as session:
+            self.assertEqual(session.query(Run).count(), 0)
+
+    def testCollectWithoutAnnotations(self):
+        self.assertEqual(collect_shared_texts(self.db, batch_size=1), 0)
+        self.assertEqual(collect_annotation_texts(self.db, batch_size=1), 0)
+
+    def _collect_while_saving(self, message_contents):
+        """Collects shared texts one id per batch, saving a run with
+        message_contents between the first two batches. The write lock has to
+        be free between batches, like a process saving a run would find it."""
+        write_lock = self.db.write_lock
+        batches = []
+
+        @contextmanager
+        def save_between_batches():
+            with open(self.db.dbname + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            if len(batches) == 1:
+                self._save_run(0, message_contents)
+            batches.append(len(batches))
+            with write_lock():
+                yield
+
+        with patch.object(self.db, "write_lock", save_between_batches):
+            collected = collect_shared_texts(self.db, batch_size=1)
+        self.assertGreater(len(batches), 2)
+        return collected
+
+    def testCollectChecksReferencesInEachBatch(self):
+        for partitioned in [False, True]:
+            with self.subTest(partitioned=partitioned):
+                self.db = DB(
+                    DBType.SQLITE,
+                    os.path.join(self.tempdir.name, f"{partitioned}.db"),
+                    partitioned=partitioned,
+                )
+                old = self._save_run(30, "old")
+                self._save_run(0, "new")
+                delete_run(self.db, old, batch_size=1)
+
+                # The run saved meanwhile reuses the message of the deleted one
+                self.assertEqual(self._collect_while_saving("old"), 0)
+                with self.db.make_session() as session:
+                    self.assertEqual(
+                        sorted(text.contents for text in session.query(SharedText)),
+                        ["new", "old", "shared"],
+                    )
+
+    def testDeleteRunAndCollectSharedTexts(self):
+        old = self._save_run(30, "old")
+        new = self._save_run(0, "new")
+
+        counts = delete_run(self.db, old, batch_size=1)
+        self.assertEqual(
+            counts,
+            {
+                "issue_instance_trace_frame_assoc": 1,
+                "issue_instance_feature_assoc": 1,
+                "shortest_traces": 0,
+                "issue_instance_fix_info": 0,
+                "issue_instances": 1,
+                "trace_frame_message_assoc": 1,
+                "trace_frame_annotations": 1,
+                "trace_frames": 1,
+                "warning_code_run_stats": 0,
+                "runs": 1,
+            },
+        )
+        with self.db.make_session() as session:
+            self.assertEqual([int(run.id) for run in session.query(Run)], [new])
+            self.assertEqual(session.query(IssueInstance).count(), 1)
+            self.assertEqual(session.query(TraceFrame).count(), 1)
+            # Issues outlive runs
+            self.assertEqual(session.query(Issue).count(), 1)
+
+        self.assertEqual(collect_shared_texts(self.db, batch_size=1), 1)
+        with self.db.make_session() as session:
+            self.assertEqual(
+                sorted(text.contents for text in session.query(SharedText)),
+                ["new", "shared"],
+            )
+
+        self.assertEqual(collect_annotation_texts(self.db, batch_size=1), 1)
+        with self.db.make_session() as session:
+            self.assertEqual(
+                [text.message for text in session.query(TraceFrameAnnotationText)],
+                ["new"],
+            )
+
+        self.assertEqual(incremental_vacuum(self.db), 0)
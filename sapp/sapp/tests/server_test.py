@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from ..db import DB, DBType
+from ..models import (
+    Issue,
+    IssueInstance,
+    IssueInstanceSharedTextAssoc,
+    IssueInstanceTraceFrameAssoc,
+    Run,
+    RunStatus,
+    SharedText,
+    SharedTextKind,
+    SourceLocation,
+    TraceFrame,
+    TraceFrameLeafAssoc,
+    TraceKind,
+)
+from ..server import QueryServer
+
+
+class QueryServerTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        dbname = os.path.join(self.tempdir.name, "sapp.db")
+        db = DB(DBType.SQLITE, dbname)
+        with db.make_session() as session:
+            session.add(Run(id=1, date=datetime.now(), status=RunStatus.FINISHED))
+            session.add(
+                SharedText(id=1, contents="message", kind=SharedTextKind.MESSAGE)
+            )
+            session.add(SharedText(id=2, contents="source", kind=SharedTextKind.SOURCE))
+            for id in range(1, 4):
+                session.add(
+                    Issue(
+                        id=id,
+                        handle=f"handle{id}",
+                        code=6000 + id,
+                        callable=f"module.function{id}",
+                        first_seen=datetime.now(),
+                    )
+                )
+                session.add(
+                    IssueInstance(
+                        id=id,
+                        location=SourceLocation(id, 1, 2),
+                        filename="module.py",
+                        run_id=1,
+                        issue_id=id,
+                        message_id=1,
+                    )
+                )
+            for id, caller, callee, callee_port in [
+                (1, "module.function1", "module.helper", "result"),
+                (2, "module.helper", "module.source", "source"),
+            ]:
+                session.add(
+                    TraceFrame(
+                        id=id,
+                        kind=TraceKind.POSTCONDITION,
+                        caller=caller,
+                        caller_port="root" if id == 1 else "result",
+                        callee=callee,
+                        callee_port=callee_port,
+                        callee_location=SourceLocation(id, 1, 2),
+                        filename="module.py",
+                        run_id=1,
+                    )
+                )
+                session.add(
+                    TraceFrameLeafAssoc(trace_frame_id=id, leaf_id=2, trace_length=0)
+                )
+            session.add(
+                IssueInstanceTraceFrameAssoc(issue_instance_id=1, trace_frame_id=1)
+            )
+            session.add(
+                IssueInstanceSharedTextAssoc(issue_instance_id=1, shared_text_id=2)
+            )
+            session.commit()
+
+        self.server = QueryServer(("localhost", 0), dbname)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.tempdir.cleanup()
+
+    def _get(self, path: str) -> bytes:
+        host, port = self.server.server_address
+        with urlopen(f"http://{host}:{port}{path}") as response:
+            return response.read()
+
+    def _status(self, path: str) -> int:
+        with self.assertRaises(HTTPError) as context:
+            self._get(path)
+        return context.exception.code
+
+    def testIssues(self):
+        page = json.loads(self._get("/runs/1/issues?limit=2"))
+        self.assertEqual([issue["id"] for issue in page["items"]], [1, 2])
+        page = json.loads(self._get(f"/runs/1/issues?limit=2&after={page['after']}"))
+        self.assertEqual([issue["id"] for issue in page["items"]], [3])
+        self.assertIsNone(page["after"])
+
+        page = json.loads(self._get("/runs/1/issues?code=6001&code=6003"))
+        self.assertEqual([issue["id"] for issue in page["items"]], [1, 3])
+        page = json.loads(self._get("/runs/1/issues?callable=%25function2"))
+        self.assertEqual([issue["id"] for issue in page["items"]], [2])
+
+        lines = self._get("/runs/1/issues?stream=1").splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [1, 2, 3])
+
+        issue = json.loads(self._get("/runs/1/issues/1"))
+        self.assertEqual(issue["code"], 6001)
+        self.assertEqual(issue["message"], "message")
+        self.assertEqual(issue["sources"], ["source"])
+
+    def testTrace(self):
+        trace = json.loads(self._get("/runs/1/issues/1/trace"))
+        self.assertEqual(
+            [
+                (frame["id"], frame["branches"])
+                for frame in trace["postcondition"]["frames"]
+            ],
+            [(1, 1), (2, 1)],
+        )
+        self.assertTrue(trace["postcondition"]["complete"])
+        self.assertEqual(trace["precondition"]["frames"], [])
+
+    def testFrames(self):
+        page = json.loads(
+            self._get("/runs/1/frames?kind=postcondition&caller=module.helper")
+        )
+        self.assertEqual([frame["id"] for frame in page["items"]], [2])
+        frame = json.loads(self._get("/runs/1/frames/2"))
+        self.assertEqual(frame["leaves"], [{"name": "source", "trace_length": 0}])
+        parents = json.loads(self._get("/runs/1/frames/2/parents"))
+        self.assertEqual([frame["id"] for frame in parents["items"]], [1])
+
+    def testErrors(self):
+        self.assertEqual(self._status("/runs/2/issues"), 404)
+        self.assertEqual(self._status("/runs/1/issues/9"), 404)
+        self.assertEqual(self._status("/runs/1/issues?code=x"), 400)
+        self.assertEqual(self._status("/runs/1/frames?kind=x&stream=1"), 400)
+        self.assertEqual(self._status("/runs/1/issues/1?stream=1"), 400)
+        self.assertEqual(self._status("/unknown"), 404)
+        with self.assertRaises(HTTPError) as context:
+            self._get("/unknown")
+        self.assertEqual(
+            json.loads(context.exception.read()),
+            {"error": "No such endpoint: /unknown"},
+        )
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from ..db import DB, DBType
+from ..models import (
+    Issue,
+    IssueInstance,
+    Run,
+    RunStatus,
+    SharedText,
+    SharedTextKind,
+    SourceLocation,
+    TraceFrame,
+    TraceKind,
+)
+from ..snapshot import snapshot
+
+
+class SnapshotTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _db(self, name, **kwargs):
+        db = DB(DBType.SQLITE, os.path.join(self.tempdir.name, name), **kwargs)
+        with db.make_session() as session:
+            session.add(
+                SharedText(id=1, contents="via tito", kind=SharedTextKind.FEATURE)
+            )
+            session.commit()
+        for run_id in [1, 2]:
+            db.attach_run(run_id, create=True)
+            with db.make_session() as session:
+                session.add(
+                    Run(id=run_id, date=datetime.now(), status=RunStatus.FINISHED)
+                )
+                session.add(
+                    Issue(
+                        id=run_id,
+                        handle=f"handle{run_id}",
+                        code=6016,
+                        callable="module.function",
+                        first_seen=datetime.now(),
+                    )
+                )
+                session.add(
+                    IssueInstance(
+                        id=run_id,
+                        location=SourceLocation(run_id, 1, 2),
+                        filename="module.py",
+                        run_id=run_id,
+                        issue_id=run_id,
+                    )
+                )
+                session.add(
+                    TraceFrame(
+                        id=run_id,
+                        kind=TraceKind.POSTCONDITION,
+                        caller="caller",
+                        callee="callee",
+                        callee_location=SourceLocation(run_id, 1, 2),
+                        filename="module.py",
+                        run_id=run_id,
+                    )
+                )
+                session.commit()
+        return db
+
+    def _contents(self, db):
+        with db.make_session() as session:
+            return {
+                model.__name__: sorted(int(row.id) for row in session.query(model))
+                for model in [Run, Issue, IssueInstance, TraceFrame, SharedText]
+            }
+
+    def testCopyDatabase(self):
+        for partitioned in [False, True]:
+            with self.subTest(partitioned=partitioned):
+                db = self._db(f"copy{partitioned}.db", partitioned=partitioned)
+                progress = []
+                memory = snapshot(
+                    db,
+                    progress=lambda done, total, steps=progress: steps.append(
+                        (done, total)
+                    ),
+                )
+                self.assertEqual(memory.dbtype, DBType.MEMORY)
+                self.assertEqual(
+                    self._contents(memory),
+                    {
+                        "Run": [1, 2],
+                        "Issue": [1, 2],
+                        "IssueInstance": [1, 2],
+                        "TraceFrame": [1, 2],
+                        "SharedText": [1],
+                    },
+                )
+                self.assertEqual(progress[-1][0], progress[-1][1])
+
+    def testCopyRun(self):
+        for partitioned in [False, True]:
+            with self.subTest(partitioned=partitioned):
+                db = self._db(f"run{partitioned}.db", partitioned=partitioned)
+                memory = snapshot(db, run_id=2)
+                self.assertEqual(
+                    self._contents(memory),
+                    {
+                        "Run": [2],
+                        "Issue": [2],
+                        "IssueInstance": [2],
+                        "TraceFrame": [2],
+                        "SharedText": [1],
+                    },
+                )
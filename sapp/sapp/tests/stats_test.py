@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+import numpy as np
+
+from ..db import DB, DBType
+from ..models import (
+    Issue,
+    IssueInstance,
+    Run,
+    RunStatus,
+    SharedText,
+    SharedTextKind,
+    SourceLocation,
+    TraceFrame,
+    TraceKind,
+)
+from ..stats import distribution, run_stats
+
+
+class StatsTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db = DB(DBType.SQLITE, os.path.join(self.tempdir.name, "test.db"))
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def testDistribution(self):
+        stats = distribution(np.array([1, 1, 2, 4, 10]), bins=3)
+        self.assertEqual(stats["count"], 5)
+        self.assertEqual((stats["min"], stats["max"]), (1, 10))
+        self.assertEqual(stats["mean"], 3.6)
+        self.assertEqual(stats["percentiles"]["p50"], 2.0)
+        self.assertEqual([count for _, _, count in stats["histogram"]], [4, 0, 1])
+        self.assertEqual(distribution(np.array([], dtype=np.int64)), {"count": 0})
+
+    def testRunStats(self):
+        with self.db.make_session() as session:
+            session.add(Run(id=1, date=datetime(2020, 1, 1), status=RunStatus.FINISHED))
+            for id, contents in [(1, "module.f"), (2, "module.g"), (3, "module.py")]:
+                session.add(
+                    SharedText(id=id, contents=contents, kind=SharedTextKind.CALLABLE)
+                )
+            for id, code, callable_id, fwd_trace_len in [
+                (1, 6016, 1, 1),
+                (2, 6016, 1, 3),
+                (3, 5000, 2, None),
+            ]:
+                session.add(
+                    Issue(
+                        id=id,
+                        handle=f"handle{id}",
+                        code=code,
+                        callable=f"callable{id}",
+                        status="uncategorized",
+                        first_seen=datetime(2020, 1, 1),
+                    )
+                )
+                session.add(
+                    IssueInstance(
+                        id=id,
+                        location=SourceLocation(1, 2, 3),
+                        filename="module.py",
+                        filename_id=3,
+                        callable_id=callable_id,
+                        run_id=1,
+                        issue_id=id,
+                        message_id=1,
+                        min_trace_length_to_sources=fwd_trace_len,
+                        min_trace_length_to_sinks=2,
+                    )
+                )
+            for id, caller_id in [(1, 1), (2, 1), (3, 1), (4, 2)]:
+                session.add(
+                    TraceFrame(
+                        id=id,
+                        kind=TraceKind.POSTCONDITION,
+                        caller="",
+                        caller_id=caller_id,
+                        caller_port="root",
+                        callee="callee",
+                        callee_location=SourceLocation(1, 2, 3),
+                        callee_port="source",
+                        filename="module.py",
+                        filename_id=3,
+                        run_id=1,
+                        titos=[],
+                    )
+                )
+            session.commit()
+
+        stats = run_stats(self.db, 1, top=1)
+        self.assertEqual(sorted(stats["trace_lengths"]), [5000, 6016])
+        forward = stats["trace_lengths"][6016]["forward"]
+        self.assertEqual((forward["count"], forward["min"], forward["max"]), (2, 1, 3))
+        # Missing trace lengths count as 0
+        self.assertEqual(stats["trace_lengths"][5000]["forward"]["max"], 0)
+
+        self.assertEqual(stats["issues_per_callable"]["count"], 2)
+        self.assertEqual(
+            stats["issues_per_callable"]["top"], [{"name": "module.f", "count": 2}]
+        )
+        self.assertEqual(
+            stats["fanout_per_caller"]["top"], [{"name": "module.f", "count": 3}]
+        )
+        self.assertEqual(
+            stats["frames_per_file"]["top"], [{"name": "module.py", "count": 4}]
+        )
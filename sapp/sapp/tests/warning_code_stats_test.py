@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from ..db import DB, DBType
+from ..models import (
+    DBID,
+    Issue,
+    IssueDBID,
+    IssueInstance,
+    Run,
+    RunStatus,
+    WarningCodeProperties,
+    WarningCodeRunStats,
+    WarningCodeTotals,
+)
+from ..warning_code_stats import RunStatsCollector, remove_run, rollup
+
+
+class WarningCodeStatsTest(TestCase):
+    def setUp(self) -> None:
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db = DB(DBType.SQLITE, os.path.join(self.tempdir.name, "test.db"))
+
+    def tearDown(self) -> None:
+        self.tempdir.cleanup()
+
+    def _issue(self, code, is_new):
+        issue = Issue.Record(id=IssueDBID(), code=code)
+        issue.id.resolve(id=1, is_new=is_new)
+        return issue
+
+    def _instance(self, issue, fwd_trace_len, bwd_trace_len):
+        return IssueInstance.Record(
+            id=DBID(),
+            issue_id=issue.id,
+            min_trace_length_to_sources=fwd_trace_len,
+            min_trace_length_to_sinks=bwd_trace_len,
+        )
+
+    def _add_run(self, session, id, day, status=RunStatus.FINISHED, **counts):
+        session.add(Run(id=id, date=datetime(2020, 1, day), status=status))
+        for code, (issue_count, new_issue_count) in counts.items():
+            session.add(
+                WarningCodeRunStats(
+                    run_id=id,
+                    code=int(code[1:]),
+                    issue_count=issue_count,
+                    new_issue_count=new_issue_count,
+                    fwd_trace_len_sum=issue_count * 2,
+                    fwd_trace_len_count=issue_count,
+                    bwd_trace_len_sum=issue_count * 4,
+                    bwd_trace_len_count=issue_count,
+                )
+            )
+
+    def testCollector(self):
+        old, new, other = (
+            self._issue(6016, False),
+            self._issue(6016, True),
+            self._issue(5000, True),
+        )
+        collector = RunStatsCollector(
+            [old, new, other],
+            [
+                self._instance(old, 1, 2),
+                self._instance(new, 3, None),
+                self._instance(other, 0, 5),
+            ],
+        )
+        self.assertEqual(
+            [
+                (
+                    stats.code,
+                    stats.issue_count,
+                    stats.new_issue_count,
+                    stats.fwd_trace_len_sum,
+                    stats.fwd_trace_len_count,
+                    stats.bwd_trace_len_sum,
+                    stats.bwd_trace_len_count,
+                )
+                for stats in collector.stats(run_id=7)
+            ],
+            # Missing trace lengths aren't counted
+            [(5000, 1, 1, 0, 1, 5, 1), (6016, 2, 1, 4, 2, 2, 1)],
+        )
+
+    def testRollup(self):
+        with self.db.make_session() as session:
+            self._add_run(session, 1, 1, c6016=(4, 4), c5000=(2, 2))
+            self._add_run(session, 2, 3, c6016=(5, 1))
+            self._add_run(session, 3, 5, c6016=(6, 2))
+            # Neither the stats of unfinished runs count, nor does it count as
+            # the latest run
+            self._add_run(session, 4, 6, status=RunStatus.INCOMPLETE, c6016=(9, 9))
+            session.add(WarningCodeProperties(code=5000, snr=0.5, bug_count=2))
+            session.commit()
+
+            self.assertEqual(rollup(session), 2)
+            properties = {
+                properties.code: properties
+                for properties in session.query(WarningCodeProperties)
+            }
+            self.assertEqual(properties[6016].bug_count, 6)
+            self.assertEqual(properties[6016].new_issue_rate, 3 / 4)
+            self.assertEqual(properties[6016].avg_fwd_trace_len, 2.0)
+            self.assertEqual(properties[6016].avg_bwd_trace_len, 4.0)
+            self.assertEqual(properties[5000].bug_count, 0)
+            self.assertEqual(properties[5000].new_issue_rate, 0.0)
+            self.assertEqual(properties[5000].snr, 0.5)
+
+    def testRollupIsIncremental(self):
+        with self.db.make_session() as session:
+            self._add_run(session, 1, 1, c6016=(4, 4))
+            self._add_run(session, 2, 3, c6016=(2, 1))
+            session.commit()
+            self.assertEqual(rollup(session), 1)
+
+            self._add_run(session, 3, 5, c6016=(6, 3))
+            session.add(
+                WarningCodeRunStats(
+                    run_id=3,
+                    code=5000,
+                    issue_count=2,
+                    new_issue_count=2,
+                    fwd_trace_len_sum=0,
+                    fwd_trace_len_count=0,
+                    bwd_trace_len_sum=3,
+                    bwd_trace_len_count=1,
+                )
+            )
+            session.commit()
+            self.assertEqual(rollup(session), 2)
+            totals = session.query(WarningCodeTotals).get(6016)
+            self.assertEqual((totals.issue_count, totals.new_issue_count), (12, 8))
+            properties = {
+                properties.code: properties
+                for properties in session.query(WarningCodeProperties)
+            }
+            self.assertEqual(properties[6016].bug_count, 6)
+            self.assertEqual(properties[6016].new_issue_rate, 4 / 4)
+            self.assertEqual(properties[6016].avg_fwd_trace_len, 2.0)
+            self.assertIsNone(properties[5000].avg_fwd_trace_len)
+            self.assertEqual(properties[5000].avg_bwd_trace_len, 3.0)
+
+            # Deleted runs are taken out of the totals again
+            remove_run(session, 1)
+            session.query(WarningCodeRunStats).filter(
+                WarningCodeRunStats.run_id == 1
+            ).delete()
+            session.query(Run).filter(Run.id == 1).delete()
+            session.commit()
+            self.assertEqual(rollup(session), 2)
+            self.assertEqual((totals.issue_count, totals.new_issue_count), (8, 4))
+            self.assertEqual(properties[6016].new_issue_rate, 3 / 2)
+
+    def testRollupWithoutRuns(self):
+        with self.db.make_session() as session:
+            self.assertEqual(rollup(session), 0)
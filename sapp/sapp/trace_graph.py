@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # pyre-strict
 
-from collections import defaultdict
-from typing import DefaultDict, Dict, Iterable, List, Optional, Set, Tuple
+from collections import defaultdict, deque
+from typing import DefaultDict, Deque, Dict, Iterable, List, Optional, Set, Tuple
 
 from .bulk_saver import BulkSaver
 from .models import (
@@ -12,8 +12,10 @@ from .models import (
     IssueInstanceFixInfo,
     SharedText,
     SharedTextKind,
+    SourceLocation,
     TraceFrame,
     TraceFrameAnnotation,
+    TraceFrameAnnotationText,
     TraceKind,
 )
 
@@ -26,10 +28,18 @@ class TraceGraph(object):
     'callee->caller' gives the reverse edge.
     """
 
+    # Callee ports of trace frames that end in a source or sink
+    LEAF_NAMES = {"source", "sink", "leaf"}
+
     def __init__(self) -> None:
         self._issues: Dict[int, Issue] = {}
         self._issue_instances: Dict[int, IssueInstance] = {}
         self._trace_annotations: Dict[int, TraceFrameAnnotation] = {}
+        # Annotation texts by (message, link, trace_key), see
+        # get_or_add_annotation_text
+        self._annotation_texts: Dict[
+            Tuple[str, str, str], TraceFrameAnnotationText
+        ] = {}
 
         # Create a mapping of (caller, caller_port) to the corresponding
         # trace frame's id.
@@ -135,6 +145,18 @@ class TraceGraph(object):
     def add_trace_annotation(self, annotation: TraceFrameAnnotation) -> None:
         self._trace_annotations[annotation.id.local_id] = annotation
 
+    def get_or_add_annotation_text(
+        self, message: str, link: Optional[str], trace_key: Optional[str]
+    ) -> TraceFrameAnnotationText:
+        """Annotations with the same text share a single record of it."""
+        key = (message, link or "", trace_key or "")
+        text = self._annotation_texts.get(key)
+        if text is None:
+            text = self._annotation_texts[key] = TraceFrameAnnotationText.Record(
+                id=DBID(), message=message, link=link, trace_key=trace_key
+            )
+        return text
+
     def get_precondition_annotations(self, pre_id: int) -> List[TraceFrameAnnotation]:
         return [
             t
@@ -234,12 +256,123 @@ class TraceGraph(object):
             if self._shared_texts[msg_id].kind == kind
         ]
 
+    def get_shortest_trace(
+        self, instance: IssueInstance, kind: TraceKind
+    ) -> Tuple[List[TraceFrame], List[int]]:
+        """Finds the trace `sapp explore` shows first for the instance, with a
+        breadth first search from its initial trace frames to a leaf. Returns
+        the trace frames along with how many there were to choose from at each
+        step. If no leaf can be reached, follows the closest trace frames until
+        the trace breaks off.
+        """
+        leaf_kind = (
+            SharedTextKind.SOURCE
+            if kind == TraceKind.POSTCONDITION
+            else SharedTextKind.SINK
+        )
+        leaf_ids = {
+            leaf.id.local_id
+            for leaf in self.get_issue_instance_shared_texts(
+                instance.id.local_id, leaf_kind
+            )
+        }
+        initial_trace_frames = sorted(
+            (
+                trace_frame
+                for trace_frame in self.get_issue_instance_trace_frames(instance)
+                if trace_frame.kind == kind
+                and self._trace_frame_leaf_assoc.get(trace_frame.id.local_id)
+            ),
+            key=self._trace_frame_order,
+        )
+        if not initial_trace_frames:
+            return [], []
+
+        parents: Dict[int, Optional[TraceFrame]] = {
+            trace_frame.id.local_id: None for trace_frame in initial_trace_frames
+        }
+        queue: Deque[TraceFrame] = deque(initial_trace_frames)
+        trace: List[TraceFrame] = []
+        while queue:
+            trace_frame = queue.popleft()
+            if trace_frame.callee_port in self.LEAF_NAMES:
+                node: Optional[TraceFrame] = trace_frame
+                while node is not None:
+                    trace.append(node)
+                    node = parents[node.id.local_id]
+                trace.reverse()
+                break
+            for next_frame in self._next_trace_frames(trace_frame, leaf_ids):
+                if next_frame.id.local_id not in parents:
+                    parents[next_frame.id.local_id] = trace_frame
+                    queue.append(next_frame)
+
+        if not trace:
+            visited: Set[int] = set()
+            next_frames = initial_trace_frames[:1]
+            while next_frames and next_frames[0].id.local_id not in visited:
+                trace.append(next_frames[0])
+                visited.add(next_frames[0].id.local_id)
+                next_frames = self._next_trace_frames(next_frames[0], leaf_ids)
+
+        branches = [len(initial_trace_frames)] + [
+            len(self._next_trace_frames(trace_frame, leaf_ids))
+            for trace_frame in trace[:-1]
+        ]
+        return trace, branches
+
+    def _next_trace_frames(
+        self, trace_frame: TraceFrame, leaf_ids: Set[int]
+    ) -> List[TraceFrame]:
+        """The trace frames called by trace_frame that lead to one of the
+        leaves, closest first."""
+        if trace_frame.callee_port in self.LEAF_NAMES:
+            return []
+        next_ids = self._trace_frames_map.get(
+            (trace_frame.callee, trace_frame.callee_port), set()
+        )
+        return sorted(
+            (
+                next_frame
+                for next_frame in map(self._trace_frames.get, next_ids)
+                if next_frame is not None
+                and next_frame.kind == trace_frame.kind
+                and next_frame.caller != next_frame.callee
+                and leaf_ids.intersection(
+                    leaf_id
+                    for leaf_id, _depth in self._trace_frame_leaf_assoc.get(
+                        next_frame.id.local_id, ()
+                    )
+                )
+            ),
+            key=self._trace_frame_order,
+        )
+
+    def _trace_frame_order(self, trace_frame: TraceFrame) -> Tuple[int, int, int]:
+        """Orders trace frames like `sapp explore` does. Trace frames are saved
+        in the order of their local ids, so the last key is the order of their
+        ids in the database."""
+        depths = [
+            depth
+            for _leaf_id, depth in self._trace_frame_leaf_assoc.get(
+                trace_frame.id.local_id, ()
+            )
+        ]
+        return (
+            min(depths, default=0),
+            SourceLocation.to_int(trace_frame.callee_location),
+            trace_frame.id.local_id,
+        )
+
     def update_bulk_saver(self, bulk_saver: BulkSaver) -> None:
         bulk_saver.add_all(list(self._issues.values()))
         bulk_saver.add_all(list(self._issue_instances.values()))
-        bulk_saver.add_all(list(self._trace_frames.values()))
+        bulk_saver.add_all(
+            [self._trace_frames[id] for id in sorted(self._trace_frames)]
+        )
         bulk_saver.add_all(list(self._issue_instance_fix_info.values()))
         bulk_saver.add_all(list(self._trace_annotations.values()))
+        bulk_saver.add_all(list(self._annotation_texts.values()))
         bulk_saver.add_all(list(self._shared_texts.values()))
 
         self._save_issue_instance_trace_frame_assoc(bulk_saver)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Per run counts of the issue instances of each warning code, and the computed
+columns of WarningCodeProperties rolled up from them.
+
+The counts of a run are taken from its records while it is saved, and stored
+as WarningCodeRunStats. The rollup adds the stats of runs finished since the
+last rollup to WarningCodeTotals, and computes the columns from those, so
+neither it nor dashboards have to scan issue_instances or all past stats.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import click
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from .models import (
+    Issue,
+    IssueInstance,
+    Run,
+    RunStatus,
+    WarningCodeProperties,
+    WarningCodeRunStats,
+    WarningCodeTotals,
+)
+
+
+log = logging.getLogger("sapp")
+
+
+# The counts that add up over runs
+SUMMED_COLUMNS = [
+    "issue_count",
+    "new_issue_count",
+    "fwd_trace_len_sum",
+    "fwd_trace_len_count",
+    "bwd_trace_len_sum",
+    "bwd_trace_len_count",
+]
+
+
+class RunStatsCollector:
+    """Collects the counts of a run from the records about to be saved."""
+
+    def __init__(self, issues: Iterable, issue_instances: Iterable) -> None:
+        codes = {issue.id.local_id: issue.code for issue in issues}
+        self.instances = [
+            (
+                codes[instance.issue_id.local_id],
+                instance.issue_id,
+                instance.min_trace_length_to_sources,
+                instance.min_trace_length_to_sinks,
+            )
+            for instance in issue_instances
+        ]
+
+    def stats(self, run_id: int) -> List[WarningCodeRunStats]:
+        """Only complete after the run is saved, since merging the issues
+        with the existing ones tells which are new."""
+        stats: Dict[int, WarningCodeRunStats] = {}
+        for code, issue_id, fwd_trace_len, bwd_trace_len in self.instances:
+            code_stats = stats.get(code)
+            if code_stats is None:
+                code_stats = stats[code] = WarningCodeRunStats(
+                    run_id=run_id,
+                    code=code,
+                    **{column: 0 for column in SUMMED_COLUMNS},
+                )
+            code_stats.issue_count += 1
+            # Like IssueInstance.merge sets is_new_issue
+            code_stats.new_issue_count += 1 if issue_id.is_new else 0
+            # Instances without a trace length don't count towards the average
+            if fwd_trace_len is not None:
+                code_stats.fwd_trace_len_sum += fwd_trace_len
+                code_stats.fwd_trace_len_count += 1
+            if bwd_trace_len is not None:
+                code_stats.bwd_trace_len_sum += bwd_trace_len
+                code_stats.bwd_trace_len_count += 1
+        return sorted(stats.values(), key=lambda code_stats: code_stats.code)
+
+    def add(self, session: Session, run_id: int) -> List[WarningCodeRunStats]:
+        stats = self.stats(run_id)
+        session.add_all(stats)
+        return stats
+
+
+def _add_to_totals(
+    totals: WarningCodeTotals, stats: WarningCodeRunStats, sign: int = 1
+) -> None:
+    for column in SUMMED_COLUMNS:
+        setattr(totals, column, getattr(totals, column) + sign * getattr(stats, column))
+
+
+def rollup(session: Session) -> int:
+    """Adds the stats of the runs finished since the last rollup to the
+    totals, recomputes the computed columns of WarningCodeProperties from
+    them, and returns the number of codes updated.
+
+    bug_count is the number of issue instances in the latest run. New issues
+    per day don't count the first run, where every issue is new.
+    """
+    stats = WarningCodeRunStats
+    finished_runs = session.query(Run.id).filter(Run.status == RunStatus.FINISHED)
+    totals = {totals.code: totals for totals in session.query(WarningCodeTotals)}
+    for run_stats in (
+        session.query(stats)
+        .filter(stats.run_id.in_(finished_runs))
+        .filter(stats.rolled_up.is_(False))
+    ):
+        code_totals = totals.get(run_stats.code)
+        if code_totals is None:
+            code_totals = totals[run_stats.code] = WarningCodeTotals(
+                code=run_stats.code, **{column: 0 for column in SUMMED_COLUMNS}
+            )
+            session.add(code_totals)
+        _add_to_totals(code_totals, run_stats)
+        run_stats.rolled_up = True
+    session.flush()
+
+    rolled_up_runs = (
+        session.query(Run.id, Run.date)
+        .filter(Run.status == RunStatus.FINISHED)
+        .filter(Run.id.in_(session.query(stats.run_id).filter(stats.rolled_up)))
+    )
+    first_run = rolled_up_runs.order_by(Run.id).first()
+    if first_run is None:
+        session.commit()
+        return 0
+    latest_run = rolled_up_runs.order_by(Run.id.desc()).first()
+    days = max((latest_run.date - first_run.date).total_seconds() / 86400, 1.0)
+
+    first_new_counts = dict(
+        session.query(stats.code, stats.new_issue_count).filter(
+            stats.run_id == first_run.id
+        )
+    )
+    latest_counts = dict(
+        session.query(stats.code, stats.issue_count).filter(
+            stats.run_id == latest_run.id
+        )
+    )
+
+    properties = {
+        properties.code: properties
+        for properties in session.query(WarningCodeProperties)
+    }
+    for code, code_totals in totals.items():
+        code_properties = properties.get(code)
+        if code_properties is None:
+            code_properties = properties[code] = WarningCodeProperties(code=code)
+            session.add(code_properties)
+        code_properties.new_issue_rate = (
+            code_totals.new_issue_count - first_new_counts.get(code, 0)
+        ) / days
+        code_properties.avg_fwd_trace_len = _average(
+            code_totals.fwd_trace_len_sum, code_totals.fwd_trace_len_count
+        )
+        code_properties.avg_bwd_trace_len = _average(
+            code_totals.bwd_trace_len_sum, code_totals.bwd_trace_len_count
+        )
+    for code, code_properties in properties.items():
+        code_properties.bug_count = latest_counts.get(code, 0)
+    session.commit()
+    return len(totals)
+
+
+def _average(total: int, count: int) -> Optional[float]:
+    return total / count if count else None
+
+
+def remove_run(session: Session, run_id: int) -> None:
+    """Takes the stats of a run that is about to be deleted out of the
+    totals, so that they stay the sums of the remaining runs."""
+    for run_stats in (
+        session.query(WarningCodeRunStats)
+        .filter(WarningCodeRunStats.run_id == run_id)
+        .filter(WarningCodeRunStats.rolled_up)
+    ):
+        code_totals = session.query(WarningCodeTotals).get(run_stats.code)
+        if code_totals is not None:
+            _add_to_totals(code_totals, run_stats, sign=-1)
+
+
+def _runs_without_stats(table: str) -> str:
+    return (
+        f"SELECT id FROM {Run.__tablename__} "
+        f"WHERE status = '{RunStatus.FINISHED.name}' "
+        f"AND id NOT IN (SELECT run_id FROM {WarningCodeRunStats.__tablename__}) "
+        f"AND EXISTS (SELECT 1 FROM {table} WHERE run_id = {Run.__tablename__}.id)"
+    )
+
+
+def has_runs_without_stats(connection: Connection) -> bool:
+    return (
+        connection.execute(
+            _runs_without_stats(IssueInstance.__tablename__) + " LIMIT 1"
+        ).scalar()
+        is not None
+    )
+
+
+def backfill(connection: Connection) -> None:
+    """Takes the stats of finished runs saved before stats were kept."""
+    instances, issues = IssueInstance.__tablename__, Issue.__tablename__
+    connection.execute(
+        f"INSERT INTO {WarningCodeRunStats.__tablename__} "
+        "(run_id, code, issue_count, new_issue_count, "
+        "fwd_trace_len_sum, fwd_trace_len_count, "
+        "bwd_trace_len_sum, bwd_trace_len_count) "
+        f"SELECT i.run_id, {issues}.code, COUNT(*), "
+        "SUM(CASE WHEN i.is_new_issue THEN 1 ELSE 0 END), "
+        "COALESCE(SUM(i.min_trace_length_to_sources), 0), "
+        "COUNT(i.min_trace_length_to_sources), "
+        "COALESCE(SUM(i.min_trace_length_to_sinks), 0), "
+        "COUNT(i.min_trace_length_to_sinks) "
+        f"FROM {instances} i JOIN {issues} ON {issues}.id = i.issue_id "
+        f"WHERE i.run_id IN ({_runs_without_stats(instances)}) "
+        f"GROUP BY i.run_id, {issues}.code"
+    )
+
+
+@click.command(name="rollup")
+@click.pass_context
+def rollup_command(click_ctx: click.Context) -> None:
+    """Update the computed columns of warning code properties"""
+    with click_ctx.obj.database.make_session() as session:
+        count = rollup(session)
+    click.echo(f"Updated {count} warning codes")